@@ -1,8 +1,16 @@
-import os, sys, time, math, signal, pathlib, datetime as dt
-from typing import List, Tuple, Dict, Iterable
+import os, sys, time, math, signal, pathlib, threading, datetime as dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple, Dict
 import orjson as jsonf
 from python_bitvavo_api.bitvavo import Bitvavo
 
+from tradingbot_ingest.backfill import Checkpoint, closed_until, jsonl_open_times, missing_ranges, split_ranges
+from tradingbot_ingest.ratelimit import bucket_from_env
+from tradingbot_storage.manifest import Manifest
+from tradingbot_storage.parquet_sink import write_partition
+from tradingbot_storage.reader import load as load_history
+from tradingbot_storage.schemas import build_table
+
 CONF = {
   "PARQUET_DIR": os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet"),
   "BACKFILL_INTERVALS": os.getenv("BACKFILL_INTERVALS", "1m,5m,1h"),
@@ -11,9 +19,16 @@ CONF = {
   "BACKFILL_HOURS": int(os.getenv("BACKFILL_HOURS", "24")),
   "BACKFILL_START": os.getenv("BACKFILL_START", ""),             # bv. "2025-10-28 00:00:00"
   "BACKFILL_END": os.getenv("BACKFILL_END", ""),                 # bv. "2025-10-29 00:00:00"
-  # Rate-limit besturing
-  "RATE_MIN": int(os.getenv("RATE_MIN", "200")),                 # wacht als remaining < RATE_MIN
-  "SLEEP_BETWEEN_CALLS": float(os.getenv("SLEEP_BETWEEN_CALLS", "0.05")),
+  # Parallelle (market, interval)-jobs; het gewichtsbudget bewaakt de token bucket
+  "BACKFILL_WORKERS": int(os.getenv("BACKFILL_WORKERS", "8")),
+  "BACKFILL_RETRIES": int(os.getenv("BACKFILL_RETRIES", "3")),
+  # Checkpoints per (market, interval): al opgevraagde ranges worden niet opnieuw gehaald
+  "BACKFILL_STATE_DIR": os.getenv("BACKFILL_STATE_DIR", ""),     # default <PARQUET_DIR>/_backfill
+  "BACKFILL_FORCE": os.getenv("BACKFILL_FORCE", "0") in ("1", "true", "yes"),  # checkpoints negeren (dedup blijft)
+  # parquet: getypte OHLCV in <dag>/candles:<interval>/ (zelfde layout als live); jsonl: oude layout; both
+  "BACKFILL_FORMAT": os.getenv("BACKFILL_FORMAT", "parquet"),
+  # Rate-limit besturing: RATE_BUDGET_PER_MIN gewicht/min per key, RATE_MIN blijft vrij voor andere processen
+  "RATE_MIN": int(os.getenv("RATE_MIN", "200")),
   # API keys zijn optioneel voor public endpoints; met key kun je vaak meer headroom krijgen
   "BITVAVO_API_KEY": os.getenv("BITVAVO_API_KEY", ""),
   "BITVAVO_API_SECRET": os.getenv("BITVAVO_API_SECRET", ""),
@@ -51,35 +66,75 @@ def ensure_day_dir(interval: str, when_ms: int) -> pathlib.Path:
 def out_file(interval: str, market: str, when_ms: int) -> pathlib.Path:
   return ensure_day_dir(interval, when_ms) / f"{market.replace('/', '-')}.jsonl"
 
-def chunk_ranges(interval: str, start_ms: int, end_ms: int) -> Iterable[Tuple[int,int]]:
-  ms_per_candle, minutes_per_request = INTERVALS[interval]
-  span_ms = minutes_per_request * 60_000
-  s = start_ms
-  while s < end_ms:
-    e = min(end_ms, s + span_ms)
-    yield (s, e)
-    s = e
-
 def pick_markets(bv: Bitvavo) -> List[str]:
   if CONF["BACKFILL_MARKETS"].upper() == "ALL":
     mkts = [m["market"] for m in bv.markets({})]
     return [m for m in mkts if m.endswith("-EUR")]
   return [m.strip() for m in CONF["BACKFILL_MARKETS"].split(",") if m.strip()]
 
-def wait_for_budget(bv: Bitvavo):
-  # REST-budgetmeter: wacht tot remaining >= RATE_MIN
-  while True:
+# Gedeelde token bucket (Redis, RATE_LIMIT_BACKEND=local voor alleen dit proces) i.p.v.
+# getRemainingLimit-polling; de remaining uit de response-headers corrigeert de bucket na elke call.
+LIMITER = bucket_from_env(reserve_default=200)
+CANDLES_WEIGHT = 1
+
+_local = threading.local()
+_stop = threading.Event()
+_print_lock = threading.Lock()
+
+def client() -> Bitvavo:
+  # één client per worker-thread (eigen HTTP-sessie en rate-limit headers)
+  bv = getattr(_local, "bv", None)
+  if bv is None:
+    key = CONF["BITVAVO_API_KEY"]; sec = CONF["BITVAVO_API_SECRET"]
+    bv = _local.bv = Bitvavo({'APIKEY': key, 'APISECRET': sec} if key and sec else {})
+  return bv
+
+def log(msg: str, err: bool = False):
+  with _print_lock:
+    print(msg, file=sys.stderr if err else sys.stdout, flush=True)
+
+def fetch_candles(market: str, interval: str, win_s: int, win_e: int):
+  bv = client()
+  for attempt in range(CONF["BACKFILL_RETRIES"] + 1):
+    if _stop.is_set():
+      return None
+    LIMITER.acquire(CANDLES_WEIGHT)
+    # Call: REST/candles per Bitvavo SDK; params met 'interval','start','end'
+    # Verwachte response: lijst van lijsten [tOpen, open, high, low, close, volume]
     try:
-      rem = bv.getRemainingLimit()
+      items = bv.candles(market, {"interval": interval, "start": win_s, "end": win_e})
     except Exception as e:
-      # defensief: bij error even pauze en opnieuw proberen
-      print(f"[rate] error getRemainingLimit: {e}", file=sys.stderr)
-      rem = 0
-    if rem is None:
-      time.sleep(0.5); continue
-    if rem >= CONF["RATE_MIN"]:
-      return rem
-    time.sleep(0.5)
+      log(f"[err] candles {market} {interval} {win_s}-{win_e}: {e}", err=True)
+      time.sleep(min(30.0, 2 ** attempt))
+      continue
+    LIMITER.observe_client(bv)
+    if isinstance(items, dict) and "errorCode" in items:
+      # 105/110: rate limit geraakt of tijdelijke ban → iedereen pauzeren
+      msg = str(items.get("error", ""))
+      log(f"[err] candles {market} {interval}: {items.get('errorCode')} {msg}", err=True)
+      if items.get("errorCode") in (105, 110) or "limit" in msg.lower():
+        LIMITER.penalize(60.0)
+      else:
+        time.sleep(min(30.0, 2 ** attempt))
+      continue
+    return items or []
+  return None
+
+BACKFILL_FORMATS = ("parquet", "jsonl", "both")
+MANIFEST = Manifest(pathlib.Path(CONF["PARQUET_DIR"]))
+
+def write_parquet(interval: str, market: str, day: str, rows: List[dict]):
+  if not rows:
+    return
+  # gesorteerd op open_time; compactie voegt de bestanden van afgesloten dagen later samen
+  table = build_table(f"candles:{interval}", market, rows).sort_by("open_time")
+  write_partition(pathlib.Path(CONF["PARQUET_DIR"]), day, f"candles:{interval}", market, table, MANIFEST)
+
+def parquet_open_times(interval: str, market: str, s_ms: int, e_ms: int) -> set:
+  # live + eerder gebackfilde Parquet-candles (manifest snoeit de bestanden)
+  t = load_history(f"candles:{interval}", [market], s_ms, e_ms, columns=["open_time"],
+                   base_dir=CONF["PARQUET_DIR"], jsonl_fallback=False, sort=False)
+  return {v for v in t.column("open_time").cast("int64").to_pylist() if v is not None}
 
 def write_jsonl(path: pathlib.Path, rows: List[dict]):
   if not rows:
@@ -89,19 +144,40 @@ def write_jsonl(path: pathlib.Path, rows: List[dict]):
     for r in rows:
       f.write(jsonf.dumps(r) + b"\n")
 
-def backfill_market_interval(bv: Bitvavo, market: str, interval: str, s_ms: int, e_ms: int):
-  ms_per_candle, _ = INTERVALS[interval]
+def state_dir() -> pathlib.Path:
+  return pathlib.Path(CONF["BACKFILL_STATE_DIR"] or pathlib.Path(CONF["PARQUET_DIR"]) / "_backfill")
+
+def day_files(interval: str, market: str, s_ms: int, e_ms: int) -> List[pathlib.Path]:
+  day = dt.datetime.utcfromtimestamp(s_ms/1000.0).date()
+  last = dt.datetime.utcfromtimestamp((e_ms - 1)/1000.0).date()
+  out = []
+  while day <= last:
+    out.append(pathlib.Path(CONF["PARQUET_DIR"]) / day.strftime("%Y-%m-%d") / "candles" / interval / f"{market.replace('/', '-')}.jsonl")
+    day += dt.timedelta(days=1)
+  return out
+
+def backfill_market_interval(market: str, interval: str, s_ms: int, e_ms: int) -> int:
+  # één job per (market, interval): windows sequentieel, dus per bestand maar één schrijver
+  ms_per_candle, minutes_per_request = INTERVALS[interval]
+  e_ms = min(e_ms, closed_until(ms_per_candle))  # alleen afgesloten candles
+  if e_ms <= s_ms:
+    return 0
+  cp = Checkpoint(state_dir(), market, interval).load()
+  present = jsonl_open_times(day_files(interval, market, s_ms, e_ms)) | parquet_open_times(interval, market, s_ms, e_ms)
+  gaps = missing_ranges(s_ms, e_ms, ms_per_candle, present, [] if CONF["BACKFILL_FORCE"] else cp.ranges)
+  windows = split_ranges(gaps, minutes_per_request * 60_000)
+  if not windows:
+    return 0
+  log(f"[plan] {market} {interval} present={len(present)} gaps={len(gaps)} requests={len(windows)}")
   total = 0
-  for (win_s, win_e) in chunk_ranges(interval, s_ms, e_ms):
-    wait_for_budget(bv)
-    # Call: REST/candles per Bitvavo SDK; params met 'interval','start','end'
-    # Verwachte response: lijst van lijsten [tOpen, open, high, low, close, volume]
-    try:
-      items = bv.candles(market, {"interval": interval, "start": win_s, "end": win_e})
-    except Exception as e:
-      print(f"[err] candles {market} {interval} {win_s}-{win_e}: {e}", file=sys.stderr)
-      # mini backoff
-      time.sleep(1.0)
+  complete = True
+  for (win_s, win_e) in windows:
+    if _stop.is_set():
+      complete = False
+      break
+    items = fetch_candles(market, interval, win_s, win_e)
+    if items is None:
+      complete = False
       continue
 
     # Normaliseer & schrijf per candle naar dagbestand van tOpen
@@ -111,6 +187,10 @@ def backfill_market_interval(bv: Bitvavo, market: str, interval: str, s_ms: int,
       if not isinstance(c, (list, tuple)) or len(c) < 6: 
         continue
       t_open = int(c[0])
+      # dedup: alleen nieuwe, afgesloten candles binnen het window
+      if t_open in present or not (win_s <= t_open < win_e):
+        continue
+      present.add(t_open)
       obj = {
         "market": market,
         "interval": interval,
@@ -119,45 +199,62 @@ def backfill_market_interval(bv: Bitvavo, market: str, interval: str, s_ms: int,
       day = dt.datetime.utcfromtimestamp(t_open/1000.0).strftime("%Y-%m-%d")
       rows_by_day.setdefault(day, []).append(obj)
 
+    written = 0
     for day, rows in rows_by_day.items():
-      path = pathlib.Path(CONF["PARQUET_DIR"]) / day / "candles" / interval / f"{market.replace('/', '-')}.jsonl"
-      write_jsonl(path, rows)
+      if CONF["BACKFILL_FORMAT"] in ("parquet", "both"):
+        write_parquet(interval, market, day, rows)
+      if CONF["BACKFILL_FORMAT"] in ("jsonl", "both"):
+        path = pathlib.Path(CONF["PARQUET_DIR"]) / day / "candles" / interval / f"{market.replace('/', '-')}.jsonl"
+        write_jsonl(path, rows)
+      written += len(rows)
+    # pas na het schrijven als gedaan markeren: een onderbroken run haalt dit window opnieuw
+    cp.mark(win_s, win_e)
 
-    total += len(items or [])
-    print(f"[ok] {market} {interval} {win_s}->{win_e} candles={len(items or [])} total={total}")
-    time.sleep(CONF["SLEEP_BETWEEN_CALLS"])
+    total += written
+    log(f"[ok] {market} {interval} {win_s}->{win_e} candles={len(items)} new={written} total={total}")
+  if complete:
+    cp.mark(s_ms, e_ms)  # hele range klaar: één aaneengesloten checkpoint
+  return total
 
 def main():
   # Init Bitvavo
-  key = CONF["BITVAVO_API_KEY"]; sec = CONF["BITVAVO_API_SECRET"]
-  creds = {'APIKEY': key, 'APISECRET': sec} if key and sec else {}
-  bv = Bitvavo(creds)
+  bv = client()
 
   # Input validatie
   intervals = [i.strip() for i in CONF["BACKFILL_INTERVALS"].split(",") if i.strip()]
   for itv in intervals:
     if itv not in INTERVALS:
       raise ValueError(f"Niet-ondersteund interval: {itv} (toegestaan: {list(INTERVALS)})")
+  if CONF["BACKFILL_FORMAT"] not in BACKFILL_FORMATS:
+    raise ValueError(f"Onbekend BACKFILL_FORMAT: {CONF['BACKFILL_FORMAT']} (toegestaan: {', '.join(BACKFILL_FORMATS)})")
   start_ms, end_ms = parse_boundaries()
 
   markets = pick_markets(bv)
-  print(f"[start] markets={len(markets)} intervals={intervals} rangeUTC=({start_ms}..{end_ms})")
+  workers = max(1, CONF["BACKFILL_WORKERS"])
+  print(f"[start] markets={len(markets)} intervals={intervals} rangeUTC=({start_ms}..{end_ms}) "
+        f"workers={workers} budget={LIMITER.capacity:.0f}/min reserve={LIMITER.config.reserve}")
 
-  # Ctrl-C vriendelijk
-  running = True
-  def stop(*_): 
-    nonlocal running; running = False
+  # Ctrl-C vriendelijk: lopende calls maken hun window af, daarna stoppen alle workers
+  def stop(*_):
+    _stop.set()
   signal.signal(signal.SIGINT, stop)
   signal.signal(signal.SIGTERM, stop)
 
+  t0 = time.time()
+  total = 0
   try:
-    for itv in intervals:
-      if not running: break
-      for m in markets:
-        if not running: break
-        backfill_market_interval(bv, m, itv, start_ms, end_ms)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+      jobs = {pool.submit(backfill_market_interval, m, itv, start_ms, end_ms): (m, itv)
+              for itv in intervals for m in markets}
+      for fut in as_completed(jobs):
+        try:
+          total += fut.result()
+        except Exception as e:
+          m, itv = jobs[fut]
+          log(f"[err] {m} {itv}: {e}", err=True)
   finally:
-    print("[done] backfill finished")
+    print(f"[done] backfill finished candles={total} in {time.time() - t0:.0f}s "
+          f"(rate-limit wait {LIMITER.waited_secs:.0f}s)")
 
 if __name__ == "__main__":
   main()
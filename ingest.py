@@ -1,8 +1,9 @@
-import os, sys, time, signal, pathlib, datetime as dt
-import orjson as jsonf
+import os, sys, time, signal
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+from tradingbot_ingest.jsonl import JsonlWriter
+from tradingbot_ingest.publisher import StreamPublisher
 from tradingbot_storage.parquet_sink import ParquetConfig, ParquetSink
 
 CONF = {
@@ -15,20 +16,12 @@ CONF = {
 
 # Redis
 r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
-
-def day_dir(kind: str) -> pathlib.Path:
-  d = dt.datetime.utcnow().strftime("%Y-%m-%d")
-  base = pathlib.Path(CONF["PARQUET_DIR"]).expanduser() / d
-  if kind == "trades":
-    base = base / "trades"
-  base.mkdir(parents=True, exist_ok=True)
-  return base
+PUBLISHER = StreamPublisher(r)
+# open handles per (dag, kind, markt); flush in achtergrond-thread
+JSONL = JsonlWriter(CONF["PARQUET_DIR"])
 
 def append_jsonl(kind: str, market: str, rows: list):
-  fn = day_dir(kind) / f"{market.replace('/', '-')}.jsonl"
-  with open(fn, "ab") as f:
-    for row in rows:
-      f.write(jsonf.dumps(row) + b"\n")
+  JSONL.write(("trades",) if kind == "trades" else (), market, rows)
 
 
 PARQUET_SINK = ParquetSink(ParquetConfig.from_env())
@@ -71,7 +64,7 @@ def _market_of(ev: dict) -> str:
 
 def _handle(evt: str, ev: dict):
   # RAW → Redis
-  r.xadd(f"bitvavo:{evt}", {"data": jsonf.dumps(ev)})
+  PUBLISHER.publish(f"bitvavo:{evt}", ev)
   # RAW → file (batch)
   m = _market_of(ev)
   key = (evt, m)
@@ -137,4 +130,7 @@ finally:
   for (evt, m), rows in list(batch.items()):
     if rows:
       flush_bucket(evt, m)
+  PARQUET_SINK.close()
+  JSONL.close()
+  PUBLISHER.close()
   print("[ws] stopped", file=sys.stderr)
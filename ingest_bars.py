@@ -0,0 +1,134 @@
+import os, sys, time, signal, socket
+from redis import Redis
+from redis.exceptions import ResponseError
+
+from tradingbot_ingest.bars import BarBuilder, parse_entry_id, parse_specs
+from tradingbot_ingest.retention import RetentionPolicies
+from tradingbot_ingest.wire import WireCodec, decode_fields
+
+# Bouwt bars uit bitvavo:trades (consumer group) en schrijft afgesloten bars naar bitvavo:bars:<spec>.
+# Eén consumer per groep: trades van een markt mogen niet over consumers verdeeld worden.
+# Een trade wordt pas geackt als alle bars waar hij in zit geschreven zijn (zelfde pipeline, bars eerst);
+# na een crash worden de pending entries opnieuw verwerkt en slaat de builder over wat al in een bar zit.
+CONF = {
+  "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
+  "TRADES_STREAM": os.getenv("TRADES_STREAM", "bitvavo:trades"),
+  # time-bars (1s, 10s, 1m), volume:<base amount>, dollar:<EUR notional>
+  "BAR_SPECS": os.getenv("BAR_SPECS", "1s,10s"),
+  "BAR_GROUP": os.getenv("BAR_GROUP", "bars"),
+  "BAR_CONSUMER": os.getenv("BAR_CONSUMER", f"{socket.gethostname()}-bars"),
+  "BAR_BATCH": int(os.getenv("BAR_BATCH", "1000")),
+  "BAR_BLOCK_MS": int(os.getenv("BAR_BLOCK_MS", "200")),
+  # time-bar pas afsluiten als er zo lang na het einde geen trade meer voor kwam
+  "BAR_GRACE_MS": int(os.getenv("BAR_GRACE_MS", "500")),
+  "REPORT_SECS": float(os.getenv("BAR_REPORT_SECS", "60")),
+}
+
+r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
+CODEC = WireCodec.from_env()
+RETENTION = RetentionPolicies.from_env()
+SPECS = parse_specs(CONF["BAR_SPECS"])
+OUT = []    # (stream, bar) afgesloten sinds de laatste commit
+ACKS = []   # entry-ids waarvan alle bars in OUT of al geschreven zijn
+BUILDER = BarBuilder(SPECS, lambda spec, bar: OUT.append((spec.stream, bar)), CONF["BAR_GRACE_MS"])
+
+def ensure_group():
+  try:
+    r.xgroup_create(CONF["TRADES_STREAM"], CONF["BAR_GROUP"], id="$", mkstream=True)
+  except ResponseError as e:
+    if "BUSYGROUP" not in str(e):
+      raise
+
+def resume():
+  # bars die al geschreven zijn sinds de oudste pending entry: die trades niet nog eens meetellen
+  info = r.xpending(CONF["TRADES_STREAM"], CONF["BAR_GROUP"])
+  if not info or not info.get("pending"):
+    return
+  start = f"{parse_entry_id(info['min'])[0]}-0"
+  n = 0
+  for spec in SPECS:
+    while True:
+      rows = r.xrange(spec.stream, min=start, max="+", count=1000)
+      for _id, fields in rows:
+        bar = decode_fields(fields)
+        if bar.get("market") and bar.get("last_entry"):
+          BUILDER.resume(spec.name, bar["market"], bar["last_entry"])
+          n += 1
+      if len(rows) < 1000:
+        break
+      start = "(" + rows[-1][0].decode()
+  print(f"[bars] {info['pending']} pending entries, {n} bars al geschreven", file=sys.stderr)
+
+def commit():
+  # bars en acks in één pipeline, bars eerst: een entry is nooit geackt zonder zijn bars
+  ACKS.extend(BUILDER.take_ackable())
+  if not OUT and not ACKS:
+    return
+  pipe = r.pipeline(transaction=False)
+  for stream, bar in OUT:
+    maxlen = RETENTION.maxlen_for(stream)
+    if maxlen:
+      pipe.xadd(stream, CODEC.encode(stream, bar), maxlen=maxlen, approximate=True)
+    else:
+      pipe.xadd(stream, CODEC.encode(stream, bar))
+  if ACKS:
+    pipe.xack(CONF["TRADES_STREAM"], CONF["BAR_GROUP"], *ACKS)
+  pipe.execute()
+  OUT.clear()
+  ACKS.clear()
+
+def consume(start_id: str):
+  # start_id ">": nieuwe entries; anders eigen pending entries (na crash) na die id; geeft de laatste id terug
+  res = r.xreadgroup(CONF["BAR_GROUP"], CONF["BAR_CONSUMER"], {CONF["TRADES_STREAM"]: start_id},
+                     count=CONF["BAR_BATCH"], block=CONF["BAR_BLOCK_MS"] if start_id == ">" else None)
+  last = None
+  for _stream, messages in res or []:
+    for msg_id, fields in messages:
+      last = msg_id = msg_id.decode() if isinstance(msg_id, bytes) else msg_id
+      ev = decode_fields(fields)
+      market = ev.get("market")
+      if market:
+        BUILDER.on_trade(market, ev.get("price"), ev.get("amount"), ev.get("timestamp"), msg_id)
+      else:
+        ACKS.append(msg_id)
+  return last
+
+running = True
+def stop(*_):
+  global running; running = False
+signal.signal(signal.SIGINT, stop)
+signal.signal(signal.SIGTERM, stop)
+
+def main():
+  ensure_group()
+  print(f"[bars] {CONF['TRADES_STREAM']} -> {[s.stream for s in SPECS]} group={CONF['BAR_GROUP']}", file=sys.stderr)
+  resume()
+  replay = "0"
+  while running and replay:
+    # pending entries blijven pending tot hun bars er zijn: per pagina verder na de laatst gelezen id
+    replay = consume(replay)
+  commit()
+  next_report = time.time() + CONF["REPORT_SECS"]
+  try:
+    while running:
+      try:
+        consume(">")
+        BUILDER.flush_due()
+        commit()
+      except Exception as e:
+        # OUT/ACKS blijven staan voor de volgende commit
+        print(f"[bars] read/write error: {e}", file=sys.stderr)
+        time.sleep(0.5)
+      if time.time() >= next_report:
+        next_report = time.time() + CONF["REPORT_SECS"]
+        print(f"[bars] trades={BUILDER.trades} bars={BUILDER.emitted} open={BUILDER.open_bars()} "
+              f"unacked={BUILDER.pending_entries()} late={BUILDER.late}", file=sys.stderr)
+  finally:
+    try:
+      commit()
+    except Exception as e:
+      print(f"[bars] final commit failed: {e}", file=sys.stderr)
+    print("[bars] stopped", file=sys.stderr)
+
+if __name__ == "__main__":
+  main()
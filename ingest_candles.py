@@ -1,8 +1,11 @@
-import os, sys, time, signal, pathlib, datetime as dt
-import orjson as jsonf
+import os, sys, time, signal, threading
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+from tradingbot_ingest.aggregate import BASE_INTERVAL, CandleAggregator, plan_intervals
+from tradingbot_ingest.candlestate import CandleState
+from tradingbot_ingest.jsonl import JsonlWriter
+from tradingbot_ingest.publisher import StreamPublisher
 from tradingbot_storage.parquet_sink import ParquetConfig, ParquetSink
 
 CONF = {
@@ -10,38 +13,47 @@ CONF = {
   "PARQUET_DIR": os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet"),
   "INGEST_MARKETS": os.getenv("INGEST_MARKETS", "ALL"),
   "CANDLE_INTERVALS": os.getenv("CANDLE_INTERVALS", "1m,5m,1h"),
+  # candles: alleen 1m subscriben, hogere intervallen lokaal uit 1m bouwen; off: elk interval subscriben
+  "CANDLE_AGG_SOURCE": os.getenv("CANDLE_AGG_SOURCE", "candles"),
+  "CANDLE_AGG_GRACE_MS": int(os.getenv("CANDLE_AGG_GRACE_MS", "2000")),
+  # lopende (nog niet afgesloten) candle-updates ook naar bitvavo:candles:<interval>:live
+  "CANDLE_LIVE": os.getenv("CANDLE_LIVE", "false").lower() in ("1", "true", "yes"),
   "BITVAVO_API_KEY": os.getenv("BITVAVO_API_KEY", ""),
   "BITVAVO_API_SECRET": os.getenv("BITVAVO_API_SECRET", ""),
 }
 
 r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
-
-def day_dir(interval: str) -> pathlib.Path:
-  d = dt.datetime.utcnow().strftime("%Y-%m-%d")
-  base = pathlib.Path(CONF["PARQUET_DIR"]).expanduser()
-  p = base / d / "candles" / interval
-  p.mkdir(parents=True, exist_ok=True)
-  return p
+PUBLISHER = StreamPublisher(r)
+# open handles per (dag, interval, markt); flush in achtergrond-thread
+JSONL = JsonlWriter(CONF["PARQUET_DIR"])
 
 def append_jsonl(interval: str, market: str, rows: list):
-  fn = day_dir(interval) / f"{market.replace('/', '-')}.jsonl"
-  with open(fn, "ab") as f:
-    for row in rows:
-      f.write(jsonf.dumps(row) + b"\n")
+  JSONL.write(("candles", interval), market, rows)
 
 
 PARQUET_SINK = ParquetSink(ParquetConfig.from_env())
 
 
-def flush_bucket(interval: str, market: str):
-  key = (interval, market)
-  rows = batch.get(key)
-  if not rows:
-    return
-
+def write_bucket(interval: str, market: str, rows: list):
   append_jsonl(interval, market, rows)
   PARQUET_SINK.write(f"candles:{interval}", market, rows)
-  batch[key] = []
+
+def write_full():
+  with batch_lock:
+    due = full[:]
+    full.clear()
+  for (interval, market), rows in due:
+    write_bucket(interval, market, rows)
+
+def take_buckets() -> list:
+  # alle buckets onder batch_lock loskoppelen (volle eerst); schrijven gebeurt daarna zonder lock
+  with batch_lock:
+    due = full[:] + [(key, rows) for key, rows in batch.items() if rows]
+    full.clear()
+    for key, rows in batch.items():
+      if rows:
+        batch[key] = []
+  return due
 
 bv = Bitvavo({'APIKEY': CONF["BITVAVO_API_KEY"], 'APISECRET': CONF["BITVAVO_API_SECRET"]})
 ws = bv.newWebsocket()
@@ -55,33 +67,62 @@ def get_markets():
 
 markets = get_markets()
 intervals = [i.strip() for i in CONF["CANDLE_INTERVALS"].split(",") if i.strip()]
-print(f"[candles] subscribing {len(markets)} markets × {intervals}", file=sys.stderr)
+if CONF["CANDLE_AGG_SOURCE"] not in ("off", "candles"):
+  raise ValueError(f"Onbekende CANDLE_AGG_SOURCE: {CONF['CANDLE_AGG_SOURCE']} (toegestaan: off,candles)")
+subscribed, derived = plan_intervals(intervals, CONF["CANDLE_AGG_SOURCE"])
+print(f"[candles] subscribing {len(markets)} markets × {subscribed}, lokaal {derived}", file=sys.stderr)
 
 # batching per (interval, market)
 BATCH_LIMIT = 200
 batch = {}  # key=(interval, market) -> list
+full = []   # volle buckets, losgekoppeld onder batch_lock; geschreven na het vrijgeven
 last_flush = time.time()
 FLUSH_SECS = 5
 
-def handle(interval: str, market: str, candles: list):
-  # RAW → Redis stream per interval
-  for c in candles:
-    obj = {"market": market, "interval": interval, "candle": c}
-    r.xadd(f"bitvavo:candles:{interval}", {"data": jsonf.dumps(obj)})
-  # RAW → file batch
+def publish(market: str, interval: str, c: list, closed: bool):
+  obj = {"market": market, "interval": interval, "candle": c, "closed": closed}
+  if not closed:
+    # lopende candle: alleen naar het live-kanaal, niet opslaan
+    if CONF["CANDLE_LIVE"]:
+      PUBLISHER.publish(f"bitvavo:candles:{interval}:live", obj)
+    return
+  # afgesloten candle → Redis stream per interval
+  PUBLISHER.publish(f"bitvavo:candles:{interval}", obj)
+  # → file batch
   key = (interval, market)
   bucket = batch.setdefault(key, [])
-  for c in candles:
-    bucket.append({"market": market, "interval": interval, "candle": c})
+  bucket.append(obj)
   if len(bucket) >= BATCH_LIMIT:
-    flush_bucket(interval, market)
+    # publish draait onder batch_lock: alleen loskoppelen, write_full schrijft
+    batch[key] = []
+    full.append((key, bucket))
+
+# ws-thread en hoofdloop (flush_due) publiceren allebei → batch onder één lock
+batch_lock = threading.Lock()
+# herhaalde updates van de lopende candle samenvoegen; elke open-tijd één keer als afgesloten
+STATE = CandleState(publish, CONF["CANDLE_LIVE"], CONF["CANDLE_AGG_GRACE_MS"])
+# hogere intervallen uit de 1m-candles
+AGG = CandleAggregator(publish, derived, CONF["CANDLE_AGG_GRACE_MS"]) if derived else None
+
+def handle(interval: str, market: str, candles: list):
+  with batch_lock:
+    for c in candles:
+      if interval in intervals:
+        STATE.update(market, interval, c)
+      if AGG is not None and interval == BASE_INTERVAL:
+        AGG.on_candle(market, c)
+  write_full()
 
 def flush_if_due():
   global last_flush
+  with batch_lock:
+    STATE.flush_due()
+    if AGG is not None:
+      AGG.flush_due()
+  write_full()
   if time.time() - last_flush >= FLUSH_SECS:
-    for (interval, market), rows in list(batch.items()):
-      if rows:
-        flush_bucket(interval, market)
+    for (interval, market), rows in take_buckets():
+      write_bucket(interval, market, rows)
     last_flush = time.time()
 
 def on_candle(payload, interval, market):
@@ -98,7 +139,7 @@ def on_candle(payload, interval, market):
 
 # per markt × interval subscriben (SDK: subscriptionCandles)
 for m in markets:
-  for itv in intervals:
+  for itv in subscribed:
     ws.subscriptionCandles(m, itv, lambda p, _itv=itv, _m=m: on_candle(p, _itv, _m))
 
 running = True
@@ -115,7 +156,9 @@ finally:
   try: ws.closeSocket()
   except Exception: pass
   # afsluit-flush
-  for (interval, market), rows in list(batch.items()):
-    if rows:
-      flush_bucket(interval, market)
+  for (interval, market), rows in take_buckets():
+    write_bucket(interval, market, rows)
+  PARQUET_SINK.close()
+  JSONL.close()
+  PUBLISHER.close()
   print("[candles] stopped", file=sys.stderr)
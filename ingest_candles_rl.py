@@ -1,8 +1,11 @@
-import os, sys, time, signal, pathlib, datetime as dt
-import orjson as jsonf
+import os, sys, time, signal
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+from tradingbot_ingest.jsonl import JsonlWriter
+from tradingbot_ingest.publisher import StreamPublisher
+from tradingbot_ingest.ratelimit import bucket_from_env
+
 CONF = {
   "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
   "PARQUET_DIR": os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet"),
@@ -18,18 +21,12 @@ CONF = {
 }
 
 r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
-
-def day_dir(interval: str) -> pathlib.Path:
-  d = dt.datetime.utcnow().strftime("%Y-%m-%d")
-  p = pathlib.Path(CONF["PARQUET_DIR"]) / d / "candles" / interval
-  p.mkdir(parents=True, exist_ok=True)
-  return p
+PUBLISHER = StreamPublisher(r)
+# open handles per (dag, interval, markt); flush in achtergrond-thread
+JSONL = JsonlWriter(CONF["PARQUET_DIR"])
 
 def append_jsonl(interval: str, market: str, rows: list):
-  fn = day_dir(interval) / f"{market.replace('/', '-')}.jsonl"
-  with open(fn, "ab") as f:
-    for row in rows:
-      f.write(jsonf.dumps(row) + b"\n")
+  JSONL.write(("candles", interval), market, rows)
 
 bv = Bitvavo({'APIKEY': CONF["BITVAVO_API_KEY"], 'APISECRET': CONF["BITVAVO_API_SECRET"]})
 ws = bv.newWebsocket()
@@ -58,7 +55,7 @@ def handle(interval: str, market: str, candles: list):
   if not candles: return
   for c in candles:
     obj = {"market": market, "interval": interval, "candle": c}
-    r.xadd(f"bitvavo:candles:{interval}", {"data": jsonf.dumps(obj)})
+    PUBLISHER.publish(f"bitvavo:candles:{interval}", obj)
   key = (interval, market)
   bucket = batch.setdefault(key, [])
   for c in candles:
@@ -88,20 +85,8 @@ def on_candle(payload, interval, market):
 
 ws.setErrorCallback(on_error)
 
-def wait_for_budget():
-  # wacht tot rate budget >= RATE_MIN
-  while True:
-    try:
-      rem = bv.getRemainingLimit()
-    except Exception as e:
-      print(f"[rate] error getRemainingLimit: {e}", file=sys.stderr)
-      rem = 0
-    if rem is None:
-      # defensief: als None terugkomt, even pauze
-      time.sleep(0.5); continue
-    if rem >= CONF["RATE_MIN"]:
-      return rem
-    time.sleep(0.5)
+# gedeelde token bucket (Redis) voor alle Bitvavo-callers op deze key; RATE_MIN blijft vrij
+LIMITER = bucket_from_env(r, CONF["RATE_MIN"])
 
 def chunked(seq, n):
   for i in range(0, len(seq), n):
@@ -110,8 +95,8 @@ def chunked(seq, n):
 # Throttled subscribes per interval
 for itv in intervals:
   for group in chunked(markets, CONF["SUB_CHUNK"]):
-    wait_for_budget()
     for m in group:
+      LIMITER.acquire(1)  # ook websocket-acties tellen mee in het budget
       ws.subscriptionCandles(m, itv, lambda p, _itv=itv, _m=m: on_candle(p, _itv, _m))
       time.sleep(CONF["SLEEP_BETWEEN_SUBS"])
     time.sleep(CONF["SLEEP_BETWEEN_CHUNKS"])
@@ -132,4 +117,6 @@ finally:
   for (itv, m), rows in list(batch.items()):
     if rows:
       append_jsonl(itv, m, rows)
+  JSONL.close()
+  PUBLISHER.close()
   print("[candles-rl] stopped", file=sys.stderr)
@@ -0,0 +1,97 @@
+import os, sys, pathlib
+from typing import List
+from redis import Redis
+from python_bitvavo_api.bitvavo import Bitvavo
+
+from tradingbot_ingest.channels import BookHandler, CandlesHandler, ChannelHandler, Ticker24hHandler, TradesHandler
+from tradingbot_ingest.engine import IngestEngine
+from tradingbot_ingest.publisher import StreamPublisher
+from tradingbot_ingest.ratelimit import bucket_from_env
+from tradingbot_ingest.sink import BatchSink
+from tradingbot_storage.parquet_sink import ParquetConfig, ParquetSink
+
+# Eén proces, één websocket, één marktlijst: vervangt ingest.py / ingest_trades.py /
+# ingest_candles.py / ingest_ticker24h.py / ingest_orderbook.py als ze samen draaien.
+CONF = {
+  "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
+  "PARQUET_DIR": os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet"),
+  "INGEST_MARKETS": os.getenv("INGEST_MARKETS", "ALL"),
+  "INGEST_CHANNELS": os.getenv("INGEST_CHANNELS", "ticker24h,trades,candles,book"),
+  "CANDLE_INTERVALS": os.getenv("CANDLE_INTERVALS", "1m,5m,1h"),
+  # candles: alleen 1m bij Bitvavo, 5m/15m/1h/4h/1d lokaal aggregeren; trades: alles uit trades; off: alles subscriben
+  "CANDLE_AGG_SOURCE": os.getenv("CANDLE_AGG_SOURCE", "candles"),
+  "CANDLE_AGG_GRACE_MS": int(os.getenv("CANDLE_AGG_GRACE_MS", "2000")),
+  # lopende (nog niet afgesloten) candle-updates ook naar bitvavo:candles:<interval>:live
+  "CANDLE_LIVE": os.getenv("CANDLE_LIVE", "false").lower() in ("1", "true", "yes"),
+  "ORDERBOOK_DEPTH": int(os.getenv("ORDERBOOK_DEPTH", "100")),
+  "DRAIN_GRACE_MS": int(os.getenv("DRAIN_GRACE_MS", "250")),
+  "REORDER_MAX": int(os.getenv("REORDER_MAX", "2000")),
+  # >0: top-of-book per markt samenvoegen binnen dit window (ms) vóór bitvavo:book
+  "TOP_CONFLATE_MS": int(os.getenv("TOP_CONFLATE_MS", "0")),
+  "SUB_CHUNK": int(os.getenv("SUB_CHUNK", "25")),
+  "SLEEP_BETWEEN_SUBS": float(os.getenv("SLEEP_BETWEEN_SUBS", "0.05")),
+  "SLEEP_BETWEEN_CHUNKS": float(os.getenv("SLEEP_BETWEEN_CHUNKS", "1.0")),
+  "RATE_MIN": int(os.getenv("RATE_MIN", "200")),
+  "FLUSH_SECS": float(os.getenv("FLUSH_SECS", "5")),
+  "BITVAVO_API_KEY": os.getenv("BITVAVO_API_KEY", ""),
+  "BITVAVO_API_SECRET": os.getenv("BITVAVO_API_SECRET", ""),
+  "HTTP_TIMEOUT": float(os.getenv("HTTP_TIMEOUT", "10.0")),
+}
+
+def pick_markets(bv: Bitvavo) -> List[str]:
+  # één REST-call voor alle kanalen samen
+  if CONF["INGEST_MARKETS"].upper() == "ALL":
+    return [m["market"] for m in bv.markets({}) if m["market"].endswith("-EUR")]
+  return [m.strip() for m in CONF["INGEST_MARKETS"].split(",") if m.strip()]
+
+def build_handlers(r: Redis) -> List[ChannelHandler]:
+  handlers: List[ChannelHandler] = []
+  channels = [c.strip() for c in CONF["INGEST_CHANNELS"].split(",") if c.strip()]
+  candles = None
+  if "candles" in channels:
+    intervals = [i.strip() for i in CONF["CANDLE_INTERVALS"].split(",") if i.strip()]
+    candles = CandlesHandler(intervals, CONF["CANDLE_AGG_SOURCE"], CONF["CANDLE_AGG_GRACE_MS"], CONF["CANDLE_LIVE"])
+    if candles.source == "trades" and "trades" not in channels:
+      raise ValueError("CANDLE_AGG_SOURCE=trades vereist het trades-kanaal in INGEST_CHANNELS")
+  for name in channels:
+    if name == "ticker24h":
+      handlers.append(Ticker24hHandler())
+    elif name == "trades":
+      handlers.append(TradesHandler(candles.on_trade if candles is not None else None))
+    elif name == "candles":
+      handlers.append(candles)
+    elif name == "book":
+      handlers.append(BookHandler(
+        CONF["ORDERBOOK_DEPTH"], CONF["DRAIN_GRACE_MS"], CONF["REORDER_MAX"],
+        conflate_ms=CONF["TOP_CONFLATE_MS"], metrics_redis=r,
+      ))
+    else:
+      raise ValueError(f"Onbekend kanaal: {name} (toegestaan: ticker24h,trades,candles,book)")
+  return handlers
+
+def main():
+  creds = {}
+  if CONF["BITVAVO_API_KEY"] and CONF["BITVAVO_API_SECRET"]:
+    creds = {'APIKEY': CONF["BITVAVO_API_KEY"], 'APISECRET': CONF["BITVAVO_API_SECRET"]}
+  bv = Bitvavo({**creds, 'timeout': CONF["HTTP_TIMEOUT"]})
+  ws = bv.newWebsocket()
+  ws.setErrorCallback(lambda err: print(f"[ws-error] {err}", file=sys.stderr))
+
+  r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
+  sink = BatchSink(
+    pathlib.Path(CONF["PARQUET_DIR"]).expanduser(),
+    ParquetSink(ParquetConfig.from_env()),
+    flush_secs=CONF["FLUSH_SECS"],
+  )
+  engine = IngestEngine(
+    bv, ws, StreamPublisher(r), sink, build_handlers(r), pick_markets(bv),
+    sub_chunk=CONF["SUB_CHUNK"],
+    sleep_between_subs=CONF["SLEEP_BETWEEN_SUBS"],
+    sleep_between_chunks=CONF["SLEEP_BETWEEN_CHUNKS"],
+    rate_min=CONF["RATE_MIN"],
+    limiter=bucket_from_env(r, CONF["RATE_MIN"]),
+  )
+  engine.run_forever()
+
+if __name__ == "__main__":
+  main()
@@ -1,8 +1,10 @@
-import os, sys, signal, pathlib, datetime as dt
-import orjson as jsonf
+import os, sys, signal
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+from tradingbot_ingest.jsonl import JsonlWriter
+from tradingbot_ingest.publisher import StreamPublisher
+
 CONF = {
     "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
     "PARQUET_DIR": os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet"),
@@ -12,19 +14,12 @@ CONF = {
 }
 
 r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
+PUBLISHER = StreamPublisher(r)
+# open handles per (dag, categorie, markt); flush in achtergrond-thread
+JSONL = JsonlWriter(CONF["PARQUET_DIR"])
 
-def day_dir(category: str, market: str) -> pathlib.Path:
-    d = dt.datetime.utcnow().strftime("%Y-%m-%d")
-    base = pathlib.Path(CONF["PARQUET_DIR"]) / d
-    if category == "trades":
-        base = base / "trades"
-    base.mkdir(parents=True, exist_ok=True)
-    return base / f"{market.replace('/', '-')}.jsonl"
-
-def append_jsonl(path: pathlib.Path, rows: list):
-    with open(path, "ab") as f:
-        for row in rows:
-            f.write(jsonf.dumps(row) + b"\n")
+def append_jsonl(category: str, market: str, rows: list):
+    JSONL.write(("trades",) if category == "trades" else (), market, rows)
 
 running = True
 def stop(*_):
@@ -58,12 +53,12 @@ def handle_event(category: str, ev: dict):
         return
     m = ev.get("market") or ev.get("marketId") or ev.get("pair") or "unknown"
     # Redis stream (RAW-first)
-    r.xadd(f"bitvavo:{category}", {"data": jsonf.dumps(ev)})
+    PUBLISHER.publish(f"bitvavo:{category}", ev)
     # File batch
     key = (category, m)
     batch.setdefault(key, []).append(ev)
     if len(batch[key]) >= BATCH_LIMIT.get(category, 500):
-        append_jsonl(day_dir(category, m), batch[key]); batch[key] = []
+        append_jsonl(category, m, batch[key]); batch[key] = []
 
 def on_event(ev):
     # Universele callback voor ws: expect dicts met "event"
@@ -76,7 +71,7 @@ def on_event(ev):
         handle_event("trades", ev)
     else:
         # andere events negeren, maar wel raw naar een aparte stream
-        r.xadd("bitvavo:other", {"data": jsonf.dumps(ev)})
+        PUBLISHER.publish("bitvavo:other", ev)
 
 def on_error(code, msg):
     print(f"[error] {code} {msg}", file=sys.stderr)
@@ -94,5 +89,7 @@ bv.websocket(on_open, on_event, on_error)
 # Flush restbatches bij stop
 for (category, m), rows in list(batch.items()):
     if rows:
-        append_jsonl(day_dir(category, m), rows)
+        append_jsonl(category, m, rows)
+JSONL.close()
+PUBLISHER.close()
 print("[multi] stopped", file=sys.stderr)
@@ -1,10 +1,14 @@
-import os, sys, time, signal, pathlib, datetime as dt
-import orjson as jsonf
-from collections import deque
-from typing import Dict, List, Optional, Tuple
+import os, sys, time, signal, threading
+from typing import Dict, List, Optional
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+from tradingbot_ingest.book import LocalBook
+from tradingbot_ingest.conflate import TopConflator
+from tradingbot_ingest.jsonl import JsonlWriter
+from tradingbot_ingest.publisher import StreamPublisher
+from tradingbot_ingest.ratelimit import bucket_from_env, limited
+from tradingbot_ingest.shard import ShardSupervisor
 from tradingbot_storage.parquet_sink import ParquetConfig, ParquetSink
 
 CONF = {
@@ -21,27 +25,32 @@ CONF = {
   "HTTP_TIMEOUT": float(os.getenv("HTTP_TIMEOUT", "10.0")),
   # Niet-blokkerende grace: hoe lang we MAX parallel willen wachten dat N+1 binnenloopt
   "DRAIN_GRACE_MS": int(os.getenv("DRAIN_GRACE_MS", "250")),
+  # >1: markten verdelen (stabiele hash) over N worker-processen, elk met eigen ws/books/sinks
+  "ORDERBOOK_SHARDS": int(os.getenv("ORDERBOOK_SHARDS", "1")),
+  "SHARD_REFRESH_SECS": float(os.getenv("SHARD_REFRESH_SECS", "300")),
+  # Max aantal out-of-order updates per markt in de reorder-buffer (oudste nonces vallen eruit)
+  "REORDER_MAX": int(os.getenv("REORDER_MAX", "2000")),
+  # >0: top-of-book per markt samenvoegen binnen dit window (ms) vóór bitvavo:book
+  "TOP_CONFLATE_MS": int(os.getenv("TOP_CONFLATE_MS", "0")),
+  "CONFLATE_REPORT_SECS": float(os.getenv("CONFLATE_REPORT_SECS", "10")),
 }
 
 # IO helpers
 r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
+PUBLISHER = StreamPublisher(r)
 
-def day_dir(kind: str) -> pathlib.Path:
-  d = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%d")
-  base = pathlib.Path(CONF["PARQUET_DIR"]).expanduser()
-  p = base / d / "orderbook" / kind
-  p.mkdir(parents=True, exist_ok=True)
-  return p
+# open handles per (dag, kind, markt): geen mkdir/open/close meer per event
+JSONL = JsonlWriter(CONF["PARQUET_DIR"])
 
 def append_jsonl(kind: str, market: str, payload: dict):
-  fn = day_dir(kind) / f"{market.replace('/', '-')}.jsonl"
-  with open(fn, "ab") as f:
-    f.write(jsonf.dumps(payload) + b"\n")
+  JSONL.write_one(("orderbook", kind), market, payload)
 
 
 PARQUET_SINK = ParquetSink(ParquetConfig.from_env())
 _PARQUET_BATCH_LIMIT = {"snapshot": 1, "update": 200, "top": 400}
 _PARQUET_BUFFER = {}
+# ws-thread, hoofdloop en conflate-thread schrijven allemaal naar de buffer
+_PARQUET_LOCK = threading.Lock()
 _PARQUET_LAST_FLUSH = time.time()
 _PARQUET_FLUSH_SECS = 5
 
@@ -52,28 +61,33 @@ def _parquet_key(kind: str, market: str):
 
 def parquet_append(kind: str, market: str, payload: dict):
   key = _parquet_key(kind, market)
-  bucket = _PARQUET_BUFFER.setdefault(key, [])
-  bucket.append(payload)
-  if len(bucket) >= _PARQUET_BATCH_LIMIT[kind]:
+  with _PARQUET_LOCK:
+    bucket = _PARQUET_BUFFER.setdefault(key, [])
+    bucket.append(payload)
+    full = len(bucket) >= _PARQUET_BATCH_LIMIT[kind]
+  if full:
     parquet_flush(kind, market)
 
 
 def parquet_flush(kind: Optional[str] = None, market: Optional[str] = None):
   global _PARQUET_LAST_FLUSH
-  targets = []
-  if kind is not None and market is not None:
-    targets.append(_parquet_key(kind, market))
-  else:
-    targets.extend(list(_PARQUET_BUFFER.keys()))
-
-  for key in targets:
-    rows = _PARQUET_BUFFER.get(key)
-    if not rows:
-      continue
-    event, mkt = key
+  # buckets onder de lock loskoppelen, schrijven daarna zonder lock
+  with _PARQUET_LOCK:
+    if kind is not None and market is not None:
+      targets = [_parquet_key(kind, market)]
+    else:
+      targets = list(_PARQUET_BUFFER.keys())
+    due = []
+    for key in targets:
+      rows = _PARQUET_BUFFER.get(key)
+      if rows:
+        due.append((key, rows))
+        _PARQUET_BUFFER[key] = []
+    if due:
+      _PARQUET_LAST_FLUSH = time.time()
+
+  for (event, mkt), rows in due:
     PARQUET_SINK.write(f"orderbook:{event}", mkt, rows)
-    _PARQUET_BUFFER[key] = []
-    _PARQUET_LAST_FLUSH = time.time()
 
 
 def parquet_flush_if_due():
@@ -82,12 +96,32 @@ def parquet_flush_if_due():
     parquet_flush()
 
 def xadd(market: str, obj: dict):
-  r.xadd(f"bitvavo:book:{market}", {"data": jsonf.dumps(obj)})
+  PUBLISHER.publish(f"bitvavo:book:{market}", obj)
 
 def xadd_top(obj: dict):
-  r.xadd("bitvavo:book", {"data": jsonf.dumps(obj)})
+  PUBLISHER.publish("bitvavo:book", obj)
 
 
+def publish_top(market: str, payload: dict):
+  xadd_top(payload)
+  append_jsonl("top", market, payload)
+  parquet_append("top", market, payload)
+
+TOP_CONFLATOR = TopConflator(publish_top, CONF["TOP_CONFLATE_MS"] / 1000.0)
+
+def conflate_loop(stop: threading.Event):
+  # window-deadlines bewaken; elke CONFLATE_REPORT_SECS tellers naar Redis (metrics_sidecar)
+  tick = min(TOP_CONFLATOR.window_secs / 4, 0.05)
+  next_report = time.monotonic() + CONF["CONFLATE_REPORT_SECS"]
+  while not stop.wait(tick):
+    TOP_CONFLATOR.flush_due()
+    if time.monotonic() >= next_report:
+      next_report = time.monotonic() + CONF["CONFLATE_REPORT_SECS"]
+      try:
+        TOP_CONFLATOR.report(r)
+      except Exception as e:
+        print(f"[conflate] metrics report failed: {e}", file=sys.stderr)
+
 def emit_top_of_book(market: str, lb: 'LocalBook', origin: str):
   top = lb.current_top()
   if not top:
@@ -106,157 +140,47 @@ def emit_top_of_book(market: str, lb: 'LocalBook', origin: str):
     "source": origin,
     "timestamp": int(time.time()*1000),
   }
-  xadd_top(payload)
-  append_jsonl("top", market, payload)
-  parquet_append("top", market, payload)
+  TOP_CONFLATOR.offer(market, payload)
   lb.last_top = top
 
-def wait_for_budget(bv: Bitvavo):
-  while True:
-    try:
-      rem = bv.getRemainingLimit()
-    except Exception:
-      rem = 0
-    if rem is None:
-      time.sleep(0.3); continue
-    if rem >= CONF["RATE_MIN"]:
-      return
-    time.sleep(0.3)
-
-# Lokale state per markt
-class LocalBook:
-  def __init__(self, depth: int):
-    self.depth = depth
-    self.bids: Dict[str, str] = {}
-    self.asks: Dict[str, str] = {}
-    self.last_nonce: int = -1
-    self.seeded: bool = False
-    self.buffer: deque = deque()         # ruwe updates (dicts)
-    self.await_until: Optional[float] = None  # epoch-seconden (deadline) na snapshot
-    self.last_top: Optional[Tuple[float, float, float, float]] = None
-
-  def _apply_side(self, side: str, levels):
-    book = self.bids if side == "bids" else self.asks
-    for price, amount in levels:
-      if amount in ("0","0.0","0.00000000"):
-        book.pop(price, None)
-      else:
-        book[price] = amount
-    # top N bijhouden
-    if side == "bids":
-      top = sorted(book.items(), key=lambda kv: float(kv[0]), reverse=True)[:self.depth]
-      self.bids = dict(top)
-    else:
-      top = sorted(book.items(), key=lambda kv: float(kv[0]))[:self.depth]
-      self.asks = dict(top)
-
-  def apply_snapshot(self, snap: dict):
-    self.bids, self.asks = {}, {}
-    self._apply_side("bids", snap.get("bids", []))
-    self._apply_side("asks", snap.get("asks", []))
-    self.last_nonce = int(snap.get("nonce", -1))
-    self.seeded = True
-    self.last_top = None
-    # Zet non-blocking grace-deadline
-    self.await_until = time.time() + (CONF["DRAIN_GRACE_MS"] / 1000.0)
-
-  def try_apply_update(self, upd: dict) -> bool:
-    if not self.seeded:
-      self.buffer.append(upd); return False
-    n = int(upd.get("nonce", -1))
-    if n == self.last_nonce + 1:
-      self._apply_side("bids", upd.get("bids", []))
-      self._apply_side("asks", upd.get("asks", []))
-      self.last_nonce = n
-      return True
-    # Niet direct weggooien; in buffer houden (kan nog *de* missing N+1 zijn)
-    self.buffer.append(upd)
-    return False
-
-  def can_drain_now(self) -> bool:
-    """Mag in main-loop proberen door te trekken? (alleen na snapshot en binnen de grace)"""
-    return self.seeded and self.await_until is not None and time.time() <= self.await_until
-
-  def drain_step(self) -> bool:
-    """
-    Eén **niet-blokkerende** drain-stap:
-    - Als expected (last_nonce+1) in buffer zit -> toepassen (één stap)
-    - Anders: niets doen (wachten in volgende main-loop iteratie)
-    Return:
-      True  -> er is toegepast (we zijn verder in de keten)
-      False -> geen stap mogelijk (nog wachten of grace is straks op)
-    """
-    if not self.seeded:
-      return False
-    expected = self.last_nonce + 1
-    # pak laatste update per nonce (laatste wint)
-    by_nonce: Dict[int, dict] = {}
-    for u in list(self.buffer):
-      try:
-        n = int(u.get("nonce", -1))
-        if n >= expected:
-          by_nonce[n] = u
-      except Exception:
-        pass
-    u = by_nonce.get(expected)
-    if not u:
-      return False
-    # pas precies expected toe
-    if self.try_apply_update(u):
-      # buffer opschonen tot en met last_nonce
-      self.buffer = deque([x for x in self.buffer if int(x.get("nonce", -1)) > self.last_nonce])
-      return True
-    return False
-
-  def grace_expired(self) -> bool:
-    return self.await_until is not None and time.time() > self.await_until
-
-  def mark_out_of_sync(self):
-    self.seeded = False
-    self.await_until = None
-    self.buffer.clear()
-    self.last_top = None
-
-  def current_top(self) -> Optional[Tuple[float, float, float, float]]:
-    if not self.bids or not self.asks:
-      return None
-    try:
-      bid_price, bid_amount = next(iter(self.bids.items()))
-      ask_price, ask_amount = next(iter(self.asks.items()))
-    except StopIteration:
-      return None
-    try:
-      return (float(bid_price), float(bid_amount), float(ask_price), float(ask_amount))
-    except (TypeError, ValueError):
-      return None
+# gedeelde token bucket (Redis) voor alle Bitvavo-callers op deze key; RATE_MIN blijft vrij
+LIMITER = bucket_from_env(r, CONF["RATE_MIN"])
+
+def new_client() -> Bitvavo:
+  creds = {}
+  if CONF["BITVAVO_API_KEY"] and CONF["BITVAVO_API_SECRET"]:
+    creds = {'APIKEY': CONF["BITVAVO_API_KEY"], 'APISECRET': CONF["BITVAVO_API_SECRET"]}
+  return limited(Bitvavo({**creds, 'timeout': CONF["HTTP_TIMEOUT"]}), LIMITER)
+
+def pick_markets(bv: Bitvavo) -> List[str]:
+  if CONF["INGEST_MARKETS"].upper() == "ALL":
+    return [m["market"] for m in bv.markets({}) if m["market"].endswith("-EUR")]
+  return [m.strip() for m in CONF["INGEST_MARKETS"].split(",") if m.strip()]
 
 class OrderbookIngest:
-  def __init__(self):
-    creds = {}
-    if CONF["BITVAVO_API_KEY"] and CONF["BITVAVO_API_SECRET"]:
-      creds = {'APIKEY': CONF["BITVAVO_API_KEY"], 'APISECRET': CONF["BITVAVO_API_SECRET"]}
-    self.bv = Bitvavo({**creds, 'timeout': CONF["HTTP_TIMEOUT"]})
+  def __init__(self, markets: Optional[List[str]] = None):
+    self.bv = new_client()
+    self.markets = markets
     self.ws = self.bv.newWebsocket()
     self.ws.setErrorCallback(lambda err: print(f"[ws-error] {err}", file=sys.stderr))
     self.depth = CONF["ORDERBOOK_DEPTH"]
     self.books: Dict[str, LocalBook] = {}
 
-  def all_markets(self) -> List[str]:
-    return [m["market"] for m in self.bv.markets({}) if m["market"].endswith("-EUR")]
+  def new_book(self) -> LocalBook:
+    return LocalBook(self.depth, CONF["DRAIN_GRACE_MS"], CONF["REORDER_MAX"])
 
   def pick_markets(self) -> List[str]:
-    if CONF["INGEST_MARKETS"].upper() == "ALL":
-      return self.all_markets()
-    return [m.strip() for m in CONF["INGEST_MARKETS"].split(",") if m.strip()]
+    if self.markets is not None:
+      return list(self.markets)
+    return pick_markets(self.bv)
 
   def seed_snapshot(self, market: str) -> bool:
     try:
-      wait_for_budget(self.bv)
       snap = self.bv.book(market, {"depth": self.depth})
     except Exception as e:
       print(f"[err] snapshot {market}: {e}", file=sys.stderr)
       return False
-    lb = self.books.setdefault(market, LocalBook(self.depth))
+    lb = self.books.get(market) or self.books.setdefault(market, self.new_book())
     lb.apply_snapshot(snap)
     payload = {"event":"snapshot","market":market,"data":snap,"timestamp":int(time.time()*1000)}
     xadd(market, payload); append_jsonl("snapshot", market, payload)
@@ -281,7 +205,7 @@ class OrderbookIngest:
     xadd(market, obj); append_jsonl("update", market, obj)
     parquet_append("update", market, obj)
 
-    lb = self.books.setdefault(market, LocalBook(self.depth))
+    lb = self.books.get(market) or self.books.setdefault(market, self.new_book())
     # probeer toe te passen of bufferen
     applied = lb.try_apply_update(update)
     if applied:
@@ -313,6 +237,10 @@ class OrderbookIngest:
     signal.signal(signal.SIGINT, stop)
     signal.signal(signal.SIGTERM, stop)
 
+    conflate_stop = threading.Event()
+    if TOP_CONFLATOR.enabled:
+      threading.Thread(target=conflate_loop, args=(conflate_stop,), name="top-conflate", daemon=True).start()
+
     try:
       while running:
         # 1) parallel niet-blokkerend doorscrollen waar mogelijk
@@ -324,7 +252,7 @@ class OrderbookIngest:
             continue
           # seeded: als we binnen grace zitten, probeer 1 stap expected te zetten
           if lb.can_drain_now():
-            if lb.drain_step():
+            if lb.drain():
               emit_top_of_book(m, lb, "buffered")
               progressed += 1
               continue
@@ -343,8 +271,28 @@ class OrderbookIngest:
     finally:
       try: self.ws.closeSocket()
       except Exception: pass
+      conflate_stop.set()
+      TOP_CONFLATOR.flush_all()
       parquet_flush()
+      PARQUET_SINK.close()
+      JSONL.close()
+      PUBLISHER.close()
       print("[orderbook] stopped", file=sys.stderr)
 
+def run_shard(shard: int, markets: List[str]):
+  # entrypoint van een worker-proces (spawn): eigen Redis/publisher/sinks via module-import
+  print(f"[orderbook] shard {shard}: {len(markets)} markets", file=sys.stderr)
+  OrderbookIngest(markets).run()
+
+def main():
+  if CONF["ORDERBOOK_SHARDS"] <= 1:
+    OrderbookIngest().run()
+    return
+  bv = new_client()
+  ShardSupervisor(
+    run_shard, lambda: pick_markets(bv), CONF["ORDERBOOK_SHARDS"],
+    refresh_secs=CONF["SHARD_REFRESH_SECS"],
+  ).run()
+
 if __name__ == "__main__":
-  OrderbookIngest().run()
+  main()
@@ -1,8 +1,10 @@
-import os, sys, time, signal, pathlib, datetime as dt
-import orjson as jsonf
+import os, sys, time, signal
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+from tradingbot_ingest.jsonl import JsonlWriter
+from tradingbot_ingest.publisher import StreamPublisher
+
 CONF = {
   "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
   "PARQUET_DIR": os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet"),
@@ -12,18 +14,12 @@ CONF = {
 }
 
 r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
-
-def day_dir() -> pathlib.Path:
-  d = dt.datetime.utcnow().strftime("%Y-%m-%d")
-  p = pathlib.Path(CONF["PARQUET_DIR"]) / d
-  p.mkdir(parents=True, exist_ok=True)
-  return p
+PUBLISHER = StreamPublisher(r)
+# open handles per (dag, markt); flush in achtergrond-thread
+JSONL = JsonlWriter(CONF["PARQUET_DIR"])
 
 def append_jsonl(market: str, rows: list):
-  fn = day_dir() / f"{market.replace('/', '-')}.jsonl"
-  with open(fn, "ab") as f:
-    for row in rows:
-      f.write(jsonf.dumps(row) + b"\n")
+  JSONL.write((), market, rows)
 
 bv = Bitvavo({'APIKEY': CONF["BITVAVO_API_KEY"], 'APISECRET': CONF["BITVAVO_API_SECRET"]})
 ws = bv.newWebsocket()
@@ -40,7 +36,7 @@ FLUSH_SECS = 5
 def handle(ev: dict):
   m = ev.get("market") or "unknown"
   # Redis stream: bitvavo:ticker24h
-  r.xadd("bitvavo:ticker24h", {"data": jsonf.dumps(ev)})
+  PUBLISHER.publish("bitvavo:ticker24h", ev)
   # File batch
   bucket = batch.setdefault(m, [])
   bucket.append(ev)
@@ -84,4 +80,6 @@ finally:
   for m, rows in list(batch.items()):
     if rows:
       append_jsonl(m, rows)
+  JSONL.close()
+  PUBLISHER.close()
   print("[ticker24h] stopped", file=sys.stderr)
@@ -1,8 +1,10 @@
-import os, sys, signal, pathlib, datetime as dt
-import orjson as jsonf
+import os, sys, signal
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+from tradingbot_ingest.jsonl import JsonlWriter
+from tradingbot_ingest.publisher import StreamPublisher
+
 CONF = {
     "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
     "PARQUET_DIR": os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet"),
@@ -12,18 +14,12 @@ CONF = {
 }
 
 r = Redis.from_url(CONF["REDIS_URL"], decode_responses=False)
-
-def day_dir() -> pathlib.Path:
-    d = dt.datetime.utcnow().strftime("%Y-%m-%d")
-    p = pathlib.Path(CONF["PARQUET_DIR"]) / d / "trades"
-    p.mkdir(parents=True, exist_ok=True)
-    return p
+PUBLISHER = StreamPublisher(r)
+# open handles per (dag, markt); flush in achtergrond-thread
+JSONL = JsonlWriter(CONF["PARQUET_DIR"])
 
 def write_jsonl(market: str, rows: list):
-    fn = day_dir() / f"{market.replace('/', '-')}.jsonl"
-    with open(fn, "ab") as f:
-        for row in rows:
-            f.write(jsonf.dumps(row) + b"\n")
+    JSONL.write(("trades",), market, rows)
 
 running = True
 def stop(*_): 
@@ -61,7 +57,7 @@ def on_event(ev):
     m = ev.get("market") or ev.get("marketId") or ev.get("pair") or "unknown"
     # Redis streamnaam volgt het 'event'-veld indien aanwezig, anders 'trades'
     event_name = ev.get("event") or "trades"
-    r.xadd(f"bitvavo:{event_name}", {"data": jsonf.dumps(ev)})
+    PUBLISHER.publish(f"bitvavo:{event_name}", ev)
     batch.setdefault(m, []).append(ev)
     if len(batch[m]) >= 100:   # trades zijn high-freq → kleinere batch
         write_jsonl(m, batch[m]); batch[m] = []
@@ -79,4 +75,6 @@ bv.websocket(on_open, on_event, on_error)
 for m, rows in list(batch.items()):
     if rows:
         write_jsonl(m, rows)
+JSONL.close()
+PUBLISHER.close()
 print("[trades] stopped", file=sys.stderr)
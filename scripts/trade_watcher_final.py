@@ -11,6 +11,13 @@ Fixes:
 import os, sys, time, json, hmac, hashlib, decimal, subprocess, re
 import urllib.request, urllib.error
 
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from tradingbot_ingest.ratelimit import bucket_from_env
+
+# gedeeld REST-budget met ingest/backfill (orders mogen de reserve gebruiken)
+LIMITER = bucket_from_env(reserve=0)
+
 BASE = "https://api.bitvavo.com"
 OPERATOR_ID = 1702
 PRECISION_CACHE = "/srv/trading/storage/precision_cache.json"
@@ -67,10 +74,13 @@ def http(method, endpoint, params=None, body=None, auth=True, timeout=15):
         })
     req=urllib.request.Request(url, data=(body_json.encode() if body_json else None),
                                headers=headers, method=method)
+    LIMITER.acquire(1)
     try:
         with urllib.request.urlopen(req, timeout=timeout) as r:
+            LIMITER.observe_headers(r.headers)
             return r.status, json.loads(r.read().decode())
     except urllib.error.HTTPError as e:
+        LIMITER.observe_headers(e.headers)
         try: return e.code, json.loads(e.read().decode())
         except: return e.code, {"error": e.reason}
     except Exception as e:
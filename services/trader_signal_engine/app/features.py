@@ -0,0 +1,219 @@
+"""Structure-of-arrays feature store for vectorized filter evaluation.
+
+Instead of one :class:`~.main.MktState` with Python deques per market, every
+feature is one NumPy array with a row per market (``index`` maps market ->
+row).  Windowed features are ring buffers of shape ``(markets, window)``
+with a write position and fill count per row, so markets that trade at
+different rates share one array:
+
+* ``returns`` and ``spread`` (spread in bps at each bar, ``VOL_WINDOW``
+  wide) and ``volume`` (``VOL_SPIKE_WINDOW``);
+* per row: latest bid/ask, last traded price (ticker or bar close, the base
+  of the next return), last bar's open/high/low/close, EWMA of the returns
+  and a ``dirty`` flag for rows with a new bar since the last pass.
+
+Writes are O(1) scalar stores; :meth:`FeatureStore.evaluate` computes the
+spread, volatility, volume-spike and wick filters for all dirty markets in
+one pass over the arrays and only drops into Python for markets that fire.
+A pass evaluates the newest bar per market: when several bars of a market
+arrive between two passes, the earlier ones only feed the returns, spread and
+volume rings and are not evaluated on their own (event mode evaluates every
+bar).
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Mapping, Tuple
+
+import numpy as np
+
+Signal = Tuple[str, Dict[str, Any], float, List[str]]
+
+
+class Ring:
+    """``rows × width`` ring buffer; unwritten cells are NaN."""
+
+    def __init__(self, rows: int, width: int):
+        self.width = width
+        self.data = np.full((rows, width), np.nan)
+        self.pos = np.zeros(rows, dtype=np.int64)
+        self.count = np.zeros(rows, dtype=np.int64)
+
+    def grow(self, rows: int) -> None:
+        extra = rows - self.data.shape[0]
+        if extra <= 0:
+            return
+        self.data = np.vstack([self.data, np.full((extra, self.width), np.nan)])
+        self.pos = np.concatenate([self.pos, np.zeros(extra, dtype=np.int64)])
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+
+    def push(self, row: int, x: float) -> None:
+        col = self.pos[row]
+        self.data[row, col] = x
+        self.pos[row] = (col + 1) % self.width
+        if self.count[row] < self.width:
+            self.count[row] += 1
+
+    def last(self) -> np.ndarray:
+        """Newest value per row (NaN for empty rows)."""
+        return self.data[np.arange(self.data.shape[0]), (self.pos - 1) % self.width]
+
+    def sums(self) -> np.ndarray:
+        return np.nansum(self.data, axis=1)
+
+
+class FeatureStore:
+    """Per-market features as NumPy arrays, evaluated for all markets at once."""
+
+    def __init__(self, vol_window: int, spike_window: int, capacity: int = 256):
+        self.index: Dict[str, int] = {}
+        self.markets: List[str] = []
+        self._capacity = capacity
+        self.returns = Ring(capacity, vol_window)
+        self.volume = Ring(capacity, spike_window)
+        self.spread = Ring(capacity, vol_window)
+        self.bid = np.full(capacity, np.nan)
+        self.ask = np.full(capacity, np.nan)
+        self.last_close = np.full(capacity, np.nan)
+        self.open = np.full(capacity, np.nan)
+        self.high = np.full(capacity, np.nan)
+        self.low = np.full(capacity, np.nan)
+        self.close = np.full(capacity, np.nan)  # close van de laatste bar; last_close volgt ook de ticker
+        self.ewma_alpha = 2.0 / (vol_window + 1.0)
+        self.ewma_mean = np.full(capacity, np.nan)
+        self.ewma_var = np.zeros(capacity)
+        self.dirty = np.zeros(capacity, dtype=bool)
+
+    def row(self, market: str) -> int:
+        row = self.index.get(market)
+        if row is None:
+            row = self.index[market] = len(self.markets)
+            self.markets.append(market)
+            if row >= self._capacity:
+                self._grow(self._capacity * 2)
+        return row
+
+    def _grow(self, capacity: int) -> None:
+        extra = capacity - self._capacity
+        for ring in (self.returns, self.volume, self.spread):
+            ring.grow(capacity)
+        for name in ("bid", "ask", "last_close", "open", "high", "low", "close", "ewma_mean"):
+            setattr(self, name, np.concatenate([getattr(self, name), np.full(extra, np.nan)]))
+        self.ewma_var = np.concatenate([self.ewma_var, np.zeros(extra)])
+        self.dirty = np.concatenate([self.dirty, np.zeros(extra, dtype=bool)])
+        self._capacity = capacity
+
+    def set_quote(self, market: str, bid: float, ask: float) -> None:
+        row = self.row(market)
+        self.bid[row] = bid
+        self.ask[row] = ask
+
+    def push_price(self, market: str, price: float) -> None:
+        """Last traded price (ticker): a return against the previous close, no bar."""
+        row = self.row(market)
+        self._push_return(row, price)
+        self.last_close[row] = price
+
+    def push_bar(self, market: str, o: float, h: float, l: float, c: float, v: float) -> None:
+        row = self.row(market)
+        self._push_return(row, c)
+        self.last_close[row] = c
+        self.open[row], self.high[row], self.low[row], self.close[row] = o, h, l, c
+        self.volume.push(row, v)
+        b, a = self.bid[row], self.ask[row]
+        # spread op het moment van de bar, zoals eval_filters in event-modus; NaN zonder quote
+        self.spread.push(row, (a - b) / (0.5 * (a + b)) * 1e4 if b > 0 and a > 0 else np.nan)
+        self.dirty[row] = True
+
+    def _push_return(self, row: int, price: float) -> None:
+        prev = self.last_close[row]
+        if not prev > 0:
+            return
+        ret = (price - prev) / prev
+        self.returns.push(row, ret)
+        mean = self.ewma_mean[row]
+        if np.isnan(mean):
+            self.ewma_mean[row] = ret
+            return
+        delta = ret - mean
+        self.ewma_mean[row] = mean + self.ewma_alpha * delta
+        self.ewma_var[row] = (1.0 - self.ewma_alpha) * (self.ewma_var[row] + self.ewma_alpha * delta * delta)
+
+    def evaluate(self, cfg: Mapping[str, Any]) -> List[Signal]:
+        """Filters for every market with a new bar since the previous call; returns the ones that fire.
+
+        Same filters, scores, reasons and details as ``eval_filters`` plus the
+        wick check in ``handle_candle``, for the newest bar of each market.  The
+        wick, OHLC and spread details use that bar; returns include tickers that
+        arrived between the bar and this pass.
+        """
+        n = len(self.markets)
+        rows = np.flatnonzero(self.dirty[:n])
+        if not len(rows):
+            return []
+        self.dirty[rows] = False
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            spread = self.spread.last()[rows]
+            has_quote = ~np.isnan(spread)
+            spread_ok = has_quote & (spread <= cfg["SPREAD_BPS_MAX"])
+
+            rets = self.returns.data[rows]
+            k = self.returns.count[rows]
+            mean = np.nansum(rets, axis=1) / k
+            var = np.nansum((rets - mean[:, None]) ** 2, axis=1) / (k - 1)
+            vol_std = np.sqrt(np.where(k >= 2, var, 0.0))
+            has_vol = k >= max(5, cfg["VOL_WINDOW"] // 3)
+            vol_ok = has_vol & (vol_std >= cfg["VOL_STD_MIN"])
+
+            kv = self.volume.count[rows]
+            last_v = self.volume.last()[rows]
+            hist_mean = np.where(kv >= 2, (self.volume.sums()[rows] - last_v) / (kv - 1), 0.0)
+            has_spike_hist = kv >= 5
+            spike = has_spike_hist & (hist_mean > 0) & (last_v >= cfg["VOL_SPIKE_MULT"] * hist_mean)
+
+            o, h, l, c = self.open[rows], self.high[rows], self.low[rows], self.close[rows]
+            body = np.abs(c - o)
+            body = np.where(body > 0, body, 1e-12)
+            upper = np.maximum(0.0, h - np.maximum(o, c))
+            lower = np.maximum(0.0, np.minimum(o, c) - l)
+            wick = np.maximum(upper, lower) / body
+            wick_ok = wick >= cfg["WICK_RATIO_MIN"]
+
+        fire = spread_ok | vol_ok | spike | wick_ok
+        out: List[Signal] = []
+        for i in np.flatnonzero(fire):
+            row = int(rows[i])
+            reasons: List[str] = []
+            details: Dict[str, Any] = {}
+            score = 0.0
+            if has_quote[i]:
+                details["spread_bps"] = round(float(spread[i]), 4)
+                if spread_ok[i]:
+                    reasons.append(f"spread<={cfg['SPREAD_BPS_MAX']}bps")
+                    score += 1.0
+            if has_vol[i]:
+                details["vol_std"] = round(float(vol_std[i]), 6)
+                details["vol_ewma_std"] = round(float(np.sqrt(self.ewma_var[row])), 6)
+                if vol_ok[i]:
+                    reasons.append(f"vol_std>={cfg['VOL_STD_MIN']}")
+                    score += 1.0
+            if has_spike_hist[i]:
+                details["vol_last"] = float(last_v[i])
+                details["vol_mean"] = round(float(hist_mean[i]), 6)
+                if spike[i]:
+                    reasons.append(f"volume>={cfg['VOL_SPIKE_MULT']}x")
+                    score += 1.0
+            details.update({
+                "market": self.markets[row],
+                "o": float(o[i]), "h": float(h[i]), "l": float(l[i]), "c": float(c[i]), "v": float(last_v[i]),
+                "wick_ratio": round(float(wick[i]), 4),
+                "wick_ok": bool(wick_ok[i]),
+            })
+            if wick_ok[i]:
+                reasons.append(f"wick>={cfg['WICK_RATIO_MIN']}x")
+                score += 1.0
+            out.append((self.markets[row], details, score, reasons))
+        return out
+
+
+__all__ = ["FeatureStore", "Ring"]
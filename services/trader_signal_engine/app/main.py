@@ -1,8 +1,12 @@
 """Trader signal engine service as described in het bouwplan."""
-import os, time, json, math, collections, datetime as dt
-from typing import Dict, Deque, Any, Tuple, List
+import os, time, json, datetime as dt
+from typing import Dict, Any, Tuple, List
 from redis import Redis
 
+from tradingbot_ingest.wire import decode_fields
+
+from .rolling import EWMA, RollingStats, RollingSum
+
 CFG = {
   "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
   "SPREAD_BPS_MAX": float(os.getenv("SPREAD_BPS_MAX", "15")),
@@ -14,9 +18,17 @@ CFG = {
   "SIGNAL_STREAM": os.getenv("SIGNAL_STREAM", "signals:baseline"),
   "IDLE_FLUSH_SEC": float(os.getenv("IDLE_FLUSH_SEC", "1")),
   "VERBOSE": os.getenv("VERBOSE", "0") in ("1","true","TRUE","yes","YES"),
+  # event: filters per candle per markt; vectorized: NumPy feature store, alle markten in één pass
+  "SIGNAL_EVAL": os.getenv("SIGNAL_EVAL", "event"),
+  "SIGNAL_EVAL_SECS": float(os.getenv("SIGNAL_EVAL_SECS", "1")),
 }
 
+if CFG["SIGNAL_EVAL"] not in ("event", "vectorized"):
+    raise ValueError(f"Onbekende SIGNAL_EVAL: {CFG['SIGNAL_EVAL']} (toegestaan: event, vectorized)")
+
 r = Redis.from_url(CFG["REDIS_URL"], decode_responses=True)
+# ingest-streams kunnen binaire payloads bevatten (zie tradingbot_ingest.wire) -> bytes-client
+rs = Redis.from_url(CFG["REDIS_URL"], decode_responses=False)
 
 STREAM_TICKER = "bitvavo:ticker24h"
 STREAM_CANDLE = "bitvavo:candles:1m"
@@ -24,20 +36,24 @@ STREAM_BOOK   = "bitvavo:book"
 
 class MktState:
     def __init__(self):
-        self.returns: Deque[float] = collections.deque(maxlen=CFG["VOL_WINDOW"])
-        self.volumes: Deque[float] = collections.deque(maxlen=CFG["VOL_SPIKE_WINDOW"])
+        # O(1) per update, los van VOL_WINDOW / VOL_SPIKE_WINDOW
+        self.returns = RollingStats(CFG["VOL_WINDOW"])
+        self.volumes = RollingSum(CFG["VOL_SPIKE_WINDOW"])
+        self.returns_ewma = EWMA(span=CFG["VOL_WINDOW"])
         self.last_close: float = None
         self.last_bidask: Tuple[float,float] = (None, None)
         self.last_candle_ts: float = 0.0
+        self.last_candle_open: int = -1
+        # (open_time, o, h, l, c, v) van de lopende candle bij producers zonder "closed"-vlag
+        self.pending_candle: Tuple[int, Tuple[float, ...]] = None
 
 state: Dict[str, MktState] = {}
 
-def stddev(vals: List[float]) -> float:
-    n = len(vals)
-    if n < 2: return 0.0
-    m = sum(vals)/n
-    var = sum((v-m)*(v-m) for v in vals)/(n-1)
-    return math.sqrt(var)
+FEATURES = None
+if CFG["SIGNAL_EVAL"] == "vectorized":
+    # numpy alleen nodig in deze modus
+    from .features import FeatureStore
+    FEATURES = FeatureStore(CFG["VOL_WINDOW"], CFG["VOL_SPIKE_WINDOW"])
 
 def wick_ratio(o: float, h: float, l: float, c: float) -> float:
     body = abs(c - o) or 1e-12
@@ -45,14 +61,8 @@ def wick_ratio(o: float, h: float, l: float, c: float) -> float:
     lower = max(0.0, min(o, c) - l)
     return max(upper/body, lower/body)
 
-def parse_event(raw: str) -> Dict[str, Any]:
-    try:
-        ev = json.loads(raw)
-        if isinstance(ev, str):
-            ev = json.loads(ev)
-        return ev
-    except Exception:
-        return {}
+def parse_event(fields: Dict[bytes, bytes]) -> Dict[str, Any]:
+    return decode_fields(fields)
 
 def _parse_candle_array(ev):
     c = ev.get("candle")
@@ -64,6 +74,14 @@ def _parse_candle_array(ev):
     except Exception:
         return None
 
+def _candle_open_time(ev) -> int | None:
+    c = ev.get("candle")
+    raw = c[0] if isinstance(c, (list, tuple)) and c else ev.get("open_time", ev.get("timestamp"))
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return None
+
 def _log(msg: str):
     if CFG["VERBOSE"]:
         print(msg, flush=True)
@@ -87,8 +105,9 @@ def eval_filters(mkt: str) -> Tuple[bool, Dict[str, Any], float, List[str]]:
 
     vol_ok = False
     if len(ms.returns) >= max(5, CFG["VOL_WINDOW"]//3):
-        vol_std = stddev(list(ms.returns))
+        vol_std = ms.returns.std
         details["vol_std"] = round(vol_std, 6)
+        details["vol_ewma_std"] = round(ms.returns_ewma.std, 6)
         vol_ok = vol_std >= CFG["VOL_STD_MIN"]
         if vol_ok:
             reasons.append(f"vol_std>={CFG['VOL_STD_MIN']}")
@@ -96,8 +115,8 @@ def eval_filters(mkt: str) -> Tuple[bool, Dict[str, Any], float, List[str]]:
 
     vol_spike = False
     if len(ms.volumes) >= 5:
-        *hist, lastv = list(ms.volumes)
-        meanv = (sum(hist)/len(hist)) if hist else 0.0
+        lastv = ms.volumes.last
+        meanv = ms.volumes.mean_excluding_last()
         details["vol_last"] = lastv
         details["vol_mean"] = round(meanv, 6)
         if meanv > 0 and lastv >= CFG["VOL_SPIKE_MULT"]*meanv:
@@ -132,12 +151,17 @@ def handle_ticker(ev: Dict[str, Any]):
     ask = _first_float(ev, "bestAsk", "ask", "a")
     if bid and ask and bid > 0 and ask > 0:
         ms.last_bidask = (bid, ask)
+        if FEATURES is not None:
+            FEATURES.set_quote(mkt, bid, ask)
 
     last_price = _first_float(ev, "lastPrice", "price", "lastTradedPrice")
     if last_price and last_price > 0:
-        if ms.last_close is not None and ms.last_close > 0:
+        if FEATURES is not None:
+            FEATURES.push_price(mkt, last_price)
+        elif ms.last_close is not None and ms.last_close > 0:
             ret = (last_price - ms.last_close) / ms.last_close
-            ms.returns.append(ret)
+            ms.returns.push(ret)
+            ms.returns_ewma.push(ret)
         ms.last_close = last_price
 
 def handle_book(ev: Dict[str, Any]):
@@ -150,6 +174,8 @@ def handle_book(ev: Dict[str, Any]):
         a = float(ev.get("bestAsk") or ev.get("ask") or ev.get("a") or 0)
         if b > 0 and a > 0:
             ms.last_bidask = (b, a)
+            if FEATURES is not None:
+                FEATURES.set_quote(mkt, b, a)
     except Exception:
         return
 
@@ -170,15 +196,42 @@ def handle_candle(ev: Dict[str, Any]):
     if parsed is None:
         return
 
-    o, h, l, c, v = parsed
     ms = state.setdefault(mkt, MktState())
+    closed = ev.get("closed")
+    if closed is False:
+        return  # lopende candle (live-kanaal); alleen afgesloten bars tellen
+    open_time = _candle_open_time(ev)
+    if open_time is None:
+        on_closed_candle(mkt, ms, parsed)
+        return
+    if closed is None:
+        # oudere producer: elke update van de lopende candle; een open-tijd is pas
+        # afgesloten als er een nieuwere binnenkomt
+        pending = ms.pending_candle
+        if pending is not None and open_time < pending[0]:
+            return
+        ms.pending_candle = (open_time, parsed)
+        if pending is None or open_time == pending[0]:
+            return
+        open_time, parsed = pending
+    if open_time <= ms.last_candle_open:
+        return  # dubbele of te late bar
+    ms.last_candle_open = open_time
+    on_closed_candle(mkt, ms, parsed)
+
+def on_closed_candle(mkt: str, ms: MktState, parsed: Tuple[float, float, float, float, float]):
+    o, h, l, c, v = parsed
+    if FEATURES is not None:
+        FEATURES.push_bar(mkt, o, h, l, c, v)  # evaluatie in evaluate_all()
+        return
 
     if ms.last_close is not None and ms.last_close > 0:
         ret = (c - ms.last_close)/ms.last_close
-        ms.returns.append(ret)
+        ms.returns.push(ret)
+        ms.returns_ewma.push(ret)
     ms.last_close = c
 
-    ms.volumes.append(v)
+    ms.volumes.push(v)
 
     wr = wick_ratio(o, h, l, c)
     wick_ok = wr >= CFG["WICK_RATIO_MIN"]
@@ -196,13 +249,21 @@ def handle_candle(ev: Dict[str, Any]):
         any_true = True
 
     if any_true:
-        emit_signal(mkt, {
-          "market": mkt,
-          "score": round(score, 3),
-          "reasons": json.dumps(reasons),
-          "details": json.dumps(details),
-        })
-        _log(f"[signal] {mkt} score={round(score,3)} reasons={reasons}")
+        publish_signal(mkt, score, reasons, details)
+
+def publish_signal(mkt: str, score: float, reasons: List[str], details: Dict[str, Any]):
+    emit_signal(mkt, {
+      "market": mkt,
+      "score": round(score, 3),
+      "reasons": json.dumps(reasons),
+      "details": json.dumps(details),
+    })
+    _log(f"[signal] {mkt} score={round(score,3)} reasons={reasons}")
+
+def evaluate_all():
+    # alle markten met een nieuwe bar sinds de vorige pass in één keer
+    for mkt, details, score, reasons in FEATURES.evaluate(CFG):
+        publish_signal(mkt, score, reasons, details)
 
 def pump():
     _log("[AI] baseline_signals started — waiting for Redis events...")
@@ -219,16 +280,15 @@ def pump():
                 book_keys.append(k)
 
     last_flush = time.time()
+    last_eval = time.time()
     while True:
         keys = [STREAM_CANDLE, STREAM_TICKER] + ([STREAM_BOOK] if has_book_agg else [])
-        res = r.xread(streams=dict(zip(keys, [ids[k] for k in keys])), block=1000, count=500)
+        res = rs.xread(streams=dict(zip(keys, [ids[k] for k in keys])), block=1000, count=500)
         for k, messages in res:
+            k = k.decode()
             for msg_id, fields in messages:
                 ids[k] = msg_id
-                raw = fields.get("data")
-                if raw is None:
-                    continue
-                ev = parse_event(raw)
+                ev = parse_event(fields)
                 if not ev:
                     continue
                 if k == STREAM_CANDLE:
@@ -239,6 +299,9 @@ def pump():
                     handle_book(ev)
 
         now = time.time()
+        if FEATURES is not None and now - last_eval >= CFG["SIGNAL_EVAL_SECS"]:
+            evaluate_all()
+            last_eval = now
         if not has_book_agg and (now - last_flush) >= max(5, CFG["IDLE_FLUSH_SEC"]):
             if now - last_discover > 300:
                 for k in r.scan_iter("bitvavo:book:*", count=1000):
@@ -249,11 +312,11 @@ def pump():
             for bk in book_keys[:50]:
                 if bk not in ids:
                     ids[bk] = "$"
-                res2 = r.xread(streams={bk: ids[bk]}, block=1, count=100)
+                res2 = rs.xread(streams={bk: ids[bk]}, block=1, count=100)
                 for _k, messages in res2:
                     for msg_id, fields in messages:
-                        ids[_k] = msg_id
-                        ev = parse_event(fields.get("data"))
+                        ids[_k.decode()] = msg_id
+                        ev = parse_event(fields)
                         if ev:
                             handle_book(ev)
             last_flush = now
@@ -0,0 +1,145 @@
+"""Incremental rolling-window statistics for the signal engine.
+
+Every update is O(1), independent of the window length:
+
+* :class:`RollingStats` — mean and sample variance over the last ``window``
+  values (Welford's update, with the matching removal for the value that
+  drops out of the window);
+* :class:`RollingSum` — sum and mean over the last ``window`` values;
+* :class:`EWMA` — exponentially weighted mean and variance (no window).
+
+Subtracting values that leave the window accumulates rounding error, so both
+windowed classes recompute from their window once every ``window`` pushes
+(still O(1) amortised).
+"""
+from __future__ import annotations
+
+import collections
+import math
+from typing import Deque, Iterator, Optional
+
+
+class RollingStats:
+    """Mean / variance / std of the last ``window`` values."""
+
+    def __init__(self, window: int):
+        if window < 1:
+            raise ValueError(f"window moet >= 1 zijn: {window}")
+        self.window = window
+        self.values: Deque[float] = collections.deque()
+        self.mean = 0.0
+        self._m2 = 0.0  # som van kwadratische afwijkingen t.o.v. het gemiddelde
+        self._pushes = 0
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> Iterator[float]:
+        return iter(self.values)
+
+    def push(self, x: float) -> None:
+        if len(self.values) == self.window:
+            self._remove(self.values.popleft())
+        self.values.append(x)
+        n = len(self.values)
+        delta = x - self.mean
+        self.mean += delta / n
+        self._m2 += delta * (x - self.mean)
+        self._pushes += 1
+        if self._pushes >= self.window:
+            self._recompute()
+
+    def _remove(self, x: float) -> None:
+        n = len(self.values) + 1  # x is al uit de deque gehaald
+        if n <= 1:
+            self.mean = self._m2 = 0.0
+            return
+        mean = (self.mean * n - x) / (n - 1)
+        self._m2 -= (x - self.mean) * (x - mean)
+        self.mean = mean
+
+    def _recompute(self) -> None:
+        n = len(self.values)
+        self.mean = sum(self.values) / n
+        self._m2 = sum((v - self.mean) * (v - self.mean) for v in self.values)
+        self._pushes = 0
+
+    @property
+    def var(self) -> float:
+        """Sample variance (``n - 1``); 0.0 below two values."""
+        n = len(self.values)
+        return max(self._m2, 0.0) / (n - 1) if n >= 2 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.var)
+
+
+class RollingSum:
+    """Sum and mean of the last ``window`` values; :attr:`last` is the newest."""
+
+    def __init__(self, window: int):
+        if window < 1:
+            raise ValueError(f"window moet >= 1 zijn: {window}")
+        self.window = window
+        self.values: Deque[float] = collections.deque()
+        self.sum = 0.0
+        self._pushes = 0
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def push(self, x: float) -> None:
+        if len(self.values) == self.window:
+            self.sum -= self.values.popleft()
+        self.values.append(x)
+        self.sum += x
+        self._pushes += 1
+        if self._pushes >= self.window:
+            self.sum = math.fsum(self.values)  # afrondingsfouten niet laten oplopen
+            self._pushes = 0
+
+    @property
+    def last(self) -> Optional[float]:
+        return self.values[-1] if self.values else None
+
+    @property
+    def mean(self) -> float:
+        return self.sum / len(self.values) if self.values else 0.0
+
+    def mean_excluding_last(self) -> float:
+        """Mean of the window without its newest value (the history a spike is compared to)."""
+        n = len(self.values)
+        return (self.sum - self.values[-1]) / (n - 1) if n >= 2 else 0.0
+
+
+class EWMA:
+    """Exponentially weighted mean and variance; ``span`` as in pandas (``alpha = 2 / (span + 1)``)."""
+
+    def __init__(self, span: Optional[float] = None, alpha: Optional[float] = None):
+        if alpha is None:
+            if span is None or span < 1:
+                raise ValueError("EWMA heeft span >= 1 of alpha nodig")
+            alpha = 2.0 / (span + 1.0)
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError(f"alpha moet in (0, 1] liggen: {alpha}")
+        self.alpha = alpha
+        self.mean: Optional[float] = None
+        self.var = 0.0
+        self.count = 0
+
+    def push(self, x: float) -> None:
+        self.count += 1
+        if self.mean is None:
+            self.mean = x
+            return
+        delta = x - self.mean
+        self.mean += self.alpha * delta
+        self.var = (1.0 - self.alpha) * (self.var + self.alpha * delta * delta)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.var)
+
+
+__all__ = ["EWMA", "RollingStats", "RollingSum"]
@@ -8,6 +8,8 @@ from typing import Dict, List, Tuple
 import orjson
 from redis import Redis
 
+from tradingbot_ingest.wire import decode_fields
+
 CFG = {
     "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"),
     "SOURCE_STREAM": os.getenv("UNIVERSE_SOURCE", "bitvavo:ticker24h"),
@@ -22,23 +24,17 @@ redis_client = Redis.from_url(CFG["REDIS_URL"], decode_responses=True)
 
 
 def _parse(fields: Dict[str, str]) -> Tuple[str, float]:
-    raw = fields.get("data")
-    if isinstance(raw, (bytes, bytearray)):
-        raw = raw.decode()
-    market = ""
-    volume = 0.0
-    if isinstance(raw, str):
-        try:
-            payload = orjson.loads(raw)
-            market = payload.get("market") or payload.get("marketId") or payload.get("pair") or ""
-            volume = float(
-                payload.get("volume")
-                or payload.get("baseVolume")
-                or payload.get("volume24h")
-                or 0.0
-            )
-        except orjson.JSONDecodeError:
-            pass
+    payload = decode_fields(fields)
+    market = payload.get("market") or payload.get("marketId") or payload.get("pair") or ""
+    try:
+        volume = float(
+            payload.get("volume")
+            or payload.get("baseVolume")
+            or payload.get("volume24h")
+            or 0.0
+        )
+    except (TypeError, ValueError):
+        volume = 0.0
     return market, volume
 
 
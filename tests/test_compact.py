@@ -0,0 +1,45 @@
+import datetime as dt
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from tradingbot_storage.compact import compact_day
+from tradingbot_storage.manifest import Manifest
+from tradingbot_storage.parquet_sink import ParquetConfig, ParquetSink
+from tradingbot_storage.reader import load
+
+T0 = 1_700_000_000_000
+
+
+def _candles(market, n):
+    return [
+        {"market": market, "interval": "1m", "candle": [T0 + i * 60_000, "1.0", "2.0", "0.5", "1.5", "10"]}
+        for i in range(n)
+    ]
+
+
+def _write(base, market, n):
+    sink = ParquetSink(ParquetConfig(base, rolling=False))
+    sink.write("candles:1m", market, _candles(market, n))
+    sink.close()
+
+
+def test_recompaction_keeps_markets_of_compacted_files(tmp_path):
+    day = dt.datetime.utcnow().strftime("%Y-%m-%d")
+    manifest = Manifest(tmp_path)
+    _write(tmp_path, "BTC-EUR", 3)
+    _write(tmp_path, "ETH-EUR", 2)
+    compact_day(tmp_path, day, manifest=manifest)
+
+    # late file voor dezelfde dag, daarna opnieuw compacteren
+    _write(tmp_path, "SOL-EUR", 4)
+    results = compact_day(tmp_path, day, manifest=manifest)
+    assert [r.skipped for r in results] == [None]
+
+    entries = manifest.entries(day, "candles:1m")
+    assert sorted(m for e in entries.values() for m in e.markets) == ["BTC-EUR", "ETH-EUR", "SOL-EUR"]
+    assert load("candles:1m", ["BTC-EUR"], base_dir=tmp_path).num_rows == 3
+    assert load("candles:1m", ["ETH-EUR"], base_dir=tmp_path).num_rows == 2
+    assert load("candles:1m", ["SOL-EUR"], base_dir=tmp_path).num_rows == 4
+    assert load("candles:1m", base_dir=tmp_path).num_rows == 9
@@ -0,0 +1,58 @@
+from tradingbot_ingest.reorder import ReorderBuffer
+
+
+def test_gap_fill_pops_consecutive_run():
+    buf = ReorderBuffer()
+    for n in (12, 11, 14):
+        buf.push(n, {"nonce": n})
+    assert buf.lowest() == 11
+    assert [u["nonce"] for u in buf.pop_run(11)] == [11, 12]
+    # 13 ontbreekt nog: 14 blijft geparkeerd
+    assert len(buf) == 1 and buf.lowest() == 14
+    buf.push(13, {"nonce": 13})
+    assert [u["nonce"] for u in buf.pop_run(13)] == [13, 14]
+    assert not buf and buf.lowest() is None
+
+
+def test_last_update_per_nonce_wins():
+    buf = ReorderBuffer()
+    buf.push(5, {"v": 1})
+    buf.push(5, {"v": 2})
+    assert len(buf) == 1
+    assert list(buf.pop_run(5)) == [{"v": 2}]
+
+
+def test_eviction_drops_highest_nonces():
+    buf = ReorderBuffer(max_size=3)
+    for n in (11, 12, 13):
+        buf.push(n, {"nonce": n})
+    buf.push(14, {"nonce": 14})  # vol en hoger dan alles: zelf gedropt
+    buf.push(10, {"nonce": 10})  # vult het gat: 13 moet wijken
+    assert buf.evicted == 2
+    assert sorted(buf._pending) == [10, 11, 12]
+    # het gat na last_nonce=9 sluit nog steeds
+    assert [u["nonce"] for u in buf.pop_run(10)] == [10, 11, 12]
+    assert not buf
+
+
+def test_eviction_keeps_gap_closable_under_long_gap():
+    buf = ReorderBuffer(max_size=100)
+    for n in range(101, 1001):
+        buf.push(n, {"nonce": n})
+    assert len(buf) == 100 and buf.lowest() == 101
+    buf.push(100, {"nonce": 100})
+    run = [u["nonce"] for u in buf.pop_run(100)]
+    assert run[0] == 100 and run == list(range(100, 100 + len(run)))
+
+
+def test_drop_through_forgets_old_nonces():
+    buf = ReorderBuffer()
+    for n in (3, 5, 7, 9):
+        buf.push(n, {"nonce": n})
+    assert buf.drop_through(7) == 3
+    assert buf.lowest() == 9
+    assert buf.drop_through(100) == 1
+    assert not buf
+    # na leeglopen telt een nieuwe push weer als hoogste
+    buf.push(1, {"nonce": 1})
+    assert buf.lowest() == 1 and len(buf) == 1
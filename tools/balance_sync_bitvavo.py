@@ -3,6 +3,10 @@ import os, time, sys
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from tradingbot_ingest.ratelimit import bucket_from_env, limited
+
 REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
 SLOTS     = int(float(os.getenv("SLOTS", "5")))   # hoeveel slots wil je verdelen
 POLL_SEC  = int(float(os.getenv("BALANCE_SYNC_INTERVAL", "5")))
@@ -18,7 +22,7 @@ if not APIKEY or not APISECRET:
     sys.exit(0)
 
 r = Redis.from_url(REDIS_URL, decode_responses=True)
-bv = Bitvavo({"APIKEY": APIKEY, "APISECRET": APISECRET, "RESTURL": RESTURL})
+bv = limited(Bitvavo({"APIKEY": APIKEY, "APISECRET": APISECRET, "RESTURL": RESTURL}), bucket_from_env(r, reserve=100))
 
 def run_once():
     # 1) haal alle balances op
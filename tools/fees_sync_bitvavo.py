@@ -8,11 +8,15 @@ fees_sync_bitvavo.py — haalt account fees (maker/taker) op via REST en zet ze
 - Optioneel: respecteert REDIS_URL, BITVAVO_REST_URL, INTERVAL_SEC
 """
 
-import os, time, datetime as dt
+import os, sys, time, datetime as dt
 from typing import Optional, Dict, Any
 from redis import Redis
 from python_bitvavo_api.bitvavo import Bitvavo
 
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from tradingbot_ingest.ratelimit import bucket_from_env, limited
+
 VERSION = "fees_sync_bitvavo 2025-10-30 v2"
 
 def now_iso() -> str:
@@ -61,7 +65,8 @@ def one_sync():
     rurl = _clean(os.getenv("REDIS_URL"), "redis://127.0.0.1:6379/0")
     r = Redis.from_url(rurl, decode_responses=True)
 
-    bv = Bitvavo({"APIKEY": keys["key"], "APISECRET": keys["secret"], "RESTURL": rest})
+    bv = limited(Bitvavo({"APIKEY": keys["key"], "APISECRET": keys["secret"], "RESTURL": rest}),
+                 bucket_from_env(r, reserve=100))
     fees = fetch_fees(bv)
 
     r.mset({
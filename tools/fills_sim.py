@@ -20,12 +20,16 @@ Consumer groups (worden aangemaakt indien nodig):
 - candles:1m   -> sim_candles
 """
 
-import os, time, random, threading
+import os, sys, time, random, threading
 import datetime as dt
 from decimal import Decimal, ROUND_HALF_UP
 from typing import Dict, Any, Optional
 from redis import Redis
 
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from tradingbot_ingest.fixedpoint import DEFAULT_DECIMALS, mul as fx_mul, one, quantize, to_str, to_ticks as tk
+
 try:
     from prometheus_client import Gauge, Counter, start_http_server
     HAVE_PROM = True
@@ -47,6 +51,12 @@ def q2(x: Decimal) -> Decimal:
 def q8(x: Decimal) -> Decimal:
     return x.quantize(Decimal("0.00000001"), rounding=ROUND_HALF_UP)
 
+ONE = one()
+
+def q8t(ticks: int) -> int:
+    """q8 op fixed-point ticks (schaal DEFAULT_DECIMALS)."""
+    return quantize(ticks, DEFAULT_DECIMALS, 8, ROUND_HALF_UP)
+
 def env_int(name, default):
     try:
         return int(os.getenv(name, str(default)).split("#",1)[0].strip())
@@ -276,7 +286,8 @@ def on_candle(c: Dict[str,str]):
     market = c.get("market","")
     if not market: return
     try:
-        o = d(c.get("o","0")); h = d(c.get("h","0")); l = d(c.get("l","0")); close = d(c.get("c","0"))
+        # fixed-point ticks: vergelijkingen zijn integer-ops i.p.v. Decimal per positie
+        h = tk(c.get("h","0")); l = tk(c.get("l","0"))
     except Exception:
         return
 
@@ -288,31 +299,32 @@ def on_candle(c: Dict[str,str]):
         pos = __import__("orjson").loads(blob)
 
         side = pos["side"]
-        entry = d(pos["entry"])
-        tp_px = d(pos["tp_price"])
-        sl_px = d(pos["sl_price"])
-        trail_pct = d(pos.get("trail_pct", 0.0))
+        entry = tk(pos["entry"])
+        tp_px = tk(pos["tp_price"])
+        sl_px = tk(pos["sl_price"])
+        trail_pct = tk(pos.get("trail_pct", 0.0))
+        trail_stop = tk(pos["trail_stop"]) if pos.get("trail_stop") is not None else None
 
         # --- trailing activation/update (alleen wanneer koers gunstig beweegt) ---
-        if float(trail_pct) > 0.0:
+        if trail_pct > 0:
             if side == "buy":
                 # activeer zodra high >= entry*(1+trail_pct)
-                activate_px = entry * (d(1) + trail_pct)
+                activate_px = fx_mul(entry, ONE + trail_pct)
                 if h >= activate_px:
                     # trail stop = high*(1 - trail_pct); monotone non-decreasing
-                    new_trail = q8(h * (d(1) - trail_pct))
-                    prev_trail = d(str(pos["trail_stop"])) if pos.get("trail_stop") is not None else None
-                    if prev_trail is None or new_trail > prev_trail:
+                    new_trail = q8t(fx_mul(h, ONE - trail_pct))
+                    if trail_stop is None or new_trail > trail_stop:
                         pos["trail_active"] = True
-                        pos["trail_stop"] = float(new_trail)
+                        pos["trail_stop"] = float(to_str(new_trail))
+                        trail_stop = new_trail
             else:  # sell
-                activate_px = entry * (d(1) - trail_pct)
+                activate_px = fx_mul(entry, ONE - trail_pct)
                 if l <= activate_px:
-                    new_trail = q8(l * (d(1) + trail_pct))
-                    prev_trail = d(str(pos["trail_stop"])) if pos.get("trail_stop") is not None else None
-                    if prev_trail is None or new_trail < prev_trail:
+                    new_trail = q8t(fx_mul(l, ONE + trail_pct))
+                    if trail_stop is None or new_trail < trail_stop:
                         pos["trail_active"] = True
-                        pos["trail_stop"] = float(new_trail)
+                        pos["trail_stop"] = float(to_str(new_trail))
+                        trail_stop = new_trail
 
         # --- close conditions (buy) ---
         closed = False
@@ -325,8 +337,8 @@ def on_candle(c: Dict[str,str]):
                 exit_px = sl_px
                 maker_close = False
                 reason = "SL"
-            elif pos.get("trail_active") and pos.get("trail_stop") is not None and l <= d(pos["trail_stop"]):
-                exit_px = d(pos["trail_stop"])
+            elif pos.get("trail_active") and trail_stop is not None and l <= trail_stop:
+                exit_px = trail_stop
                 maker_close = False
                 reason = "TRAIL"
             elif h >= tp_px:
@@ -337,15 +349,15 @@ def on_candle(c: Dict[str,str]):
             # voor sells (niet gebruikt nu), spiegel logica
             if h >= sl_px:
                 exit_px = sl_px; maker_close = False; reason = "SL"
-            elif pos.get("trail_active") and pos.get("trail_stop") is not None and h >= d(pos["trail_stop"]):
-                exit_px = d(pos["trail_stop"]); maker_close = False; reason = "TRAIL"
+            elif pos.get("trail_active") and trail_stop is not None and h >= trail_stop:
+                exit_px = trail_stop; maker_close = False; reason = "TRAIL"
             elif l <= tp_px:
                 exit_px = tp_px; maker_close = True; reason = "TP"
 
         if exit_px is not None:
             # latency + slippage
             latency = maybe_latency()
-            exit_px_adj = apply_slippage(exit_px, side)
+            exit_px_adj = apply_slippage(d(to_str(exit_px)), side)
             pos["latency_ms"] = int(latency * 1000)
             close_position(pos, reason, exit_px_adj, maker_close)
             closed = True
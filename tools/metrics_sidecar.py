@@ -5,6 +5,10 @@ metrics_sidecar.py — exposeert trading_* gauges uit Redis op :9110
 - trading_pnl_realized_eur_total
 - trading_positions_open
 - trading_orders_outbox_len
+- trading_book_top_offered_total / trading_book_top_emitted_total / trading_book_conflation_ratio
+  (top-of-book conflation, uit hash metrics:book_conflation van de orderbook-ingest)
+- trading_ingest_published_total / trading_ingest_publish_errors_total / trading_ingest_dropped_total
+  (ingest-publisher, uit hash metrics:publisher)
 Veilig: read-only; raakt je sim/core niet.
 """
 import os, time, sys
@@ -18,6 +22,12 @@ PORT = int(os.getenv("METRICS_PORT", "9110"))
 G_PNL  = Gauge("trading_pnl_realized_eur_total", "Sum of realized PnL in EUR")
 G_POS  = Gauge("trading_positions_open", "Number of open positions")
 G_OUT  = Gauge("trading_orders_outbox_len", "Length of orders:shadow outbox")
+G_TOP_OFF  = Gauge("trading_book_top_offered_total", "Top-of-book changes offered to the conflator")
+G_TOP_EMIT = Gauge("trading_book_top_emitted_total", "Top-of-book entries published to bitvavo:book")
+G_TOP_RAT  = Gauge("trading_book_conflation_ratio", "Offered / emitted top-of-book updates (lifetime)")
+G_PUB      = Gauge("trading_ingest_published_total", "Stream entries written by the ingest publishers")
+G_PUB_ERR  = Gauge("trading_ingest_publish_errors_total", "Failed ingest publisher pipelines (incl. retried)")
+G_PUB_DROP = Gauge("trading_ingest_dropped_total", "Stream entries dropped after the publisher retries")
 
 def to_float(x: Optional[str]) -> float:
     try: return float(x)
@@ -37,7 +47,17 @@ def main():
         try:
             out = int(r.xlen("orders:shadow"))
         except Exception: out = 0
+        try:
+            conf = r.hgetall("metrics:book_conflation") or {}
+        except Exception: conf = {}
+        try:
+            pub = r.hgetall("metrics:publisher") or {}
+        except Exception: pub = {}
+        off, emit = to_float(conf.get("offered")), to_float(conf.get("emitted"))
         G_PNL.set(pnl); G_POS.set(pos); G_OUT.set(out)
+        G_TOP_OFF.set(off); G_TOP_EMIT.set(emit); G_TOP_RAT.set(off / emit if emit else 0.0)
+        G_PUB.set(to_float(pub.get("published"))); G_PUB_ERR.set(to_float(pub.get("errors")))
+        G_PUB_DROP.set(to_float(pub.get("dropped")))
         time.sleep(3)
 
 if __name__ == "__main__":
@@ -23,11 +23,16 @@ ENV:
 """
 
 import os, sys, json, time, logging, math
-from decimal import Decimal, ROUND_DOWN
+from decimal import Decimal
 from redis import Redis
 from redis.exceptions import ConnectionError, TimeoutError
 from python_bitvavo_api.bitvavo import Bitvavo
 
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from tradingbot_ingest.fixedpoint import DEFAULT_DECIMALS, mul, one, to_str, to_ticks
+from tradingbot_ingest.ratelimit import bucket_from_env, limited
+
 LOG_LEVEL = os.getenv("LOG_LEVEL","INFO").upper()
 logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO),
                     format="%(asctime)s %(levelname)s %(message)s")
@@ -41,6 +46,9 @@ ALLOW_LIVE        = os.getenv("GUARD_ALLOW_LIVE","false").lower()=="true"
 
 TP_PCT  = Decimal(os.getenv("TAKE_PROFIT_PCT","0.01"))
 SL_PCT  = Decimal(os.getenv("STOP_LOSS_PCT","0.01"))
+# integer ticks (fixed-point) voor de rekenpaden in plan_orders
+TP_FACTOR = one() + to_ticks(TP_PCT)
+SL_FACTOR = one() - to_ticks(SL_PCT)
 
 API_KEY    = os.getenv("BITVAVO_API_KEY","")
 API_SECRET = os.getenv("BITVAVO_API_SECRET","")
@@ -50,20 +58,22 @@ OPID       = os.getenv("BITVAVO_OPERATOR_ID","")
 DEFAULT_PRICE_DECIMALS = 5  # ICNT-EUR accepted 0.25859 -> 5 dp
 DEFAULT_AMOUNT_DECIMALS = 8
 
-def round_step(value: Decimal, decimals: int) -> str:
-    q = Decimal(10) ** (-decimals)
-    return str(value.quantize(q, rounding=ROUND_DOWN))
+def round_step(value, decimals: int) -> str:
+    """Round down to ``decimals`` places; ``value`` is a Decimal/str or fixed-point ticks (int)."""
+    ticks = value if isinstance(value, int) else to_ticks(value)
+    return to_str(ticks, DEFAULT_DECIMALS, places=decimals)
 
 def get_client() -> Bitvavo | None:
     if not (API_KEY and API_SECRET):
         log.warning("BITVAVO_API_KEY/SECRET missing — will fail to place orders.")
         return None
     try:
-        return Bitvavo({
+        # gedeelde token bucket; TP/SL-orders mogen de reserve gebruiken
+        return limited(Bitvavo({
             "APIKEY": API_KEY,
             "APISECRET": API_SECRET,
             "RESTURL": "https://api.bitvavo.com/v2"
-        })
+        }), bucket_from_env(reserve=0))
     except Exception as e:
         log.error("Failed to init Bitvavo client: %s", e)
         return None
@@ -73,11 +83,12 @@ def plan_orders(resp: dict) -> dict:
     fills = resp.get("fills") or []
     if not fills:
         return {"skip": True, "reason": "no-fills"}
-    entry_price = Decimal(str(fills[0]["price"]))
-    amount      = Decimal(str(fills[0]["amount"]))  # base amount filled
+    entry_price = str(fills[0]["price"])
+    entry_ticks = to_ticks(entry_price)
+    amount      = to_ticks(str(fills[0]["amount"]))  # base amount filled
 
-    tp_price = entry_price * (Decimal("1") + TP_PCT)
-    sl_price = entry_price * (Decimal("1") - SL_PCT)
+    tp_price = mul(entry_ticks, TP_FACTOR)
+    sl_price = mul(entry_ticks, SL_FACTOR)
 
     # Round conservatively
     tp_price_s = round_step(tp_price, DEFAULT_PRICE_DECIMALS)
@@ -87,7 +98,7 @@ def plan_orders(resp: dict) -> dict:
     plan = {
       "market": resp["market"],
       "amount": amt_s,
-      "entry_price": str(entry_price),
+      "entry_price": entry_price,
       "tp": {
         "market": resp["market"],
         "side": "sell",
@@ -55,6 +55,10 @@ except Exception as e:
     print(f"[guard {MARKET}] FATAL: python_bitvavo_api ontbreekt: {e}", file=sys.stderr)
     sys.exit(1)
 
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from tradingbot_ingest.ratelimit import bucket_from_env, limited
+
 # Metrics: best-effort
 _metrics_enabled = True
 try:
@@ -90,7 +94,7 @@ def start_metrics():
 
 # ---------- Infra ----------
 r = Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2, socket_connect_timeout=2)
-bv = Bitvavo({})  # keys via ENV (bitvavo lib leest zelf env vars BITVAVO_API_KEY/SECRET of je unit zet ze)
+bv = limited(Bitvavo({}), bucket_from_env(reserve=0))  # keys via ENV (bitvavo lib leest zelf env vars BITVAVO_API_KEY/SECRET of je unit zet ze)
 
 LOCK_KEY = f"lock:guard:{MARKET}"
 VIRTKEY  = f"virtpos:{MARKET}"
@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os, json, time, logging, decimal
+import os, sys, json, time, logging, decimal
 from typing import Any, Dict, List, Tuple
 from redis import Redis
 from redis.exceptions import ResponseError
 from python_bitvavo_api.bitvavo import Bitvavo
 
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from tradingbot_ingest.ratelimit import bucket_from_env, limited
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 D = decimal.Decimal
 
@@ -107,7 +111,8 @@ def main() -> None:
             "ACCESSWINDOW": 10000,
             "RECVWINDOW": 5000,
         }
-        bv = Bitvavo(cfg)
+        # orders mogen de reserve gebruiken die de ingest/backfill vrijlaat
+        bv = limited(Bitvavo(cfg), bucket_from_env(r, reserve=0))
 
     logging.info(
         "Submitter gestart | stream=%s group=%s consumer=%s live=%s",
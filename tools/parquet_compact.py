@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+parquet_compact.py — voegt de kleine Parquet-bestanden van afgesloten dagen samen
+- per <dag>/<event>/ een paar grote compacted-NNNNN.parquet (zstd, gesorteerd op markt + tijd)
+- controleert rijen in == rijen uit en wisselt de map daarna om, zie tradingbot_storage.compact
+- slaat mappen met .inprogress-bestanden over; --quarantine-inprogress verplaatst ze eerst
+  naar <dag>/_orphaned/<event>/ (wezen van een harde kill, alleen voor afgesloten dagen)
+- schrijft het manifest (<dag>/_manifest/<event>.jsonl) opnieuw voor de nieuwe bestanden;
+  --rebuild-manifest indexeert dagen van voor het manifest zonder te compacteren
+Voorbeeld (cron, 03:00 UTC): python /srv/trading/tools/parquet_compact.py
+           of één dag/event: python tools/parquet_compact.py --day 2025-11-01 --event trades --dry-run
+"""
+import argparse, os, sys, time
+
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from tradingbot_storage.compact import closed_days, compact_day
+from tradingbot_storage.manifest import Manifest
+
+PARQUET_DIR = os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet")
+
+def main():
+    ap = argparse.ArgumentParser(description="Compact Parquet partitions of closed days")
+    ap.add_argument("--base", default=PARQUET_DIR)
+    ap.add_argument("--day", action="append", help="YYYY-MM-DD (herhaalbaar; default: alle afgesloten dagen)")
+    ap.add_argument("--event", action="append", help="alleen deze event-map(pen), bv. trades of candles:1m")
+    ap.add_argument("--min-age-hours", type=float, default=float(os.getenv("COMPACT_MIN_AGE_HOURS", "2")))
+    ap.add_argument("--target-rows", type=int, default=int(os.getenv("COMPACT_TARGET_ROWS", "5000000")))
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--quarantine-inprogress", action="store_true",
+                    help=".inprogress-bestanden (zonder footer) naar <dag>/_orphaned/ verplaatsen en dan compacteren")
+    ap.add_argument("--rebuild-manifest", action="store_true", help="alleen het manifest (her)opbouwen")
+    args = ap.parse_args()
+
+    manifest = Manifest(args.base)
+    days = args.day or closed_days(args.base, args.min_age_hours)
+    failed = 0
+    for day in days:
+        t0 = time.time()
+        if args.rebuild_manifest:
+            day_dir = manifest.base_dir / day
+            for event_dir in sorted(p for p in day_dir.iterdir() if p.is_dir() and p.name[:1] not in (".", "_")):
+                if args.event and event_dir.name not in args.event:
+                    continue
+                if any(event_dir.glob("*.parquet")):
+                    n = manifest.rebuild(day, event_dir.name)
+                    print(f"[compact] {day}/{event_dir.name}: manifest {n} files", flush=True)
+            continue
+        try:
+            results = compact_day(args.base, day, events=args.event, target_rows=args.target_rows, dry_run=args.dry_run,
+                                  manifest=manifest, quarantine_inprogress=args.quarantine_inprogress)
+        except Exception as e:
+            print(f"[compact] {day}: error: {e}", file=sys.stderr, flush=True)
+            failed += 1
+            continue
+        for r in results:
+            if r.quarantined:
+                print(f"[compact] {day}/{r.event}: {r.quarantined} .inprogress -> _orphaned/", file=sys.stderr, flush=True)
+            if r.skipped in ("no-parquet", "already-compact"):
+                continue
+            status = r.skipped or f"{r.input_files} -> {r.output_files} files"
+            print(f"[compact] {day}/{r.event}: {status} rows={r.rows}", flush=True)
+        print(f"[compact] {day} klaar in {time.time() - t0:.1f}s", flush=True)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
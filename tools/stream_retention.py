@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+stream_retention.py — houdt de Redis ingest-streams binnen een vast geheugenbudget
+- past RETENTION_POLICIES toe (MAXLEN per familie, MINID voor leeftijd), zie tradingbot_ingest.retention
+- exposeert per stream-familie op :9112
+  - trading_stream_length{family}
+  - trading_stream_memory_bytes{family}
+  - trading_stream_count{family}
+  - trading_stream_trimmed_total{family}
+Voorbeeld: RETENTION_POLICIES="bitvavo:book:*=maxlen:5000,bitvavo:trades=maxlen:500000|age:24h"
+"""
+import os, sys, time
+
+# Zorg dat /srv/trading altijd op het importpad staat (ongeacht huidige werkdir)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from redis import Redis
+from tradingbot_ingest.retention import RetentionManager, RetentionPolicies
+
+try:
+    from prometheus_client import Counter, Gauge, start_http_server
+    HAVE_PROM = True
+except Exception:
+    HAVE_PROM = False
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+PORT = int(os.getenv("METRICS_PORT", "9112"))
+INTERVAL = float(os.getenv("RETENTION_INTERVAL_SEC", "30"))
+DRY_RUN = os.getenv("RETENTION_DRY_RUN", "0") in ("1", "true", "TRUE", "yes", "YES")
+
+if HAVE_PROM:
+    G_LEN = Gauge("trading_stream_length", "Total entries per stream family", ["family"])
+    G_MEM = Gauge("trading_stream_memory_bytes", "Approx. Redis memory per stream family", ["family"])
+    G_CNT = Gauge("trading_stream_count", "Number of streams per family", ["family"])
+    C_TRIM = Counter("trading_stream_trimmed_total", "Entries trimmed per stream family", ["family"])
+
+def main():
+    r = Redis.from_url(REDIS_URL, decode_responses=False)
+    policies = RetentionPolicies.from_env()
+    mgr = RetentionManager(r, policies)
+    if HAVE_PROM:
+        start_http_server(PORT)
+    print(f"[retention] {len(policies.policies)} policies, interval={INTERVAL}s dry_run={DRY_RUN} metrics=:{PORT}", flush=True)
+    while True:
+        t0 = time.time()
+        try:
+            stats = mgr.run_once(trim=not DRY_RUN)
+        except Exception as e:
+            print(f"[retention] error: {e}", file=sys.stderr, flush=True)
+            stats = {}
+        for family, st in stats.items():
+            if HAVE_PROM:
+                G_LEN.labels(family).set(st.length)
+                G_MEM.labels(family).set(st.memory_bytes)
+                G_CNT.labels(family).set(st.streams)
+                C_TRIM.labels(family).inc(st.trimmed)
+            if st.trimmed:
+                print(f"[retention] {family}: trimmed={st.trimmed} len={st.length} mem={st.memory_bytes}", flush=True)
+        time.sleep(max(1.0, INTERVAL - (time.time() - t0)))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
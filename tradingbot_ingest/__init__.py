@@ -0,0 +1,105 @@
+"""Shared ingest building blocks for the Bitvavo trading bot.
+
+Submodules are imported on first attribute access: the order tools and trade
+watchers only need :mod:`.ratelimit`, and must not pay for the engine, the
+storage layer (pyarrow) or numpy on every start.
+"""
+from __future__ import annotations
+
+import importlib
+from typing import Any
+
+# naam -> submodule
+_EXPORTS = {
+    "CandleAggregator": "aggregate",
+    "plan_intervals": "aggregate",
+    "BarBuilder": "bars",
+    "BarSpec": "bars",
+    "parse_specs": "bars",
+    "BookSide": "book",
+    "LocalBook": "book",
+    "price_to_ticks": "book",
+    "CandleState": "candlestate",
+    "BookHandler": "channels",
+    "CandlesHandler": "channels",
+    "ChannelHandler": "channels",
+    "Ticker24hHandler": "channels",
+    "TradesHandler": "channels",
+    "TopConflator": "conflate",
+    "IngestEngine": "engine",
+    "to_str": "fixedpoint",
+    "to_ticks": "fixedpoint",
+    "JsonlConfig": "jsonl",
+    "JsonlWriter": "jsonl",
+    "PublisherConfig": "publisher",
+    "StreamPublisher": "publisher",
+    "RateLimitConfig": "ratelimit",
+    "RedisTokenBucket": "ratelimit",
+    "TokenBucket": "ratelimit",
+    "bucket_from_env": "ratelimit",
+    "limited": "ratelimit",
+    "ReorderBuffer": "reorder",
+    "RetentionManager": "retention",
+    "RetentionPolicies": "retention",
+    "RetentionPolicy": "retention",
+    "ShardSupervisor": "shard",
+    "partition": "shard",
+    "shard_of": "shard",
+    "BatchSink": "sink",
+    "WireCodec": "wire",
+    "decode_fields": "wire",
+}
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+__all__ = [
+    "BarBuilder",
+    "BarSpec",
+    "BatchSink",
+    "BookHandler",
+    "BookSide",
+    "CandleAggregator",
+    "CandleState",
+    "CandlesHandler",
+    "ChannelHandler",
+    "IngestEngine",
+    "JsonlConfig",
+    "JsonlWriter",
+    "LocalBook",
+    "PublisherConfig",
+    "RateLimitConfig",
+    "RedisTokenBucket",
+    "ReorderBuffer",
+    "RetentionManager",
+    "RetentionPolicies",
+    "RetentionPolicy",
+    "ShardSupervisor",
+    "StreamPublisher",
+    "Ticker24hHandler",
+    "TokenBucket",
+    "TopConflator",
+    "TradesHandler",
+    "WireCodec",
+    "bucket_from_env",
+    "decode_fields",
+    "limited",
+    "parse_specs",
+    "partition",
+    "plan_intervals",
+    "price_to_ticks",
+    "shard_of",
+    "to_str",
+    "to_ticks",
+]
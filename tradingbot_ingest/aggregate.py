@@ -0,0 +1,234 @@
+"""Higher-timeframe candles built locally from 1m candles or trades.
+
+Subscribing every market to every candle interval multiplies the websocket
+subscriptions and the Redis/Parquet writes, while a 5m or 1h candle is fully
+determined by the 1m candles (or the trades) inside it.
+:class:`CandleAggregator` folds base bars into the open bar of every derived
+interval and emits it in the exchange's candle schema
+(``[open_time, open, high, low, close, volume]``, prices as strings):
+
+* ``source="candles"``: the exchange pushes repeated updates of the forming
+  1m candle; the latest update per open time is kept and folded in once the
+  next minute starts (or :meth:`flush_due` sees the minute has passed);
+* ``source="trades"``: trades are accumulated into 1m base bars first, so
+  ``1m`` itself can be derived as well.
+
+A derived bar is emitted (``closed=False``) each time a base bar is folded
+into it, and once more with ``closed=True`` when its last minute is folded
+in, a base bar of a later bucket arrives or :meth:`flush_due` sees the bucket
+has ended.  A bucket that started before the aggregator first saw the market
+(the first bucket after a start or restart) misses its first minutes: it is
+still emitted as in progress, but never with ``closed=True``; it is dropped
+and counted in :attr:`CandleAggregator.partial` instead.  Prices and volumes
+are summed as fixed-point ticks (:mod:`~tradingbot_ingest.fixedpoint`): no float error in the volumes.
+Like :class:`~tradingbot_ingest.conflate.TopConflator` the aggregator does no
+I/O; ``emit(market, interval, candle, closed)`` runs outside its lock.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .fixedpoint import Number, to_str, to_ticks
+
+BASE_INTERVAL = "1m"
+SOURCES = ("off", "candles", "trades")
+
+# Bitvavo candle-intervallen die uit 1m af te leiden zijn (UTC, epoch-uitgelijnd)
+INTERVAL_MS: Dict[str, int] = {
+    "1m": 60_000,
+    "5m": 5 * 60_000,
+    "15m": 15 * 60_000,
+    "30m": 30 * 60_000,
+    "1h": 60 * 60_000,
+    "2h": 2 * 60 * 60_000,
+    "4h": 4 * 60 * 60_000,
+    "6h": 6 * 60 * 60_000,
+    "8h": 8 * 60 * 60_000,
+    "12h": 12 * 60 * 60_000,
+    "1d": 24 * 60 * 60_000,
+}
+
+Emit = Callable[[str, str, list, bool], None]
+
+_Out = Tuple[str, str, list, bool]
+
+
+def interval_ms(interval: str) -> int:
+    try:
+        return INTERVAL_MS[interval]
+    except KeyError:
+        raise ValueError(f"Onbekend interval: {interval} (toegestaan: {', '.join(INTERVAL_MS)})") from None
+
+
+def plan_intervals(intervals: Sequence[str], source: str) -> Tuple[List[str], List[str]]:
+    """Split wanted intervals into (subscribe at the exchange, derive locally)."""
+    if source not in SOURCES:
+        raise ValueError(f"Onbekende CANDLE_AGG_SOURCE: {source} (toegestaan: {', '.join(SOURCES)})")
+    if source == "off":
+        return list(intervals), []
+    derived = [i for i in intervals if i in INTERVAL_MS and (i != BASE_INTERVAL or source == "trades")]
+    subscribed = [i for i in intervals if i not in derived]
+    if source == "candles" and derived and BASE_INTERVAL not in subscribed:
+        subscribed.insert(0, BASE_INTERVAL)  # 1m is de bron, ook als hij zelf niet gevraagd is
+    return subscribed, derived
+
+
+class _Bar:
+    __slots__ = ("open_time", "open", "high", "low", "close", "volume", "partial")
+
+    def __init__(self, open_time: int, open_: int, high: int, low: int, close: int, volume: int):
+        self.open_time = open_time
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.partial = False
+
+    @classmethod
+    def from_candle(cls, candle: Sequence) -> "_Bar":
+        t, o, h, l, c, v = candle[:6]
+        return cls(int(t), to_ticks(o), to_ticks(h), to_ticks(l), to_ticks(c), to_ticks(v))
+
+    def copy(self, open_time: int) -> "_Bar":
+        return _Bar(open_time, self.open, self.high, self.low, self.close, self.volume)
+
+    def fold(self, other: "_Bar") -> None:
+        """Add a later bar: high/low widen, close and volume follow it."""
+        if other.high > self.high:
+            self.high = other.high
+        if other.low < self.low:
+            self.low = other.low
+        self.close = other.close
+        self.volume += other.volume
+
+    def candle(self) -> list:
+        return [self.open_time, to_str(self.open), to_str(self.high), to_str(self.low),
+                to_str(self.close), to_str(self.volume)]
+
+
+class CandleAggregator:
+    """Fold 1m base bars into the open bar of each derived interval, per market.
+
+    ``grace_ms`` is how long after its end a base minute may still receive
+    updates before :meth:`flush_due` finalises it; later updates are dropped
+    and counted in :attr:`late`.
+    """
+
+    def __init__(self, emit: Emit, intervals: Sequence[str], grace_ms: int = 2000):
+        self._emit = emit
+        self.intervals = [(i, interval_ms(i)) for i in intervals]
+        self._steps = dict(self.intervals)
+        self.base_ms = INTERVAL_MS[BASE_INTERVAL]
+        self.grace_ms = grace_ms
+        self._lock = threading.Lock()
+        self._base: Dict[str, _Bar] = {}  # markt -> vormende 1m-bar
+        self._done: Dict[str, int] = {}  # markt -> open_time van de laatst afgesloten 1m-bar
+        self._bars: Dict[Tuple[str, str], _Bar] = {}  # (markt, interval) -> open bar
+        self._since: Dict[str, int] = {}  # markt -> eerste gezien tijdstip (ms); eerdere buckets zijn onvolledig
+        self.emitted = 0
+        self.late = 0
+        self.partial = 0
+
+    def on_candle(self, market: str, candle: Sequence) -> None:
+        """Exchange 1m candle (repeated updates of the same open time replace each other)."""
+        try:
+            bar = _Bar.from_candle(candle)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            out = self._offer(market, bar, replace=True, seen_ms=bar.open_time)
+        self._send(out)
+
+    def on_trade(self, market: str, price: Number, amount: Number, timestamp_ms: int) -> None:
+        try:
+            p, a, ts = to_ticks(price), to_ticks(amount), int(timestamp_ms)
+        except (TypeError, ValueError):
+            return
+        bar = _Bar(ts - ts % self.base_ms, p, p, p, p, a)
+        with self._lock:
+            out = self._offer(market, bar, replace=False, seen_ms=ts)
+        self._send(out)
+
+    def flush_due(self, now_ms: Optional[int] = None) -> int:
+        """Finalise base minutes that ended more than ``grace_ms`` ago; returns bars emitted."""
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        cutoff = now_ms - self.grace_ms
+        out: List[_Out] = []
+        with self._lock:
+            for market, bar in list(self._base.items()):
+                if bar.open_time + self.base_ms <= cutoff:
+                    del self._base[market]
+                    self._complete(market, bar, out)
+            # buckets zonder laatste minuut (geen trades) alsnog afsluiten
+            for key, bar in list(self._bars.items()):
+                if bar.open_time + self._steps[key[1]] <= cutoff:
+                    del self._bars[key]
+                    self._close(key, bar, out)
+        self._send(out)
+        return len(out)
+
+    def _offer(self, market: str, bar: _Bar, replace: bool, seen_ms: int) -> List[_Out]:
+        out: List[_Out] = []
+        self._since.setdefault(market, seen_ms)
+        if bar.open_time <= self._done.get(market, -1):
+            self.late += 1
+            return out
+        cur = self._base.get(market)
+        if cur is None or bar.open_time > cur.open_time:
+            if cur is not None:
+                self._complete(market, cur, out)
+            self._base[market] = bar
+        elif bar.open_time == cur.open_time:
+            if replace:
+                self._base[market] = bar
+            else:
+                cur.fold(bar)
+        else:
+            self.late += 1
+        return out
+
+    def _complete(self, market: str, base: _Bar, out: List[_Out]) -> None:
+        self._done[market] = base.open_time
+        for interval, step in self.intervals:
+            start = base.open_time - base.open_time % step
+            key = (market, interval)
+            bar = self._bars.get(key)
+            if bar is not None and bar.open_time != start:
+                # nieuwe bucket: de vorige bar had geen laatste minuut, nu definitief
+                del self._bars[key]
+                self._close(key, bar, out)
+                bar = None
+            if bar is None:
+                bar = self._bars[key] = base.copy(start)
+                bar.partial = start < self._since[market]
+            else:
+                bar.fold(base)
+            if base.open_time + self.base_ms >= start + step:
+                del self._bars[key]
+                self._close(key, bar, out)
+            else:
+                out.append((market, interval, bar.candle(), False))
+
+    def _close(self, key: Tuple[str, str], bar: _Bar, out: List[_Out]) -> None:
+        if bar.partial:
+            self.partial += 1  # begin van de bucket gemist: nooit als definitief uitsturen
+            return
+        out.append((key[0], key[1], bar.candle(), True))
+
+    def _send(self, out: List[_Out]) -> None:
+        for market, interval, candle, closed in out:
+            self._emit(market, interval, candle, closed)
+        self.emitted += len(out)
+
+
+__all__ = [
+    "BASE_INTERVAL",
+    "CandleAggregator",
+    "INTERVAL_MS",
+    "SOURCES",
+    "interval_ms",
+    "plan_intervals",
+]
@@ -0,0 +1,133 @@
+"""Gap detection and checkpoints for the candle backfill.
+
+A backfill run should only fetch what is actually missing.  For every
+(market, interval) the job knows two things:
+
+* the open times already on disk (:func:`jsonl_open_times`), and
+* the windows it already asked the exchange for (:class:`Checkpoint`) — a
+  market without trades in a minute has no candle, so a gap in the files is
+  not necessarily missing data.
+
+:func:`missing_ranges` walks the candle grid of ``[start, end)`` and returns
+the stretches that are neither on disk nor checkpointed; only candles that
+have closed count, so an interrupted or nightly re-run resumes where the
+previous one stopped and never duplicates rows.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import os
+import pathlib
+from typing import Iterable, List, Optional, Set, Tuple
+
+import orjson as jsonf
+
+Range = Tuple[int, int]
+
+
+def merge_ranges(ranges: Iterable[Range]) -> List[Range]:
+    out: List[Range] = []
+    for s, e in sorted(r for r in ranges if r[1] > r[0]):
+        if out and s <= out[-1][1]:
+            out[-1] = (out[-1][0], max(out[-1][1], e))
+        else:
+            out.append((s, e))
+    return out
+
+
+def closed_until(step_ms: int, now_ms: Optional[int] = None) -> int:
+    """Open time of the candle that is still forming (everything before it is final)."""
+    now_ms = int(dt.datetime.now(dt.timezone.utc).timestamp() * 1000) if now_ms is None else now_ms
+    return now_ms - now_ms % step_ms
+
+
+def missing_ranges(start_ms: int, end_ms: int, step_ms: int, present: Set[int], done: Iterable[Range]) -> List[Range]:
+    """Stretches of the candle grid in ``[start_ms, end_ms)`` not on disk and not yet fetched."""
+    done = merge_ranges(done)
+    out: List[Range] = []
+    i = 0
+    t = start_ms + (-start_ms) % step_ms
+    while t < end_ms:
+        while i < len(done) and done[i][1] <= t:
+            i += 1
+        if i < len(done) and done[i][0] <= t:
+            t = done[i][1] + (-done[i][1]) % step_ms  # hele checkpoint-range overslaan
+            continue
+        if t not in present:
+            if out and out[-1][1] == t:
+                out[-1] = (out[-1][0], t + step_ms)
+            else:
+                out.append((t, t + step_ms))
+        t += step_ms
+    return [(s, min(e, end_ms)) for s, e in out]
+
+
+def split_ranges(ranges: Iterable[Range], span_ms: int) -> List[Range]:
+    """Request windows of at most ``span_ms``; gaps that fit in one window share it."""
+    joined: List[Range] = []
+    for s, e in sorted(ranges):
+        if joined and e - joined[-1][0] <= span_ms:
+            joined[-1] = (joined[-1][0], e)  # candles ertussen vallen weg in de dedup
+        else:
+            joined.append((s, e))
+    out = []
+    for s, e in joined:
+        while s < e:
+            out.append((s, min(e, s + span_ms)))
+            s += span_ms
+    return out
+
+
+def jsonl_open_times(paths: Iterable[pathlib.Path]) -> Set[int]:
+    """Candle open times in backfill/live JSONL files (``{"candle": [t, o, h, l, c, v]}``)."""
+    present: Set[int] = set()
+    for path in paths:
+        try:
+            raw = path.read_bytes()
+        except FileNotFoundError:
+            continue
+        for line in raw.splitlines():
+            try:
+                candle = jsonf.loads(line).get("candle")
+                present.add(int(candle[0]))
+            except (ValueError, TypeError, AttributeError, IndexError):
+                continue
+    return present
+
+
+class Checkpoint:
+    """Fetched ranges of one (market, interval), stored as ``<dir>/<interval>/<market>.json``."""
+
+    def __init__(self, state_dir: pathlib.Path, market: str, interval: str):
+        self.path = pathlib.Path(state_dir) / interval / f"{market.replace('/', '-')}.json"
+        self.ranges: List[Range] = []
+
+    def load(self) -> "Checkpoint":
+        try:
+            data = jsonf.loads(self.path.read_bytes())
+            self.ranges = merge_ranges((int(s), int(e)) for s, e in data.get("ranges", []))
+        except FileNotFoundError:
+            self.ranges = []
+        except (ValueError, TypeError):
+            self.ranges = []  # kapot checkpoint: alles opnieuw bekijken (dedup voorkomt dubbele rijen)
+        return self
+
+    def mark(self, start_ms: int, end_ms: int) -> None:
+        """Record ``[start_ms, end_ms)`` as fetched and persist atomically."""
+        if end_ms <= start_ms:
+            return
+        self.ranges = merge_ranges(self.ranges + [(start_ms, end_ms)])
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        tmp.write_bytes(jsonf.dumps({"ranges": self.ranges}))
+        os.replace(tmp, self.path)
+
+
+__all__ = [
+    "Checkpoint",
+    "closed_until",
+    "jsonl_open_times",
+    "merge_ranges",
+    "missing_ranges",
+    "split_ranges",
+]
@@ -0,0 +1,248 @@
+"""Trade-to-bar builder: time, volume and dollar bars from the trades stream.
+
+The exchange's smallest candle is one minute.  :class:`BarBuilder` turns
+individual trades into bars of any of these kinds (``BAR_SPECS``):
+
+``1s``, ``10s``, ``1m``   time bars, aligned to the epoch (UTC); a second
+                          without trades has no bar
+``volume:<amount>``       closes once the traded base amount reaches it
+``dollar:<eur>``          closes once the traded quote notional reaches it
+
+Per market and spec only one small accumulator is kept (fixed-point ticks,
+``__slots__``).  A time bar is emitted when a trade of a later bucket arrives
+or when :meth:`BarBuilder.flush_due` sees the bucket is ``grace_ms`` past its
+end; volume and dollar bars are emitted by the trade that reaches the
+threshold (that trade is not split).  Every emitted bar is final.
+
+Trades fed with their stream ``entry_id`` are tracked until every bar they
+went into has been emitted; :meth:`BarBuilder.take_ackable` then returns
+them, so a consumer group only acknowledges entries whose bars are out.
+Such bars carry ``last_entry`` (the newest entry id in them), and
+:meth:`BarBuilder.resume` with those ids makes a replay of pending entries
+after a crash skip what already went into an emitted bar.
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .fixedpoint import Number, mul, to_str, to_ticks
+
+KINDS = ("time", "volume", "dollar")
+
+_TIME_UNITS = {"s": 1000, "m": 60_000, "h": 3_600_000}
+
+EntryId = Tuple[int, int]
+
+
+def parse_entry_id(entry_id: Union[str, bytes]) -> EntryId:
+    """Redis stream id ``"<ms>-<seq>"`` -> ``(ms, seq)`` (orderable)."""
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+@dataclass(frozen=True)
+class BarSpec:
+    name: str
+    kind: str
+    size: int  # ms voor time, ticks (base amount of quote notional) voor volume/dollar
+
+    @property
+    def stream(self) -> str:
+        return f"bitvavo:bars:{self.name}"
+
+
+def parse_spec(text: str) -> BarSpec:
+    name = text.strip()
+    kind, sep, value = name.partition(":")
+    if not sep:
+        unit = name[-1:]
+        if unit not in _TIME_UNITS or not name[:-1].isdigit() or int(name[:-1]) <= 0:
+            raise ValueError(f"Onbekende bar-spec: {name} (toegestaan: <n>s|<n>m|<n>h, volume:<n>, dollar:<n>)")
+        return BarSpec(name, "time", int(name[:-1]) * _TIME_UNITS[unit])
+    if kind not in KINDS[1:]:
+        raise ValueError(f"Onbekende bar-spec: {name} (toegestaan: <n>s|<n>m|<n>h, volume:<n>, dollar:<n>)")
+    size = to_ticks(value)
+    if size <= 0:
+        raise ValueError(f"Bar-drempel moet positief zijn: {name}")
+    return BarSpec(name, kind, size)
+
+
+def parse_specs(text: str) -> List[BarSpec]:
+    """``"1s,10s,volume:5,dollar:50000"`` -> specs (duplicates dropped)."""
+    specs: Dict[str, BarSpec] = {}
+    for part in text.split(","):
+        if part.strip():
+            spec = parse_spec(part)
+            specs.setdefault(spec.name, spec)
+    return list(specs.values())
+
+
+class _Acc:
+    __slots__ = ("open_time", "close_time", "open", "high", "low", "close", "volume", "notional", "trades", "entries")
+
+    def __init__(self, open_time: int, ts: int, price: int, amount: int, notional: int):
+        self.open_time = open_time
+        self.close_time = ts
+        self.open = self.high = self.low = self.close = price
+        self.volume = amount
+        self.notional = notional
+        self.trades = 1
+        self.entries: Optional[List[str]] = None  # stream-ids van de trades (alleen met entry_id)
+
+    def add(self, ts: int, price: int, amount: int, notional: int) -> None:
+        if price > self.high:
+            self.high = price
+        if price < self.low:
+            self.low = price
+        self.close = price
+        if ts > self.close_time:
+            self.close_time = ts
+        self.volume += amount
+        self.notional += notional
+        self.trades += 1
+
+    def bar(self, market: str, spec: BarSpec) -> dict:
+        return {
+            "event": "bar",
+            "market": market,
+            "bar": spec.name,
+            "open_time": self.open_time,
+            "close_time": self.close_time,
+            "open": to_str(self.open),
+            "high": to_str(self.high),
+            "low": to_str(self.low),
+            "close": to_str(self.close),
+            "volume": to_str(self.volume),
+            "notional": to_str(self.notional),
+            "trades": self.trades,
+            **({"last_entry": self.entries[-1]} if self.entries else {}),
+        }
+
+
+class BarBuilder:
+    """Per-market accumulators for each :class:`BarSpec`; ``emit(spec, bar)`` gets closed bars.
+
+    Not thread-safe: feed it from one consumer thread, in stream order.  Trades
+    for a time bar that was already emitted are dropped and counted in
+    :attr:`late`.
+    """
+
+    def __init__(self, specs: Sequence[BarSpec], emit: Callable[[BarSpec, dict], None], grace_ms: int = 500):
+        self.specs = list(specs)
+        self._emit = emit
+        self.grace_ms = grace_ms
+        self._acc: List[Dict[str, _Acc]] = [{} for _ in self.specs]
+        self._closed: List[Dict[str, int]] = [{} for _ in self.specs]  # time: open_time laatst uitgestuurde bar
+        self._done: List[Dict[str, EntryId]] = [{} for _ in self.specs]  # markt -> laatste entry in een uitgestuurde bar
+        self._refs: Dict[str, int] = {}  # entry-id -> aantal open bars waar hij nog in zit
+        self._ackable: List[str] = []
+        self.trades = 0
+        self.emitted = 0
+        self.late = 0
+
+    def resume(self, spec_name: str, market: str, last_entry: Union[str, bytes]) -> None:
+        """Record that ``spec_name``'s bars for ``market`` already cover entries up to ``last_entry``."""
+        for i, spec in enumerate(self.specs):
+            if spec.name == spec_name:
+                eid = parse_entry_id(last_entry)
+                if eid > self._done[i].get(market, (-1, -1)):
+                    self._done[i][market] = eid
+
+    def on_trade(
+        self, market: str, price: Number, amount: Number, timestamp_ms: int, entry_id: Optional[str] = None,
+    ) -> None:
+        try:
+            p, a, ts = to_ticks(price), to_ticks(amount), int(timestamp_ms)
+            eid = parse_entry_id(entry_id) if entry_id is not None else None
+        except (TypeError, ValueError):
+            if entry_id is not None:
+                self._ackable.append(entry_id)
+            return
+        notional = mul(p, a)
+        self.trades += 1
+        refs = 0
+        for i, spec in enumerate(self.specs):
+            if eid is not None and eid <= self._done[i].get(market, (-1, -1)):
+                continue  # replay: zit al in een uitgestuurde bar
+            accs = self._acc[i]
+            acc = accs.get(market)
+            if spec.kind == "time":
+                start = ts - ts % spec.size
+                if start <= self._closed[i].get(market, -1) or (acc is not None and start < acc.open_time):
+                    self.late += 1
+                    continue
+                if acc is not None and start != acc.open_time:
+                    self._close(i, market)
+                    acc = None
+                if acc is None:
+                    acc = accs[market] = _Acc(start, ts, p, a, notional)
+                else:
+                    acc.add(ts, p, a, notional)
+                refs += self._track(acc, entry_id)
+                continue
+            if acc is None:
+                acc = accs[market] = _Acc(ts, ts, p, a, notional)
+            else:
+                acc.add(ts, p, a, notional)
+            refs += self._track(acc, entry_id)
+            if (acc.volume if spec.kind == "volume" else acc.notional) >= spec.size:
+                self._close(i, market)
+        if entry_id is not None and not refs:
+            self._ackable.append(entry_id)  # in geen enkele bar terechtgekomen
+
+    def flush_due(self, now_ms: Optional[int] = None) -> int:
+        """Emit time bars whose bucket ended ``grace_ms`` ago; returns bars emitted."""
+        cutoff = (int(time.time() * 1000) if now_ms is None else now_ms) - self.grace_ms
+        n = 0
+        for i, spec in enumerate(self.specs):
+            if spec.kind != "time":
+                continue
+            for market in [m for m, acc in self._acc[i].items() if acc.open_time + spec.size <= cutoff]:
+                self._close(i, market)
+                n += 1
+        return n
+
+    def open_bars(self) -> int:
+        return sum(len(accs) for accs in self._acc)
+
+    def take_ackable(self) -> List[str]:
+        """Entry ids whose bars have all been emitted since the previous call."""
+        ids, self._ackable = self._ackable, []
+        return ids
+
+    def pending_entries(self) -> int:
+        return len(self._refs)
+
+    def _track(self, acc: _Acc, entry_id: Optional[str]) -> int:
+        if entry_id is None:
+            return 0
+        if acc.entries is None:
+            acc.entries = []
+        acc.entries.append(entry_id)
+        self._refs[entry_id] = self._refs.get(entry_id, 0) + 1
+        return 1
+
+    def _close(self, i: int, market: str) -> None:
+        spec = self.specs[i]
+        acc = self._acc[i].pop(market)
+        if spec.kind == "time":
+            self._closed[i][market] = acc.open_time
+        self._emit(spec, acc.bar(market, spec))
+        self.emitted += 1
+        if acc.entries:
+            self._done[i][market] = parse_entry_id(acc.entries[-1])
+            # refs pas na emit vrijgeven: een entry wordt nooit geackt voor zijn bar er is
+            for entry_id in acc.entries:
+                left = self._refs[entry_id] - 1
+                if left:
+                    self._refs[entry_id] = left
+                else:
+                    del self._refs[entry_id]
+                    self._ackable.append(entry_id)
+
+
+__all__ = ["BarBuilder", "BarSpec", "KINDS", "parse_entry_id", "parse_spec", "parse_specs"]
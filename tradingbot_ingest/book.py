@@ -0,0 +1,221 @@
+"""Sorted price-level containers for the local Bitvavo order books.
+
+``bookUpdate`` messages only touch a handful of levels, so re-sorting a whole
+side per message is wasted work.  :class:`BookSide` keeps the levels in a
+sorted array of integer price ticks (``bisect`` insert/delete) next to a dict
+with the original strings, which keeps the best level an O(1) lookup and the
+top-N view a plain slice.
+"""
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .fixedpoint import DEFAULT_DECIMALS, to_ticks
+from .reorder import ReorderBuffer
+
+# tick-keys op de gedeelde fixed-point schaal (exact voor alle Bitvavo prijzen)
+PRICE_DECIMALS = DEFAULT_DECIMALS
+
+Level = Tuple[str, str]
+
+
+def price_to_ticks(price: str, decimals: int = PRICE_DECIMALS) -> int:
+    """Convert a decimal price string into an integer number of ticks."""
+    return to_ticks(price, decimals)
+
+
+def is_zero_amount(amount: str) -> bool:
+    """``True`` for ``"0"``, ``"0.0"``, ``"0.00000000"`` and friends."""
+    return not amount.strip("0.")
+
+
+class BookSide:
+    """One side (bids or asks) of a depth-limited local order book.
+
+    Keys are stored best-first: asks ascending, bids as negated ticks so that
+    index 0 is always the best price for either side.
+    """
+
+    __slots__ = ("depth", "descending", "_keys", "_levels")
+
+    def __init__(self, depth: int, descending: bool = False):
+        self.depth = depth
+        self.descending = descending
+        self._keys: List[int] = []
+        self._levels: Dict[int, Level] = {}
+
+    def _key(self, price: str) -> int:
+        ticks = to_ticks(price)
+        return -ticks if self.descending else ticks
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __bool__(self) -> bool:
+        return bool(self._keys)
+
+    def __iter__(self) -> Iterator[Level]:
+        levels = self._levels
+        for k in self._keys:
+            yield levels[k]
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._levels.clear()
+
+    def set(self, price: str, amount: str) -> None:
+        key = self._key(price)
+        if is_zero_amount(amount):
+            if self._levels.pop(key, None) is not None:
+                keys = self._keys
+                del keys[bisect_left(keys, key)]
+            return
+        if key not in self._levels:
+            keys = self._keys
+            keys.insert(bisect_left(keys, key), key)
+        self._levels[key] = (price, amount)
+
+    def apply(self, levels: Iterable[Sequence[str]]) -> None:
+        """Apply ``[price, amount]`` pairs, then cut back to ``depth`` levels."""
+        for price, amount in levels:
+            self.set(price, amount)
+        self._trim()
+
+    def _trim(self) -> None:
+        keys = self._keys
+        if len(keys) <= self.depth:
+            return
+        levels = self._levels
+        for k in keys[self.depth:]:
+            del levels[k]
+        del keys[self.depth:]
+
+    def best(self) -> Optional[Level]:
+        if not self._keys:
+            return None
+        return self._levels[self._keys[0]]
+
+    def best_ticks(self) -> Optional[int]:
+        """Best price in ticks (:data:`PRICE_DECIMALS`), without re-parsing the string."""
+        if not self._keys:
+            return None
+        k = self._keys[0]
+        return -k if self.descending else k
+
+    def top(self, n: int) -> List[Level]:
+        levels = self._levels
+        return [levels[k] for k in self._keys[:n]]
+
+
+Top = Tuple[float, float, float, float]
+
+
+class LocalBook:
+    """Local state of one market: both sides, nonce chain and reorder buffer.
+
+    Updates are only applied when they continue the nonce chain of the REST
+    snapshot.  Anything ahead of the chain is parked in the reorder buffer and
+    drained during a short, non-blocking grace window after each snapshot.
+    """
+
+    def __init__(self, depth: int, grace_ms: int = 250, reorder_max: int = 2000):
+        self.depth = depth
+        self.grace_ms = grace_ms
+        self.bids = BookSide(depth, descending=True)
+        self.asks = BookSide(depth)
+        self.last_nonce: int = -1
+        self.seeded: bool = False
+        self.buffer = ReorderBuffer(reorder_max)  # nonce -> ruwe update
+        self.await_until: Optional[float] = None  # epoch-seconden (deadline) na snapshot
+        self.last_top: Optional[Top] = None
+        self._top_levels: Optional[Tuple[Level, Level]] = None
+        self._top: Optional[Top] = None
+
+    def _apply_side(self, side: str, levels) -> None:
+        # gesorteerde tick-array: alleen de geraakte levels verschuiven, top N blijft vooraan
+        book = self.bids if side == "bids" else self.asks
+        book.apply(levels)
+
+    def apply_snapshot(self, snap: dict) -> None:
+        self.bids.clear(); self.asks.clear()
+        self._apply_side("bids", snap.get("bids", []))
+        self._apply_side("asks", snap.get("asks", []))
+        self.last_nonce = int(snap.get("nonce", -1))
+        self.seeded = True
+        self.last_top = None
+        # alles t/m de snapshot-nonce is al verwerkt in de snapshot
+        self.buffer.drop_through(self.last_nonce)
+        # Zet non-blocking grace-deadline
+        self.await_until = time.time() + (self.grace_ms / 1000.0)
+
+    def _apply(self, upd: dict, n: int) -> None:
+        self._apply_side("bids", upd.get("bids", []))
+        self._apply_side("asks", upd.get("asks", []))
+        self.last_nonce = n
+
+    def try_apply_update(self, upd: dict) -> bool:
+        try:
+            n = int(upd.get("nonce", -1))
+        except (TypeError, ValueError):
+            return False
+        if not self.seeded:
+            self.buffer.push(n, upd); return False
+        if n == self.last_nonce + 1:
+            self._apply(upd, n)
+            # gat was misschien net gedicht: direct de rest van de keten meenemen
+            if self.buffer:
+                self.drain()
+            return True
+        if n > self.last_nonce:
+            # Niet direct weggooien; in buffer houden (kan nog *de* missing N+1 zijn)
+            self.buffer.push(n, upd)
+        return False
+
+    def can_drain_now(self) -> bool:
+        """Mag in main-loop proberen door te trekken? (alleen na snapshot en binnen de grace)"""
+        return self.seeded and self.await_until is not None and time.time() <= self.await_until
+
+    def drain(self) -> int:
+        """
+        **Niet-blokkerend** doortrekken van de reorder-buffer:
+        - Zolang expected (last_nonce+1) in de buffer zit -> toepassen (hele keten in één call)
+        - Anders: niets doen (wachten in volgende main-loop iteratie)
+        Return: aantal toegepaste updates (0 -> nog wachten of grace is straks op)
+        """
+        if not self.seeded or not self.buffer:
+            return 0
+        applied = 0
+        for upd in self.buffer.pop_run(self.last_nonce + 1):
+            self._apply(upd, self.last_nonce + 1)
+            applied += 1
+        return applied
+
+    def grace_expired(self) -> bool:
+        return self.await_until is not None and time.time() > self.await_until
+
+    def mark_out_of_sync(self) -> None:
+        self.seeded = False
+        self.await_until = None
+        self.buffer.clear()
+        self.last_top = None
+
+    def current_top(self) -> Optional[Top]:
+        bid = self.bids.best()
+        ask = self.asks.best()
+        if bid is None or ask is None:
+            return None
+        # de meeste updates raken de top niet: dan geen nieuwe float-conversie
+        levels = (bid, ask)
+        if levels == self._top_levels:
+            return self._top
+        try:
+            top = (float(bid[0]), float(bid[1]), float(ask[0]), float(ask[1]))
+        except (TypeError, ValueError):
+            return None
+        self._top_levels, self._top = levels, top
+        return top
+
+
+__all__ = ["BookSide", "Level", "LocalBook", "PRICE_DECIMALS", "Top", "is_zero_amount", "price_to_ticks"]
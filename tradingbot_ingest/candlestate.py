@@ -0,0 +1,93 @@
+"""Closed-candle detection for the exchange's candle updates.
+
+Bitvavo pushes the forming candle again on every trade, with the same open
+time.  Stored and forwarded as-is, one 1m candle becomes dozens of stream
+entries and rows, and consumers count each of them as a new bar.
+:class:`CandleState` keeps the latest update per (market, interval):
+
+* an update with the same open time replaces the held candle (in progress);
+* an update with a later open time closes the held candle;
+* :meth:`CandleState.flush_due` closes candles whose interval ended
+  ``grace_ms`` ago without a successor (no trades in the next interval);
+* updates for an open time that is already closed are dropped.
+
+``emit(market, interval, candle, closed)`` gets every closed candle once and,
+with ``live=True``, every changed in-progress update as well.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .aggregate import INTERVAL_MS
+
+Emit = Callable[[str, str, list, bool], None]
+
+_Out = Tuple[str, str, list, bool]
+
+
+class CandleState:
+    """Latest candle per (market, interval); emits each open time once as closed."""
+
+    def __init__(self, emit: Emit, live: bool = False, grace_ms: int = 2000):
+        self._emit = emit
+        self.live = live
+        self.grace_ms = grace_ms
+        self._lock = threading.Lock()
+        self._open: Dict[Tuple[str, str], list] = {}  # (markt, interval) -> laatste update
+        self._closed: Dict[Tuple[str, str], int] = {}  # (markt, interval) -> open_time laatst afgesloten
+        self.updates = 0
+        self.closed = 0
+        self.dropped = 0
+
+    def update(self, market: str, interval: str, candle: Sequence) -> None:
+        try:
+            open_time = int(candle[0])
+        except (TypeError, ValueError, IndexError):
+            return
+        candle = [open_time, *candle[1:]]
+        key = (market, interval)
+        out: List[_Out] = []
+        with self._lock:
+            self.updates += 1
+            if open_time <= self._closed.get(key, -1):
+                self.dropped += 1
+                return
+            held = self._open.get(key)
+            if held is not None and open_time < held[0]:
+                self.dropped += 1
+                return
+            if held is not None and open_time > held[0]:
+                self._close(key, out)
+                held = None
+            if held is None or held[1:] != candle[1:]:
+                self._open[key] = candle
+                if self.live:
+                    out.append((market, interval, candle, False))
+        self._send(out)
+
+    def flush_due(self, now_ms: Optional[int] = None) -> int:
+        """Close candles whose interval ended more than ``grace_ms`` ago; returns the number closed."""
+        cutoff = (int(time.time() * 1000) if now_ms is None else now_ms) - self.grace_ms
+        out: List[_Out] = []
+        with self._lock:
+            for key, candle in list(self._open.items()):
+                step = INTERVAL_MS.get(key[1])
+                if step is not None and candle[0] + step <= cutoff:
+                    self._close(key, out)
+        self._send(out)
+        return len(out)
+
+    def _close(self, key: Tuple[str, str], out: List[_Out]) -> None:
+        candle = self._open.pop(key)
+        self._closed[key] = candle[0]
+        self.closed += 1
+        out.append((key[0], key[1], candle, True))
+
+    def _send(self, out: List[_Out]) -> None:
+        for market, interval, candle, closed in out:
+            self._emit(market, interval, candle, closed)
+
+
+__all__ = ["CandleState"]
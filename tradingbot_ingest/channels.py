@@ -0,0 +1,295 @@
+"""Pluggable channel handlers for :class:`~tradingbot_ingest.engine.IngestEngine`.
+
+Each handler owns one Bitvavo websocket channel: it registers its per-market
+subscriptions on the shared socket, normalises the SDK payloads and hands the
+resulting events to the engine's publisher and sink.  Handlers run on the
+engine's event loop, so per-market state (like the local order books) is only
+ever touched from a single thread.
+"""
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence
+
+from redis import Redis
+
+from .aggregate import BASE_INTERVAL, CandleAggregator, plan_intervals
+from .book import LocalBook
+from .candlestate import CandleState
+from .conflate import TopConflator
+
+if TYPE_CHECKING:
+    from .engine import IngestEngine
+
+
+def unwrap(payload: object) -> List[dict]:
+    """Normalise ``{"data": {...}}`` envelopes, flat dicts and lists to event dicts."""
+    items = payload if isinstance(payload, list) else [payload]
+    events = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        data = item.get("data")
+        events.append(dict(data) if isinstance(data, dict) else dict(item))
+    return events
+
+
+def market_of(ev: dict, default: str = "unknown") -> str:
+    return ev.get("market") or ev.get("marketId") or ev.get("pair") or default
+
+
+class ChannelHandler:
+    """Base class: subscribe per market, handle payloads, optional background task."""
+
+    name = ""
+
+    def bind(self, engine: "IngestEngine") -> None:
+        self.engine = engine
+
+    def subscribe(self, ws, market: str) -> None:
+        raise NotImplementedError
+
+    async def run(self) -> None:
+        """Background work next to the websocket stream (default: none)."""
+        return None
+
+
+class Ticker24hHandler(ChannelHandler):
+    name = "ticker24h"
+
+    def subscribe(self, ws, market: str) -> None:
+        ws.subscriptionTicker24h(market, self.engine.callback(self.handle, market))
+
+    def handle(self, market: str, payload: object) -> None:
+        for ev in unwrap(payload):
+            ev.setdefault("event", "ticker24h")
+            self.engine.publisher.publish("bitvavo:ticker24h", ev)
+            self.engine.sink.add("ticker24h", market_of(ev, market), ev)
+
+
+class TradesHandler(ChannelHandler):
+    """Trades; ``on_trade(market, ev)`` additionally sees every trade (e.g. the candle aggregator)."""
+
+    name = "trades"
+
+    def __init__(self, on_trade: Optional[Callable[[str, dict], None]] = None):
+        self.on_trade = on_trade
+
+    def subscribe(self, ws, market: str) -> None:
+        ws.subscriptionTrades(market, self.engine.callback(self.handle, market))
+
+    def handle(self, market: str, payload: object) -> None:
+        for ev in unwrap(payload):
+            ev.setdefault("event", "trades")
+            self.engine.publisher.publish("bitvavo:trades", ev)
+            self.engine.sink.add("trades", market_of(ev, market), ev)
+            if self.on_trade is not None:
+                self.on_trade(market_of(ev, market), ev)
+
+
+class CandlesHandler(ChannelHandler):
+    """Candles per interval; with ``source`` candles/trades the derivable ones are built locally.
+
+    ``source="candles"`` subscribes only 1m at the exchange and aggregates
+    5m/15m/1h/... from it; ``source="trades"`` derives every interval
+    (including 1m) from the trades channel, which then has to be enabled with
+    ``TradesHandler(on_trade=handler.on_trade)``.
+    See :class:`~tradingbot_ingest.aggregate.CandleAggregator`.
+
+    Only closed candles (``"closed": true``) go to ``bitvavo:candles:<interval>``
+    and the sink; repeated updates of the forming candle are collapsed by
+    :class:`~tradingbot_ingest.candlestate.CandleState`.  With ``live`` the
+    in-progress updates go to ``bitvavo:candles:<interval>:live``.
+    """
+
+    name = "candles"
+
+    def __init__(self, intervals: Sequence[str], source: str = "off", grace_ms: int = 2000, live: bool = False):
+        self.intervals = list(intervals)
+        self.source = source
+        self.live = live
+        self.subscribed, derived = plan_intervals(self.intervals, source)
+        self.aggregator = CandleAggregator(self._publish, derived, grace_ms) if derived else None
+        self.state = CandleState(self._publish, live, grace_ms)
+
+    def subscribe(self, ws, market: str) -> None:
+        for itv in self.subscribed:
+            ws.subscriptionCandles(market, itv, self.engine.callback(self.handle, market, itv))
+
+    def handle(self, market: str, interval: str, payload: object) -> None:
+        feed = self.aggregator is not None and self.source == "candles" and interval == BASE_INTERVAL
+        for ev in unwrap(payload):
+            candles = ev.get("candle") or []
+            if not isinstance(candles, list):
+                continue
+            m = ev.get("market", market)
+            for c in candles:
+                if interval in self.intervals:
+                    self.state.update(m, interval, c)
+                if feed:
+                    self.aggregator.on_candle(m, c)
+
+    def on_trade(self, market: str, ev: dict) -> None:
+        if self.aggregator is not None and self.source == "trades":
+            self.aggregator.on_trade(market, ev.get("price"), ev.get("amount"), ev.get("timestamp"))
+
+    def _publish(self, market: str, interval: str, candle: list, closed: bool) -> None:
+        obj = {"market": market, "interval": interval, "candle": candle, "closed": closed}
+        if closed:
+            self.engine.publisher.publish(f"bitvavo:candles:{interval}", obj)
+            self.engine.sink.add(f"candles:{interval}", market, obj)
+        elif self.live:
+            self.engine.publisher.publish(f"bitvavo:candles:{interval}:live", obj)
+
+    async def run(self) -> None:
+        while True:
+            # candles zonder opvolger (geen trades in het volgende interval) afsluiten
+            await asyncio.sleep(1.0)
+            self.state.flush_due()
+            if self.aggregator is not None:
+                self.aggregator.flush_due()
+
+
+class BookHandler(ChannelHandler):
+    """Incremental order books: bookUpdate stream, REST snapshots and top-of-book.
+
+    With ``conflate_ms > 0`` top-of-book changes are conflated per market
+    (see :class:`~tradingbot_ingest.conflate.TopConflator`); the counters are
+    reported to ``metrics_redis`` every ``report_secs`` when it is given.
+    """
+
+    name = "book"
+
+    def __init__(
+        self,
+        depth: int = 100,
+        grace_ms: int = 250,
+        reorder_max: int = 2000,
+        conflate_ms: int = 0,
+        metrics_redis: Optional[Redis] = None,
+        report_secs: float = 10.0,
+    ):
+        self.depth = depth
+        self.grace_ms = grace_ms
+        self.reorder_max = reorder_max
+        self.books: Dict[str, LocalBook] = {}
+        self.conflator = TopConflator(self._publish_top, conflate_ms / 1000.0)
+        self.metrics_redis = metrics_redis
+        self.report_secs = report_secs
+
+    def _book(self, market: str) -> LocalBook:
+        lb = self.books.get(market)
+        if lb is None:
+            lb = self.books[market] = LocalBook(self.depth, self.grace_ms, self.reorder_max)
+        return lb
+
+    def subscribe(self, ws, market: str) -> None:
+        self._book(market)
+        ws.subscriptionBookUpdate(market, self.engine.callback(self.handle, market))
+
+    def handle(self, market: str, payload: object) -> None:
+        for data in unwrap(payload):
+            update = {
+                "market": data.get("market", market),
+                "nonce": data.get("nonce"),
+                "bids": data.get("bids", []),
+                "asks": data.get("asks", []),
+            }
+            obj = {"event": "bookUpdate", "market": market, "data": update, "timestamp": int(time.time() * 1000)}
+            self.engine.publisher.publish(f"bitvavo:book:{market}", obj)
+            self.engine.sink.add("orderbook:update", market, obj)
+            lb = self._book(market)
+            if lb.try_apply_update(update):
+                self.emit_top(market, lb, "realtime")
+
+    def emit_top(self, market: str, lb: LocalBook, origin: str) -> None:
+        top = lb.current_top()
+        if not top or lb.last_top == top:
+            return
+        bid_price, bid_amount, ask_price, ask_amount = top
+        payload = {
+            "event": "topOfBook",
+            "market": market,
+            "bestBid": bid_price,
+            "bestBidSize": bid_amount,
+            "bestAsk": ask_price,
+            "bestAskSize": ask_amount,
+            "nonce": lb.last_nonce,
+            "source": origin,
+            "timestamp": int(time.time() * 1000),
+        }
+        self.conflator.offer(market, payload)
+        lb.last_top = top
+
+    def _publish_top(self, market: str, payload: dict) -> None:
+        self.engine.publisher.publish("bitvavo:book", payload)
+        self.engine.sink.add("orderbook:top", market, payload)
+
+    async def seed(self, market: str) -> bool:
+        await self.engine.wait_for_budget()
+        try:
+            snap = await self.engine.rest(self.engine.bv.book, market, {"depth": self.depth})
+        except Exception as e:
+            print(f"[err] snapshot {market}: {e}", file=sys.stderr)
+            return False
+        finally:
+            self.engine.limiter.observe_client(self.engine.bv)
+        lb = self._book(market)
+        lb.apply_snapshot(snap)
+        payload = {"event": "snapshot", "market": market, "data": snap, "timestamp": int(time.time() * 1000)}
+        self.engine.publisher.publish(f"bitvavo:book:{market}", payload)
+        self.engine.sink.add("orderbook:snapshot", market, payload)
+        self.emit_top(market, lb, "snapshot")
+        return True
+
+    async def _conflate(self) -> None:
+        next_report = time.monotonic() + self.report_secs
+        try:
+            while True:
+                await asyncio.sleep(min(self.conflator.window_secs / 4, 0.05))
+                self.conflator.flush_due()
+                if self.metrics_redis is not None and time.monotonic() >= next_report:
+                    next_report = time.monotonic() + self.report_secs
+                    try:
+                        await self.engine.rest(self.conflator.report, self.metrics_redis)
+                    except Exception as e:
+                        print(f"[conflate] metrics report failed: {e}", file=sys.stderr)
+        finally:
+            # bij stoppen de laatste tops niet kwijtraken
+            self.conflator.flush_all()
+
+    async def run(self) -> None:
+        if self.conflator.enabled:
+            await asyncio.gather(self._drain(), self._conflate())
+        else:
+            await self._drain()
+
+    async def _drain(self) -> None:
+        while True:
+            progressed = 0
+            for m, lb in list(self.books.items()):
+                if not lb.seeded:
+                    await self.seed(m)
+                    continue
+                if lb.can_drain_now():
+                    if lb.drain():
+                        self.emit_top(m, lb, "buffered")
+                        progressed += 1
+                        continue
+                    if lb.grace_expired():
+                        print(f"[resync] {m} grace expired at nonce={lb.last_nonce}", file=sys.stderr)
+                        lb.mark_out_of_sync()
+            await asyncio.sleep(0.02 if progressed else 0.08)
+
+
+__all__ = [
+    "BookHandler",
+    "CandlesHandler",
+    "ChannelHandler",
+    "Ticker24hHandler",
+    "TradesHandler",
+    "market_of",
+    "unwrap",
+]
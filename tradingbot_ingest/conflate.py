@@ -0,0 +1,110 @@
+"""Top-of-book conflation for the aggregate ``bitvavo:book`` stream.
+
+Every change of best bid/ask used to go straight to ``bitvavo:book``; in a
+volatile minute that is thousands of entries per market that the signal
+engine and the guards only skip over.  :class:`TopConflator` holds the latest
+top per market for a short window (opened by the first change) and emits only
+that one when the window closes.  A top that ends the window where the last
+emitted one was is dropped entirely.
+
+The conflator does no I/O itself: callers drive :meth:`flush_due` from their
+own loop (thread or asyncio task), so ``emit`` always runs where the caller's
+sinks expect it.  ``offered / emitted`` is the conflation ratio; counters are
+pushed to Redis by :meth:`report` and exposed by ``tools/metrics_sidecar.py``.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from redis import Redis
+
+METRICS_KEY = "metrics:book_conflation"
+
+_TopKey = Tuple[object, object, object, object]
+
+
+def _top_key(payload: dict) -> _TopKey:
+    return (payload.get("bestBid"), payload.get("bestBidSize"), payload.get("bestAsk"), payload.get("bestAskSize"))
+
+
+class TopConflator:
+    """Coalesce per-market top-of-book payloads within ``window_secs``.
+
+    With ``window_secs <= 0`` every offer is emitted immediately (no conflation).
+    """
+
+    def __init__(self, emit: Callable[[str, dict], None], window_secs: float = 0.1):
+        self._emit = emit
+        self.window_secs = window_secs
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[float, dict]] = {}  # market -> (deadline, laatste payload)
+        self._last: Dict[str, _TopKey] = {}
+        self.offered = 0
+        self.emitted = 0
+        self._reported = (0, 0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_secs > 0
+
+    def offer(self, market: str, payload: dict) -> None:
+        if not self.enabled:
+            self.offered += 1
+            self.emitted += 1
+            self._emit(market, payload)
+            return
+        with self._lock:
+            self.offered += 1
+            pending = self._pending.get(market)
+            deadline = pending[0] if pending else time.monotonic() + self.window_secs
+            self._pending[market] = (deadline, payload)
+
+    def _take(self, now: Optional[float]) -> List[Tuple[str, dict]]:
+        out = []
+        with self._lock:
+            for market, (deadline, payload) in list(self._pending.items()):
+                if now is not None and deadline > now:
+                    continue
+                del self._pending[market]
+                key = _top_key(payload)
+                if self._last.get(market) == key:
+                    continue  # top is binnen het window teruggekeerd naar de vorige
+                self._last[market] = key
+                out.append((market, payload))
+            self.emitted += len(out)
+        return out
+
+    def flush_due(self, now: Optional[float] = None) -> int:
+        """Emit every market whose window has closed; returns the number emitted."""
+        if not self._pending:
+            return 0
+        due = self._take(time.monotonic() if now is None else now)
+        for market, payload in due:
+            self._emit(market, payload)
+        return len(due)
+
+    def flush_all(self) -> int:
+        due = self._take(None)
+        for market, payload in due:
+            self._emit(market, payload)
+        return len(due)
+
+    def ratio(self) -> float:
+        return self.offered / self.emitted if self.emitted else 0.0
+
+    def report(self, redis: Redis, key: str = METRICS_KEY) -> None:
+        """Add the counts since the previous report to the shared Redis hash."""
+        offered, emitted = self.offered, self.emitted
+        d_off, d_emit = offered - self._reported[0], emitted - self._reported[1]
+        if not d_off and not d_emit:
+            return
+        pipe = redis.pipeline(transaction=False)
+        pipe.hincrby(key, "offered", d_off)
+        pipe.hincrby(key, "emitted", d_emit)
+        pipe.execute()
+        self._reported = (offered, emitted)
+
+
+__all__ = ["METRICS_KEY", "TopConflator"]
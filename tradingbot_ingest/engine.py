@@ -0,0 +1,135 @@
+"""Single-process asyncio ingest engine multiplexing all channels on one socket.
+
+The Bitvavo SDK delivers websocket callbacks on its own thread.  The engine
+bridges every callback onto one asyncio queue, so all channel handlers run on
+the event loop and share a single market list, websocket connection, stream
+publisher and batch sink.  Blocking REST calls (book snapshots) are pushed to
+the default executor.
+"""
+from __future__ import annotations
+
+import asyncio
+import signal
+import sys
+from typing import Callable, List, Optional, Sequence
+
+from .channels import ChannelHandler
+from .publisher import StreamPublisher
+from .ratelimit import RateLimitConfig, TokenBucket
+from .sink import BatchSink
+
+
+class IngestEngine:
+    """Subscribe, dispatch and flush for a set of :class:`ChannelHandler` objects."""
+
+    def __init__(
+        self,
+        bv,
+        ws,
+        publisher: StreamPublisher,
+        sink: BatchSink,
+        handlers: Sequence[ChannelHandler],
+        markets: Sequence[str],
+        sub_chunk: int = 25,
+        sleep_between_subs: float = 0.05,
+        sleep_between_chunks: float = 1.0,
+        rate_min: int = 200,
+        limiter: Optional[TokenBucket] = None,
+    ):
+        self.bv = bv
+        self.ws = ws
+        self.publisher = publisher
+        self.sink = sink
+        self.handlers = list(handlers)
+        self.markets = list(markets)
+        self.sub_chunk = sub_chunk
+        self.sleep_between_subs = sleep_between_subs
+        self.sleep_between_chunks = sleep_between_chunks
+        self.rate_min = rate_min
+        self.limiter = limiter or TokenBucket(RateLimitConfig(reserve=rate_min))
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        for h in self.handlers:
+            h.bind(self)
+
+    def callback(self, fn: Callable[..., None], *args) -> Callable[[object], None]:
+        """Wrap ``fn(*args, payload)`` into a thread-safe websocket callback."""
+        def _cb(payload: object) -> None:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, (fn, args + (payload,)))
+        return _cb
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def rest(self, fn: Callable, *args):
+        return await self._loop.run_in_executor(None, fn, *args)
+
+    async def wait_for_budget(self, weight: int = 1) -> None:
+        # gedeelde token bucket; wachten zonder de event loop te blokkeren
+        while True:
+            wait = await self.rest(self.limiter.reserve, weight)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def _subscribe_all(self) -> None:
+        for i in range(0, len(self.markets), self.sub_chunk):
+            chunk = self.markets[i:i + self.sub_chunk]
+            for m in chunk:
+                for h in self.handlers:
+                    h.subscribe(self.ws, m)
+                await asyncio.sleep(self.sleep_between_subs)
+            await asyncio.sleep(self.sleep_between_chunks)
+        print(f"[engine] subscribed {len(self.markets)} markets", file=sys.stderr)
+
+    def _dispatch_one(self, item) -> None:
+        fn, args = item
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[engine] handler error: {e}", file=sys.stderr)
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._dispatch_one(await self._queue.get())
+
+    async def _housekeeping(self) -> None:
+        while True:
+            await asyncio.sleep(0.25)
+            self.sink.flush_if_due()
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self._loop.add_signal_handler(sig, stop.set)
+
+        names = ",".join(h.name for h in self.handlers)
+        print(f"[engine] channels={names} markets={len(self.markets)}", file=sys.stderr)
+        tasks: List[asyncio.Task] = [
+            asyncio.create_task(self._dispatch()),
+            asyncio.create_task(self._housekeeping()),
+            asyncio.create_task(self._subscribe_all()),
+        ]
+        tasks.extend(asyncio.create_task(h.run()) for h in self.handlers)
+        try:
+            await stop.wait()
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try: self.ws.closeSocket()
+            except Exception: pass
+            # wat nog in de queue staat ook verwerken
+            while not self._queue.empty():
+                self._dispatch_one(self._queue.get_nowait())
+            self.sink.close()
+            self.publisher.close()
+            print("[engine] stopped", file=sys.stderr)
+
+    def run_forever(self) -> None:
+        asyncio.run(self.run())
+
+
+__all__ = ["IngestEngine"]
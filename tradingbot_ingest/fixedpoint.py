@@ -0,0 +1,97 @@
+"""Fixed-point prices and amounts as integer ticks.
+
+Bitvavo sends prices and amounts as decimal strings.  Parsing them once into
+an integer number of ticks at a fixed scale turns comparisons, sorting and
+rounding into plain integer arithmetic: no float error, and none of the
+``Decimal``/``quantize`` overhead in the hot paths (local book, exit guard,
+fills simulator).  Every value in one computation must share the same scale;
+:data:`DEFAULT_DECIMALS` (12) is exact for all Bitvavo prices and amounts.
+"""
+from __future__ import annotations
+
+from decimal import ROUND_DOWN, ROUND_HALF_UP, Decimal
+from typing import Optional, Union
+
+# Bitvavo prijzen en amounts hebben nooit meer dan 12 decimalen.
+DEFAULT_DECIMALS = 12
+
+Number = Union[str, int, float, Decimal]
+
+_POW10 = [10 ** i for i in range(40)]
+
+
+def to_ticks(value: Number, decimals: int = DEFAULT_DECIMALS) -> int:
+    """Parse a decimal value into ticks of ``10**-decimals``; extra digits are truncated."""
+    if isinstance(value, int):
+        return value * _POW10[decimals]
+    if not isinstance(value, str):
+        value = repr(value) if isinstance(value, float) else str(value)
+    s = value.strip()
+    if "e" in s or "E" in s:
+        return int(Decimal(s).scaleb(decimals).to_integral_value(rounding=ROUND_DOWN))
+    neg = s.startswith("-")
+    if neg or s.startswith("+"):
+        s = s[1:]
+    whole, _, frac = s.partition(".")
+    if len(frac) > decimals:
+        frac = frac[:decimals]
+    ticks = int((whole or "0") + frac.ljust(decimals, "0"))
+    return -ticks if neg else ticks
+
+
+def to_str(ticks: int, decimals: int = DEFAULT_DECIMALS, places: Optional[int] = None) -> str:
+    """Format ticks as a plain decimal string.
+
+    Without ``places`` trailing zeros are stripped; with ``places`` the string
+    has exactly that many decimals (digits beyond it are truncated, so
+    :func:`quantize` first when another rounding mode is wanted).
+    """
+    sign = "-" if ticks < 0 else ""
+    whole, frac = divmod(abs(ticks), _POW10[decimals])
+    digits = str(frac).rjust(decimals, "0") if decimals else ""
+    if places is None:
+        digits = digits.rstrip("0")
+    else:
+        digits = digits[:places].ljust(places, "0")
+    return f"{sign}{whole}.{digits}" if digits else f"{sign}{whole}"
+
+
+def quantize(ticks: int, decimals: int, places: int, rounding: str = ROUND_DOWN) -> int:
+    """Round ticks to ``places`` decimals, keeping the scale.
+
+    Supports :data:`decimal.ROUND_DOWN` (towards zero) and
+    :data:`decimal.ROUND_HALF_UP` (half away from zero), the two modes the
+    guards and the simulator use.
+    """
+    if places >= decimals:
+        return ticks
+    step = _POW10[decimals - places]
+    q, rem = divmod(abs(ticks), step)
+    if rounding == ROUND_HALF_UP:
+        if rem * 2 >= step:
+            q += 1
+    elif rounding != ROUND_DOWN:
+        raise ValueError(f"Niet ondersteunde afronding: {rounding}")
+    q *= step
+    return -q if ticks < 0 else q
+
+
+def mul(a: int, b: int, decimals: int = DEFAULT_DECIMALS) -> int:
+    """Product of two tick values at the same scale, truncated towards zero."""
+    q = abs(a * b) // _POW10[decimals]
+    return -q if (a < 0) != (b < 0) else q
+
+
+def one(decimals: int = DEFAULT_DECIMALS) -> int:
+    """The value 1 in ticks, for ``mul(price, one() + pct)`` style factors."""
+    return _POW10[decimals]
+
+
+__all__ = [
+    "DEFAULT_DECIMALS",
+    "mul",
+    "one",
+    "quantize",
+    "to_str",
+    "to_ticks",
+]
@@ -0,0 +1,165 @@
+"""JSONL landing with persistent, buffered file handles.
+
+The ingest scripts used to ``mkdir`` the day directory and open, write and
+close the target file for every event or batch.  :class:`JsonlWriter` keeps
+one buffered append handle per ``(day, sub-directory, market)``, creates each
+directory once, and leaves the syscalls to a background thread that flushes
+the buffers every ``flush_secs``.  Handles are evicted least-recently-used
+beyond ``max_open`` or when idle for ``idle_secs``; at UTC midnight all
+handles of the previous day are closed and new writes land in the new day.
+
+Writes are thread-safe (websocket callbacks, main loops and the flush thread
+share the writer).  Lines are only guaranteed on disk after :meth:`flush` or
+:meth:`close`.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import os
+import pathlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, Optional, Sequence, Set, Tuple
+
+import orjson as jsonf
+
+_Key = Tuple[str, Tuple[str, ...], str]
+
+
+@dataclass(frozen=True)
+class JsonlConfig:
+    max_open: int = 512
+    buffer_bytes: int = 64 * 1024
+    flush_secs: float = 1.0
+    idle_secs: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> "JsonlConfig":
+        return cls(
+            max_open=int(os.getenv("JSONL_MAX_OPEN", "512")),
+            buffer_bytes=int(os.getenv("JSONL_BUFFER_KB", "64")) * 1024,
+            flush_secs=float(os.getenv("JSONL_FLUSH_SECS", "1.0")),
+            idle_secs=float(os.getenv("JSONL_IDLE_SECS", "300")),
+        )
+
+
+class _Handle:
+    __slots__ = ("file", "last_used", "dirty")
+
+    def __init__(self, file: BinaryIO, now: float):
+        self.file = file
+        self.last_used = now
+        self.dirty = False
+
+
+class JsonlWriter:
+    """Append rows to ``<base>/<day>/<subdir...>/<market>.jsonl`` through cached handles."""
+
+    def __init__(self, base_dir: pathlib.Path, config: Optional[JsonlConfig] = None, background: bool = True):
+        self._base_dir = pathlib.Path(base_dir).expanduser()
+        self._config = config or JsonlConfig.from_env()
+        self._lock = threading.RLock()
+        self._handles: "OrderedDict[_Key, _Handle]" = OrderedDict()
+        self._dirs: Set[Tuple[str, Tuple[str, ...]]] = set()
+        self._day = ""
+        self._day_ends = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if background:
+            self._thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+            self._thread.start()
+
+    def _current_day(self, now: float) -> str:
+        if now >= self._day_ends:
+            today = dt.datetime.fromtimestamp(now, dt.timezone.utc).date()
+            midnight = dt.datetime.combine(today + dt.timedelta(days=1), dt.time(), dt.timezone.utc)
+            self._day = today.strftime("%Y-%m-%d")
+            self._day_ends = midnight.timestamp()
+            self._rollover(self._day)
+        return self._day
+
+    def _rollover(self, day: str) -> None:
+        for key in [k for k in self._handles if k[0] != day]:
+            self._close_key(key)
+        self._dirs = {d for d in self._dirs if d[0] == day}
+
+    def _close_key(self, key: _Key) -> None:
+        handle = self._handles.pop(key, None)
+        if handle is None:
+            return
+        try:
+            handle.file.close()
+        except OSError as e:
+            print(f"[jsonl] close {key} failed: {e}", file=sys.stderr)
+
+    def _handle(self, subdir: Tuple[str, ...], market: str, now: float) -> _Handle:
+        day = self._current_day(now)
+        key = (day, subdir, market)
+        handle = self._handles.get(key)
+        if handle is not None:
+            self._handles.move_to_end(key)
+            handle.last_used = now
+            return handle
+        directory = self._base_dir.joinpath(day, *subdir)
+        if (day, subdir) not in self._dirs:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._dirs.add((day, subdir))
+        path = directory / f"{market.replace('/', '-')}.jsonl"
+        handle = self._handles[key] = _Handle(open(path, "ab", buffering=self._config.buffer_bytes), now)
+        while len(self._handles) > self._config.max_open:
+            self._close_key(next(iter(self._handles)))
+        return handle
+
+    def write(self, subdir: Sequence[str], market: str, rows: Iterable[dict]) -> None:
+        data = b"".join(jsonf.dumps(row) + b"\n" for row in rows)
+        if not data:
+            return
+        with self._lock:
+            handle = self._handle(tuple(subdir), market, time.time())
+            handle.file.write(data)
+            handle.dirty = True
+
+    def write_one(self, subdir: Sequence[str], market: str, row: dict) -> None:
+        self.write(subdir, market, (row,))
+
+    def open_handles(self) -> int:
+        return len(self._handles)
+
+    def flush(self) -> None:
+        with self._lock:
+            for key, handle in self._handles.items():
+                if not handle.dirty:
+                    continue
+                try:
+                    handle.file.flush()
+                    handle.dirty = False
+                except OSError as e:
+                    print(f"[jsonl] flush {key} failed: {e}", file=sys.stderr)
+
+    def _evict_idle(self, now: float) -> None:
+        with self._lock:
+            idle = [k for k, h in self._handles.items() if now - h.last_used >= self._config.idle_secs]
+            for key in idle:
+                self._close_key(key)
+            # rollover ook zonder nieuwe writes (handles van gisteren sluiten)
+            self._current_day(now)
+
+    def close(self) -> None:
+        """Flush and close every handle and stop the flush thread."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(5.0)
+        with self._lock:
+            for key in list(self._handles):
+                self._close_key(key)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._config.flush_secs):
+            self.flush()
+            self._evict_idle(time.time())
+
+
+__all__ = ["JsonlConfig", "JsonlWriter"]
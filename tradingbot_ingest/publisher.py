@@ -0,0 +1,181 @@
+"""Buffered Redis Streams publisher shared by the ingest scripts.
+
+Websocket callbacks used to pay a full Redis round trip per ``XADD``.  The
+publisher hands entries to a background thread that coalesces them into a
+non-transactional pipeline, flushed when the batch is full or when the
+(sub-millisecond) deadline of the first queued entry expires.  The queue is
+bounded; a full queue blocks the caller, which is the backpressure we want
+when Redis falls behind.  Payloads are encoded per stream by a
+:class:`~tradingbot_ingest.wire.WireCodec` (JSON unless ``WIRE_FORMATS`` says
+otherwise), and entries without an explicit ``maxlen`` get the count cap of
+their retention policy (``RETENTION_POLICIES``).
+
+A failed pipeline is retried ``retries`` times with doubling backoff (only
+the entries that failed; a connection error retries the whole batch, so an
+entry may land twice).  What is still failing after that is dropped and
+counted in :attr:`StreamPublisher.dropped`.  Every ``report_secs`` the writer
+thread adds its counters to the ``metrics:publisher`` hash, exposed by
+``tools/metrics_sidecar.py``.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Mapping, Optional, Tuple
+
+from redis import Redis
+
+from .retention import RetentionPolicies
+from .wire import WireCodec
+
+_Entry = Tuple[str, Mapping[str, bytes], Optional[int]]
+_STOP = object()
+
+METRICS_KEY = "metrics:publisher"
+
+
+@dataclass(frozen=True)
+class PublisherConfig:
+    max_batch: int = 500
+    max_delay: float = 0.0005
+    max_queue: int = 50_000
+    retries: int = 3
+    retry_delay: float = 0.2
+    report_secs: float = 10.0
+
+    @classmethod
+    def from_env(cls) -> "PublisherConfig":
+        return cls(
+            max_batch=int(os.getenv("PUBLISH_BATCH", "500")),
+            max_delay=float(os.getenv("PUBLISH_DELAY_MS", "0.5")) / 1000.0,
+            max_queue=int(os.getenv("PUBLISH_QUEUE", "50000")),
+            retries=int(os.getenv("PUBLISH_RETRIES", "3")),
+            retry_delay=float(os.getenv("PUBLISH_RETRY_MS", "200")) / 1000.0,
+            report_secs=float(os.getenv("PUBLISH_REPORT_SECS", "10")),
+        )
+
+
+class StreamPublisher:
+    """Coalesce ``XADD`` calls into pipelines flushed by size or deadline."""
+
+    def __init__(
+        self,
+        redis: Redis,
+        config: Optional[PublisherConfig] = None,
+        codec: Optional[WireCodec] = None,
+        retention: Optional[RetentionPolicies] = None,
+    ):
+        self._redis = redis
+        self._config = config or PublisherConfig.from_env()
+        self._codec = codec or WireCodec.from_env()
+        self._retention = retention or RetentionPolicies.from_env()
+        self._queue: "queue.Queue[object]" = queue.Queue(maxsize=self._config.max_queue)
+        self.published = 0
+        self.errors = 0
+        self.dropped = 0
+        self._reported = (0, 0, 0)
+        self._thread = threading.Thread(target=self._run, name="stream-publisher", daemon=True)
+        self._thread.start()
+
+    def xadd(self, stream: str, fields: Mapping[str, bytes], maxlen: Optional[int] = None) -> None:
+        if maxlen is None:
+            maxlen = self._retention.maxlen_for(stream)
+        self._queue.put((stream, fields, maxlen))
+
+    def publish(self, stream: str, obj: object, maxlen: Optional[int] = None) -> None:
+        self.xadd(stream, self._codec.encode(stream, obj), maxlen)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def report(self, redis: Optional[Redis] = None, key: str = METRICS_KEY) -> None:
+        """Add the counts since the previous report to the shared Redis hash."""
+        counts = (self.published, self.errors, self.dropped)
+        deltas = [now - before for now, before in zip(counts, self._reported)]
+        if not any(deltas):
+            return
+        pipe = (redis or self._redis).pipeline(transaction=False)
+        for field, delta in zip(("published", "errors", "dropped"), deltas):
+            if delta:
+                pipe.hincrby(key, field, delta)
+        pipe.execute()
+        self._reported = counts
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush everything that is queued and stop the writer thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _collect(self, first: _Entry) -> Tuple[List[_Entry], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self._config.max_delay
+        while len(batch) < self._config.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _execute(self, batch: List[_Entry]) -> Tuple[List[_Entry], Optional[Exception]]:
+        """Send one pipeline; returns the entries that failed and the (first) error."""
+        pipe = self._redis.pipeline(transaction=False)
+        for stream, fields, maxlen in batch:
+            if maxlen:
+                pipe.xadd(stream, fields, maxlen=maxlen, approximate=True)
+            else:
+                pipe.xadd(stream, fields)
+        try:
+            results = pipe.execute(raise_on_error=False)
+        except Exception as e:
+            return batch, e  # verbinding weg: onbekend wat er geschreven is
+        failed = [entry for entry, res in zip(batch, results) if isinstance(res, Exception)]
+        return failed, next((res for res in results if isinstance(res, Exception)), None)
+
+    def _flush(self, batch: List[_Entry]) -> None:
+        delay = self._config.retry_delay
+        for attempt in range(self._config.retries + 1):
+            failed, error = self._execute(batch)
+            self.published += len(batch) - len(failed)
+            if not failed:
+                return
+            self.errors += 1
+            batch = failed
+            if attempt < self._config.retries:
+                print(f"[publisher] {len(failed)} entries failed ({error}), retry in {delay:.2f}s", file=sys.stderr)
+                time.sleep(delay)  # queue loopt intussen vol: backpressure naar de callers
+                delay *= 2
+        self.dropped += len(batch)
+        print(f"[publisher] dropped {len(batch)} entries after {self._config.retries} retries: {error}", file=sys.stderr)
+
+    def _run(self) -> None:
+        stop = False
+        next_report = time.monotonic() + self._config.report_secs
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self._config.report_secs)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                stop = True
+            elif item is not None:
+                batch, stop = self._collect(item)
+                self._flush(batch)
+            if stop or time.monotonic() >= next_report:
+                next_report = time.monotonic() + self._config.report_secs
+                try:
+                    self.report()
+                except Exception as e:
+                    print(f"[publisher] metrics report failed: {e}", file=sys.stderr)
+
+
+__all__ = ["METRICS_KEY", "PublisherConfig", "StreamPublisher"]
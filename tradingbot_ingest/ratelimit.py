@@ -0,0 +1,332 @@
+"""Token buckets for Bitvavo's REST weight budget.
+
+Bitvavo allows a weight budget per API key / IP per minute (1000 by
+default; most endpoints cost 1).  Polling ``getRemainingLimit`` before every
+call serialises callers and only reacts once the budget is already gone.
+A token bucket tracks the budget instead: tokens refill at ``budget / 60``
+per second, every request takes its weight before it is sent, and the
+remaining budget the exchange reports after each response
+(:meth:`observe`) clamps the bucket, so traffic the bucket did not see is
+accounted for as well.
+
+Every caller keeps ``reserve`` weight untouched below it: a backfill with
+``RATE_MIN=200`` stops at 200 remaining tokens while the order submitter
+(reserve 0) can still use them.  ``RATE_MIN`` only sets the default; a
+reserve passed explicitly (orders, guards, syncs) is not overridden by it, so
+a shared environment file cannot throttle order placement.
+
+* :class:`TokenBucket` — in-process (threads of one process);
+* :class:`RedisTokenBucket` — one bucket in Redis shared by every process on
+  the API key; acquire/observe/penalize are atomic Lua scripts using the
+  Redis clock.  If Redis is unreachable it falls back to a local bucket;
+* :func:`bucket_from_env` picks one (``RATE_LIMIT_BACKEND=redis|local``);
+* :func:`limited` wraps a ``python_bitvavo_api`` client so every REST call
+  acquires its endpoint weight and reports the response headers.
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Mapping, Optional, Union
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+BITVAVO_BUDGET_PER_MIN = 1000
+DEFAULT_KEY = "ratelimit:bitvavo"
+BACKENDS = ("redis", "local")
+
+# gewicht per REST-methode van de python-bitvavo-api client (onbekend: 1)
+REST_WEIGHTS: Dict[str, int] = {
+    "time": 1, "markets": 1, "assets": 1, "book": 1, "publicTrades": 5, "candles": 1,
+    "tickerPrice": 1, "tickerBook": 1, "ticker24h": 1,
+    "placeOrder": 1, "getOrder": 1, "updateOrder": 1, "cancelOrder": 1, "getOrders": 5,
+    "cancelOrders": 1, "ordersOpen": 1, "trades": 5, "account": 1, "fees": 1, "balance": 5,
+    "depositAssets": 1, "depositHistory": 5, "withdrawAssets": 1, "withdrawalHistory": 5,
+}
+# zonder market gelden deze voor alle markten tegelijk
+ALL_MARKETS_WEIGHT = 25
+_ALL_MARKETS = ("tickerPrice", "tickerBook", "ticker24h", "ordersOpen")
+_NOT_REST = ("newWebsocket", "getRemainingLimit", "websocket")
+
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    budget_per_min: int = BITVAVO_BUDGET_PER_MIN
+    reserve: int = 200
+
+    def __post_init__(self) -> None:
+        if self.reserve >= self.budget_per_min:
+            raise ValueError(f"RATE_MIN ({self.reserve}) moet kleiner zijn dan RATE_BUDGET_PER_MIN ({self.budget_per_min})")
+
+    @classmethod
+    def from_env(cls, reserve_default: int = 200, reserve: Optional[int] = None) -> "RateLimitConfig":
+        """``RATE_MIN`` overrides ``reserve_default``, never an explicit ``reserve``."""
+        if reserve is None:
+            reserve = int(os.getenv("RATE_MIN", str(reserve_default)))
+        return cls(
+            budget_per_min=int(os.getenv("RATE_BUDGET_PER_MIN", str(BITVAVO_BUDGET_PER_MIN))),
+            reserve=reserve,
+        )
+
+
+class TokenBucket:
+    """Weight budget shared by the threads of one process."""
+
+    def __init__(self, config: Optional[RateLimitConfig] = None):
+        self.config = config or RateLimitConfig.from_env()
+        self.capacity = float(self.config.budget_per_min)
+        self.rate = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.waited_secs = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def reserve(self, weight: int = 1) -> float:
+        """Take ``weight`` if the reserve allows it (returns 0.0), else the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._refill(now)
+            floor = self.config.reserve
+            if self._tokens - weight >= floor:
+                self._tokens -= weight
+                return 0.0
+            return (weight + floor - self._tokens) / self.rate
+
+    def try_acquire(self, weight: int = 1) -> bool:
+        return self.reserve(weight) == 0.0
+
+    def acquire(self, weight: int = 1, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.reserve(weight)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                wait = min(wait, left)
+            self.waited_secs += wait
+            time.sleep(wait)
+
+    def observe(self, remaining: Optional[int], reset_at_ms: Optional[int] = None) -> None:
+        """Clamp the bucket to the remaining weight the exchange reported after a response."""
+        if remaining is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, float(max(0, remaining)))
+            if remaining <= 0 and reset_at_ms:
+                # budget op tot de reset: niemand meer doorlaten tot dan
+                self._blocked_until = max(self._blocked_until, now + max(0.0, reset_at_ms / 1000.0 - time.time()))
+
+    def penalize(self, secs: float) -> None:
+        """Stop all acquisitions for ``secs`` (429 / temporary ban)."""
+        with self._lock:
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + secs)
+
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def observe_client(self, bv: Any) -> None:
+        """:meth:`observe` from a ``python_bitvavo_api`` client (values from the last response headers)."""
+        try:
+            remaining = bv.getRemainingLimit()
+        except Exception:
+            return
+        self.observe(remaining, getattr(bv, "rateLimitResetAt", None))
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        """:meth:`observe` from raw HTTP response headers (``bitvavo-ratelimit-*``)."""
+        remaining = headers.get("bitvavo-ratelimit-remaining")
+        reset_at = headers.get("bitvavo-ratelimit-resetat")
+        try:
+            self.observe(int(remaining) if remaining is not None else None, int(reset_at) if reset_at else None)
+        except ValueError:
+            pass
+
+
+# KEYS[1] = hash {tokens, ts, blocked}; tijden in ms volgens de Redis-klok
+_LUA_CLOCK = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local h = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'blocked')
+local cap = tonumber(ARGV[1])
+local rate = cap / 60000
+local tokens = tonumber(h[1]) or cap
+local ts = tonumber(h[2]) or now
+local blocked = tonumber(h[3]) or 0
+tokens = math.min(cap, tokens + math.max(0, now - ts) * rate)
+"""
+
+_LUA_SAVE = """
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now, 'blocked', blocked)
+redis.call('PEXPIRE', KEYS[1], 120000)
+"""
+
+# ARGV: capacity, weight, floor -> wachttijd in ms (0 = toegekend)
+_LUA_ACQUIRE = _LUA_CLOCK + """
+local weight = tonumber(ARGV[2])
+local floor = tonumber(ARGV[3])
+local wait = 0
+if now < blocked then
+  wait = blocked - now
+elseif tokens - weight >= floor then
+  tokens = tokens - weight
+else
+  wait = math.ceil((weight + floor - tokens) / rate)
+end
+""" + _LUA_SAVE + """
+return wait
+"""
+
+# ARGV: capacity, remaining, reset_at_ms
+_LUA_OBSERVE = _LUA_CLOCK + """
+local remaining = tonumber(ARGV[2])
+local reset_at = tonumber(ARGV[3])
+tokens = math.min(tokens, math.max(0, remaining))
+if remaining <= 0 and reset_at > now then
+  blocked = math.max(blocked, reset_at)
+end
+""" + _LUA_SAVE + """
+return 0
+"""
+
+# ARGV: capacity, ms
+_LUA_PENALIZE = _LUA_CLOCK + """
+tokens = 0
+blocked = math.max(blocked, now + tonumber(ARGV[2]))
+""" + _LUA_SAVE + """
+return 0
+"""
+
+
+class RedisTokenBucket(TokenBucket):
+    """One bucket per API key in Redis, shared by every process that uses the key."""
+
+    def __init__(self, redis: Redis, config: Optional[RateLimitConfig] = None, key: str = DEFAULT_KEY):
+        super().__init__(config)
+        self.key = key
+        self._redis = redis
+        self._acquire = redis.register_script(_LUA_ACQUIRE)
+        self._observe = redis.register_script(_LUA_OBSERVE)
+        self._penalize = redis.register_script(_LUA_PENALIZE)
+        self._degraded_until = 0.0
+
+    def _shared(self, fn: Callable[[], Any]) -> Optional[Any]:
+        if time.monotonic() < self._degraded_until:
+            return None
+        try:
+            return fn()
+        except RedisError as e:
+            # Redis weg: 30 s lokaal verder (zelfde budget, alleen dit proces)
+            print(f"[ratelimit] redis unavailable, local bucket for 30s: {e}", file=sys.stderr)
+            self._degraded_until = time.monotonic() + 30.0
+            return None
+
+    def reserve(self, weight: int = 1) -> float:
+        wait_ms = self._shared(lambda: self._acquire(keys=[self.key], args=[self.capacity, weight, self.config.reserve]))
+        if wait_ms is None:
+            return super().reserve(weight)
+        wait = int(wait_ms) / 1000.0
+        # kleine jitter zodat wachtende processen niet tegelijk terugkomen
+        return wait + random.uniform(0, 0.05) if wait else 0.0
+
+    def observe(self, remaining: Optional[int], reset_at_ms: Optional[int] = None) -> None:
+        if remaining is None:
+            return
+        super().observe(remaining, reset_at_ms)
+        self._shared(lambda: self._observe(keys=[self.key], args=[self.capacity, int(remaining), int(reset_at_ms or 0)]))
+
+    def penalize(self, secs: float) -> None:
+        super().penalize(secs)
+        self._shared(lambda: self._penalize(keys=[self.key], args=[self.capacity, int(secs * 1000)]))
+
+    def tokens(self) -> float:
+        raw = self._shared(lambda: self._redis.hget(self.key, "tokens"))
+        return super().tokens() if raw is None else float(raw)
+
+
+def bucket_from_env(
+    redis: Optional[Redis] = None, reserve_default: int = 200, reserve: Optional[int] = None,
+) -> TokenBucket:
+    """Shared Redis bucket (``RATE_LIMIT_BACKEND=redis``, default) or a local one.
+
+    ``reserve`` fixes the floor regardless of ``RATE_MIN``; ``reserve_default``
+    is only used when ``RATE_MIN`` is not set.
+    """
+    config = RateLimitConfig.from_env(reserve_default, reserve)
+    backend = os.getenv("RATE_LIMIT_BACKEND", "redis")
+    if backend not in BACKENDS:
+        raise ValueError(f"Onbekende RATE_LIMIT_BACKEND: {backend} (toegestaan: {', '.join(BACKENDS)})")
+    if backend == "local":
+        return TokenBucket(config)
+    if redis is None:
+        redis = Redis.from_url(os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0"), socket_timeout=2)
+    return RedisTokenBucket(redis, config, os.getenv("RATE_LIMIT_KEY", DEFAULT_KEY))
+
+
+def rest_weight(method: str, args: tuple) -> int:
+    weight = REST_WEIGHTS.get(method, 1)
+    if method in _ALL_MARKETS:
+        options = args[-1] if args and isinstance(args[-1], dict) else {}
+        if not any(isinstance(a, str) for a in args) and "market" not in options:
+            return ALL_MARKETS_WEIGHT
+    return weight
+
+
+class LimitedClient:
+    """Proxy for a ``python_bitvavo_api`` client that rate-limits its REST calls."""
+
+    def __init__(self, client: Any, bucket: TokenBucket):
+        self._client = client
+        self._bucket = bucket
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith("_") or name in _NOT_REST:
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            self._bucket.acquire(rest_weight(name, args))
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._bucket.observe_client(self._client)
+        return call
+
+
+def limited(client: Any, bucket: Union[TokenBucket, None] = None) -> LimitedClient:
+    return LimitedClient(client, bucket or bucket_from_env())
+
+
+__all__ = [
+    "ALL_MARKETS_WEIGHT",
+    "BACKENDS",
+    "BITVAVO_BUDGET_PER_MIN",
+    "DEFAULT_KEY",
+    "LimitedClient",
+    "REST_WEIGHTS",
+    "RateLimitConfig",
+    "RedisTokenBucket",
+    "TokenBucket",
+    "bucket_from_env",
+    "limited",
+    "rest_weight",
+]
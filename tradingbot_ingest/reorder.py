@@ -0,0 +1,88 @@
+"""Nonce-indexed reorder buffer for out-of-order ``bookUpdate`` messages.
+
+Updates that arrive ahead of the expected nonce (or before the REST snapshot
+has seeded the book) are parked here keyed by nonce.  Once the gap closes the
+whole consecutive run is popped in one go; a min-heap over the parked
+nonces keeps :meth:`ReorderBuffer.lowest` and :meth:`ReorderBuffer.drop_through`
+cheap.  When the buffer is full the *highest* nonces go: the low end is what
+closes the gap after ``last_nonce``, dropping it would make the whole
+buffered tail unusable.  Memory stays bounded during long gaps.
+"""
+from __future__ import annotations
+
+import heapq
+from typing import Dict, Iterator, List, Optional
+
+
+class ReorderBuffer:
+    """Bounded ``nonce -> update`` buffer; the last update per nonce wins."""
+
+    __slots__ = ("max_size", "evicted", "_pending", "_heap", "_high")
+
+    def __init__(self, max_size: int = 2000):
+        self.max_size = max_size
+        self.evicted = 0
+        self._pending: Dict[int, dict] = {}
+        self._heap: List[int] = []
+        self._high = -1  # hoogste geparkeerde nonce (-1: leeg)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __bool__(self) -> bool:
+        return bool(self._pending)
+
+    def clear(self) -> None:
+        self._pending.clear()
+        self._heap.clear()
+        self._high = -1
+
+    def push(self, nonce: int, update: dict) -> None:
+        pending = self._pending
+        if nonce in pending:
+            pending[nonce] = update
+            return
+        if len(pending) >= self.max_size:
+            if nonce > self._high:
+                self.evicted += 1  # vol: de nieuwste update zelf laten vallen
+                return
+            # hoogste eruit; zijn heap-entry ruimt lowest/drop_through later op
+            del pending[self._high]
+            self.evicted += 1
+            self._high = max(pending) if pending else -1
+        heapq.heappush(self._heap, nonce)
+        pending[nonce] = update
+        if nonce > self._high:
+            self._high = nonce
+
+    def lowest(self) -> Optional[int]:
+        heap, pending = self._heap, self._pending
+        while heap and heap[0] not in pending:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def drop_through(self, nonce: int) -> int:
+        """Forget every parked update with a nonce ``<= nonce``."""
+        heap, pending = self._heap, self._pending
+        dropped = 0
+        while heap and heap[0] <= nonce:
+            if pending.pop(heapq.heappop(heap), None) is not None:
+                dropped += 1
+        if not pending:
+            self._high = -1
+        return dropped
+
+    def pop_run(self, expected: int) -> Iterator[dict]:
+        """Yield and remove ``expected``, ``expected + 1``, ... while present."""
+        pending = self._pending
+        while True:
+            upd = pending.pop(expected, None)
+            if upd is None:
+                break
+            yield upd
+            expected += 1
+        # bijbehorende heap-entries zijn nu verouderd; opruimen tot aan het gat
+        self.drop_through(expected - 1)
+
+
+__all__ = ["ReorderBuffer"]
@@ -0,0 +1,155 @@
+"""Retention policies for the Redis ingest streams.
+
+A policy caps a stream family (exact name or ``fnmatch`` pattern such as
+``bitvavo:book:*``) by entry count (``MAXLEN``) and/or by age (``MINID``).
+Count caps are cheap enough to apply on every ``XADD`` via the publisher;
+age caps need the clock and are applied by :class:`RetentionManager`, which
+also reports length and memory per family.
+"""
+from __future__ import annotations
+
+import fnmatch
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Sequence
+
+from redis import Redis
+
+# Zonder configuratie: ruime count-caps per familie, samen ruim binnen een paar GB.
+DEFAULT_POLICIES = (
+    "bitvavo:book:*=maxlen:5000,"
+    "bitvavo:book=maxlen:200000,"
+    "bitvavo:trades=maxlen:500000,"
+    "bitvavo:ticker24h=maxlen:200000,"
+    "bitvavo:candles:*=maxlen:100000,"
+    "bitvavo:bars:*=maxlen:200000,"
+    "bitvavo:other=maxlen:10000"
+)
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _parse_age(value: str) -> int:
+    value = value.strip()
+    if value and value[-1] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(value)
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    pattern: str
+    maxlen: Optional[int] = None
+    max_age_secs: Optional[int] = None
+
+    def matches(self, stream: str) -> bool:
+        return stream == self.pattern or fnmatch.fnmatchcase(stream, self.pattern)
+
+
+def parse_policies(spec: str) -> List[RetentionPolicy]:
+    """Parse ``pattern=maxlen:N|age:6h`` entries, comma separated."""
+    policies = []
+    for part in spec.split(","):
+        pattern, _, rules = part.strip().partition("=")
+        if not pattern or not rules:
+            continue
+        maxlen = max_age = None
+        for rule in rules.split("|"):
+            kind, _, value = rule.strip().partition(":")
+            if kind == "maxlen":
+                maxlen = int(value)
+            elif kind == "age":
+                max_age = _parse_age(value)
+            else:
+                raise ValueError(f"Onbekende retention-regel: {rule} (toegestaan: maxlen:N, age:<n>[smhd])")
+        policies.append(RetentionPolicy(pattern.strip(), maxlen, max_age))
+    return policies
+
+
+class RetentionPolicies:
+    """Ordered policy list; the first matching policy wins."""
+
+    def __init__(self, policies: Sequence[RetentionPolicy]):
+        self.policies = list(policies)
+        self._cache: Dict[str, Optional[RetentionPolicy]] = {}
+
+    @classmethod
+    def from_env(cls, env_var: str = "RETENTION_POLICIES") -> "RetentionPolicies":
+        return cls(parse_policies(os.getenv(env_var, DEFAULT_POLICIES)))
+
+    def policy_for(self, stream: str) -> Optional[RetentionPolicy]:
+        if stream not in self._cache:
+            # exacte namen gaan voor patronen
+            exact = [p for p in self.policies if p.pattern == stream]
+            match = exact or [p for p in self.policies if p.matches(stream)]
+            self._cache[stream] = match[0] if match else None
+        return self._cache[stream]
+
+    def maxlen_for(self, stream: str) -> Optional[int]:
+        policy = self.policy_for(stream)
+        return policy.maxlen if policy else None
+
+
+@dataclass
+class FamilyStats:
+    streams: int = 0
+    length: int = 0
+    memory_bytes: int = 0
+    trimmed: int = 0
+
+
+class RetentionManager:
+    """Apply the policies to every matching stream and collect per-family stats."""
+
+    def __init__(self, redis: Redis, policies: RetentionPolicies, memory_samples: int = 5):
+        self._redis = redis
+        self._policies = policies
+        self._memory_samples = memory_samples
+
+    def _streams(self, pattern: str) -> List[str]:
+        keys = []
+        for key in self._redis.scan_iter(match=pattern, count=1000, _type="stream"):
+            keys.append(key.decode() if isinstance(key, bytes) else key)
+        return keys
+
+    def _trim(self, stream: str, policy: RetentionPolicy, now_ms: int) -> int:
+        trimmed = 0
+        if policy.maxlen is not None:
+            trimmed += self._redis.xtrim(stream, maxlen=policy.maxlen, approximate=True)
+        if policy.max_age_secs is not None:
+            minid = f"{now_ms - policy.max_age_secs * 1000}-0"
+            trimmed += self._redis.xtrim(stream, minid=minid, approximate=True)
+        return trimmed
+
+    def run_once(self, trim: bool = True) -> Mapping[str, FamilyStats]:
+        stats: Dict[str, FamilyStats] = {}
+        now_ms = int(time.time() * 1000)
+        seen = set()
+        for policy in self._policies.policies:
+            family = stats.setdefault(policy.pattern, FamilyStats())
+            for stream in self._streams(policy.pattern):
+                # een stream hoort bij precies één familie (eerste/exacte match)
+                if stream in seen or self._policies.policy_for(stream) is not policy:
+                    continue
+                seen.add(stream)
+                if trim:
+                    family.trimmed += self._trim(stream, policy, now_ms)
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.xlen(stream)
+                pipe.memory_usage(stream, samples=self._memory_samples)
+                length, memory = pipe.execute()
+                family.streams += 1
+                family.length += int(length or 0)
+                family.memory_bytes += int(memory or 0)
+        return stats
+
+
+__all__ = [
+    "DEFAULT_POLICIES",
+    "FamilyStats",
+    "RetentionManager",
+    "RetentionPolicies",
+    "RetentionPolicy",
+    "parse_policies",
+]
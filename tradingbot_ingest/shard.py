@@ -0,0 +1,125 @@
+"""Stable market sharding across worker processes.
+
+Markets are assigned to shards with a CRC32 of the market name, so the
+assignment survives restarts and adding or removing a market only moves that
+market.  :class:`ShardSupervisor` keeps one worker process per shard alive,
+re-lists markets periodically and restarts only the shards whose market set
+changed.
+"""
+from __future__ import annotations
+
+import multiprocessing as mp
+import signal
+import sys
+import time
+import zlib
+from typing import Callable, Dict, List, Sequence
+
+
+def shard_of(market: str, shards: int) -> int:
+    return zlib.crc32(market.encode("utf-8")) % shards
+
+
+def partition(markets: Sequence[str], shards: int) -> List[List[str]]:
+    parts: List[List[str]] = [[] for _ in range(shards)]
+    for m in markets:
+        parts[shard_of(m, shards)].append(m)
+    return parts
+
+
+class ShardSupervisor:
+    """Run ``target(shard, markets)`` in one process per shard and keep it balanced.
+
+    ``target`` must be picklable (a module-level function); workers are started
+    with the ``spawn`` method so they never inherit the supervisor's threads or
+    sockets.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[int, List[str]], None],
+        list_markets: Callable[[], Sequence[str]],
+        shards: int,
+        refresh_secs: float = 300.0,
+        restart_backoff: float = 5.0,
+    ):
+        self._target = target
+        self._list_markets = list_markets
+        self._shards = shards
+        self._refresh_secs = refresh_secs
+        self._restart_backoff = restart_backoff
+        self._ctx = mp.get_context("spawn")
+        self._assigned: List[List[str]] = [[] for _ in range(shards)]
+        self._procs: Dict[int, mp.process.BaseProcess] = {}
+        self._started_at: Dict[int, float] = {}
+        self._running = True
+
+    def _start(self, shard: int) -> None:
+        markets = self._assigned[shard]
+        if not markets:
+            return
+        proc = self._ctx.Process(target=self._target, args=(shard, markets), name=f"shard-{shard}", daemon=False)
+        proc.start()
+        self._procs[shard] = proc
+        self._started_at[shard] = time.time()
+        print(f"[shard] started shard={shard} pid={proc.pid} markets={len(markets)}", file=sys.stderr)
+
+    def _stop(self, shard: int, timeout: float = 15.0) -> None:
+        proc = self._procs.pop(shard, None)
+        if proc is None:
+            return
+        if proc.is_alive():
+            proc.terminate()  # SIGTERM: worker flusht zijn sinks
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.kill()
+                proc.join()
+
+    def rebalance(self) -> None:
+        try:
+            markets = sorted(set(self._list_markets()))
+        except Exception as e:
+            print(f"[shard] market refresh failed: {e}", file=sys.stderr)
+            return
+        parts = partition(markets, self._shards)
+        for shard, new in enumerate(parts):
+            if new == self._assigned[shard] and (shard in self._procs or not new):
+                continue
+            print(f"[shard] rebalance shard={shard} {len(self._assigned[shard])} -> {len(new)} markets", file=sys.stderr)
+            self._stop(shard)
+            self._assigned[shard] = new
+            self._start(shard)
+
+    def _reap(self) -> None:
+        now = time.time()
+        for shard, proc in list(self._procs.items()):
+            if proc.is_alive():
+                continue
+            if now - self._started_at.get(shard, 0.0) < self._restart_backoff:
+                continue
+            print(f"[shard] shard={shard} exited code={proc.exitcode}; restarting", file=sys.stderr)
+            self._procs.pop(shard, None)
+            self._start(shard)
+
+    def run(self) -> None:
+        def stop(*_):
+            self._running = False
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        self.rebalance()
+        next_refresh = time.time() + self._refresh_secs
+        try:
+            while self._running:
+                time.sleep(1.0)
+                self._reap()
+                if time.time() >= next_refresh:
+                    self.rebalance()
+                    next_refresh = time.time() + self._refresh_secs
+        finally:
+            for shard in list(self._procs):
+                self._stop(shard)
+            print("[shard] supervisor stopped", file=sys.stderr)
+
+
+__all__ = ["ShardSupervisor", "partition", "shard_of"]
@@ -0,0 +1,112 @@
+"""Batched JSONL + Parquet landing for ingest events.
+
+Rows are bucketed per ``(event, market)`` and written once a bucket reaches
+its batch limit or when :meth:`BatchSink.flush_if_due` finds the periodic
+flush interval elapsed.  The JSONL layout matches the standalone ingest
+scripts: ``ticker24h`` lands in the day root, every other event in the
+sub-directories spelled by its name (``candles:1m`` -> ``candles/1m``).
+JSONL goes through a :class:`~tradingbot_ingest.jsonl.JsonlWriter`, so files
+stay open between flushes.
+
+Bucketing is cheap and happens on the caller (the engine's event loop); a
+full bucket is detached and written by one background writer thread, so disk
+I/O never blocks the channel handlers.  One thread keeps the rows of a file
+in order.
+"""
+from __future__ import annotations
+
+import pathlib
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from tradingbot_storage.parquet_sink import ParquetSink
+
+from .jsonl import JsonlWriter
+
+DEFAULT_BATCH_LIMITS: Mapping[str, int] = {
+    "ticker24h": 500,
+    "trades": 200,
+    "candles": 200,
+    "orderbook:snapshot": 1,
+    "orderbook:update": 200,
+    "orderbook:top": 400,
+}
+
+
+def jsonl_subdir(event: str) -> Tuple[str, ...]:
+    if event == "ticker24h":
+        return ()
+    return tuple(event.split(":"))
+
+
+class BatchSink:
+    """Bucket rows per ``(event, market)`` and land them as JSONL and Parquet."""
+
+    def __init__(
+        self,
+        base_dir: pathlib.Path,
+        parquet: Optional[ParquetSink] = None,
+        batch_limits: Optional[Mapping[str, int]] = None,
+        flush_secs: float = 5.0,
+        jsonl: Optional[JsonlWriter] = None,
+    ):
+        self._jsonl = jsonl or JsonlWriter(base_dir)
+        self._parquet = parquet
+        self._limits = dict(batch_limits or DEFAULT_BATCH_LIMITS)
+        self._flush_secs = flush_secs
+        self._buckets: Dict[Tuple[str, str], List[dict]] = {}
+        self._last_flush = time.time()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-sink")
+
+    def _limit(self, event: str) -> int:
+        limit = self._limits.get(event)
+        if limit is None:
+            limit = self._limits.get(event.split(":", 1)[0], 200)
+        return limit
+
+    def add(self, event: str, market: str, row: dict) -> None:
+        key = (event, market)
+        bucket = self._buckets.setdefault(key, [])
+        bucket.append(row)
+        if len(bucket) >= self._limit(event):
+            self.flush(event, market)
+
+    def flush(self, event: str, market: str) -> None:
+        rows = self._buckets.get((event, market))
+        if not rows:
+            return
+        self._buckets[(event, market)] = []
+        self._writer.submit(self._write, event, market, rows).add_done_callback(self._report_error)
+
+    def _write(self, event: str, market: str, rows: List[dict]) -> None:
+        self._jsonl.write(jsonl_subdir(event), market, rows)
+        if self._parquet is not None:
+            self._parquet.write(event, market, rows)
+
+    @staticmethod
+    def _report_error(fut: Future) -> None:
+        e = fut.exception()
+        if e is not None:
+            print(f"[sink] write failed: {e}", file=sys.stderr)
+
+    def flush_all(self) -> None:
+        for event, market in list(self._buckets):
+            self.flush(event, market)
+        self._last_flush = time.time()
+
+    def flush_if_due(self) -> None:
+        if time.time() - self._last_flush >= self._flush_secs:
+            self.flush_all()
+
+    def close(self) -> None:
+        """Flush every bucket, wait for the writer, drain the Parquet queue and close the JSONL handles."""
+        self.flush_all()
+        self._writer.shutdown(wait=True)
+        if self._parquet is not None:
+            self._parquet.close()
+        self._jsonl.close()
+
+
+__all__ = ["BatchSink", "DEFAULT_BATCH_LIMITS", "jsonl_subdir"]
@@ -0,0 +1,226 @@
+"""Versioned wire formats for Redis stream payloads.
+
+Every entry keeps its payload under ``data``; a ``ct`` (content type) field
+names the encoding.  Entries without ``ct`` are plain JSON, which is what all
+producers wrote before this module existed, so consumers stay compatible
+with old entries and with streams that keep publishing JSON.
+
+Compact layouts are ``struct``-packed, little-endian, with length-prefixed
+UTF-8 strings appended after the fixed part:
+
+``tob/1``     bestBid, bestBidSize, bestAsk, bestAskSize (f64), nonce,
+              timestamp (i64), source (u8) + market
+``trade/1``   timestamp (i64), price, amount (f64), side (u8) + market, id, event
+``candle/1``  open time (i64), open, high, low, close, volume (f64) + market, interval
+``candle/2``  as ``candle/1`` plus closed (u8: 0 in progress, 1 closed, 2 unknown)
+
+Prices and amounts come back as floats.  An object that does not fit its
+layout (missing or non-numeric fields) silently falls back to JSON.
+"""
+from __future__ import annotations
+
+import fnmatch
+import os
+import struct
+from typing import Callable, Dict, Mapping, Optional, Tuple, Union
+
+import orjson as jsonf
+
+CT_JSON = "json/1"
+CT_TOB = "tob/1"
+CT_TRADE = "trade/1"
+CT_CANDLE = "candle/1"
+CT_CANDLE2 = "candle/2"
+
+_TOB = struct.Struct("<ddddqqB")
+_TRADE = struct.Struct("<qddB")
+_CANDLE = struct.Struct("<qddddd")
+_CANDLE2 = struct.Struct("<qdddddB")
+_LEN = struct.Struct("<H")
+
+_SOURCES = ("", "snapshot", "realtime", "buffered")
+_SIDES = ("", "buy", "sell")
+
+Fields = Mapping[Union[str, bytes], Union[str, bytes]]
+
+
+def _pack_str(value: object) -> bytes:
+    raw = str(value if value is not None else "").encode("utf-8")
+    return _LEN.pack(len(raw)) + raw
+
+
+def _unpack_str(buf: bytes, offset: int) -> Tuple[str, int]:
+    (n,) = _LEN.unpack_from(buf, offset)
+    offset += _LEN.size
+    return buf[offset:offset + n].decode("utf-8"), offset + n
+
+
+def _enc_tob(obj: Mapping) -> bytes:
+    source = obj.get("source") or ""
+    return _TOB.pack(
+        float(obj["bestBid"]), float(obj["bestBidSize"]),
+        float(obj["bestAsk"]), float(obj["bestAskSize"]),
+        int(obj.get("nonce", -1)), int(obj["timestamp"]),
+        _SOURCES.index(source) if source in _SOURCES else 0,
+    ) + _pack_str(obj["market"])
+
+
+def _dec_tob(buf: bytes) -> dict:
+    bid, bid_sz, ask, ask_sz, nonce, ts, src = _TOB.unpack_from(buf, 0)
+    market, _ = _unpack_str(buf, _TOB.size)
+    return {
+        "event": "topOfBook", "market": market,
+        "bestBid": bid, "bestBidSize": bid_sz, "bestAsk": ask, "bestAskSize": ask_sz,
+        "nonce": nonce, "source": _SOURCES[src], "timestamp": ts,
+    }
+
+
+def _enc_trade(obj: Mapping) -> bytes:
+    side = obj.get("side") or ""
+    return _TRADE.pack(
+        int(obj["timestamp"]), float(obj["price"]), float(obj["amount"]),
+        _SIDES.index(side) if side in _SIDES else 0,
+    ) + _pack_str(obj["market"]) + _pack_str(obj.get("id")) + _pack_str(obj.get("event", "trade"))
+
+
+def _dec_trade(buf: bytes) -> dict:
+    ts, price, amount, side = _TRADE.unpack_from(buf, 0)
+    market, off = _unpack_str(buf, _TRADE.size)
+    trade_id, off = _unpack_str(buf, off)
+    event, _ = _unpack_str(buf, off)
+    return {
+        "event": event, "timestamp": ts, "market": market, "id": trade_id,
+        "price": price, "amount": amount, "side": _SIDES[side],
+    }
+
+
+def _enc_candle(obj: Mapping) -> bytes:
+    c = obj["candle"]
+    return _CANDLE.pack(
+        int(c[0]), float(c[1]), float(c[2]), float(c[3]), float(c[4]), float(c[5]),
+    ) + _pack_str(obj["market"]) + _pack_str(obj.get("interval"))
+
+
+def _dec_candle(buf: bytes) -> dict:
+    t, o, h, l, c, v = _CANDLE.unpack_from(buf, 0)
+    market, off = _unpack_str(buf, _CANDLE.size)
+    interval, _ = _unpack_str(buf, off)
+    return {"market": market, "interval": interval, "candle": [t, o, h, l, c, v]}
+
+
+def _enc_candle2(obj: Mapping) -> bytes:
+    c = obj["candle"]
+    closed = obj.get("closed")
+    return _CANDLE2.pack(
+        int(c[0]), float(c[1]), float(c[2]), float(c[3]), float(c[4]), float(c[5]),
+        2 if closed is None else int(bool(closed)),
+    ) + _pack_str(obj["market"]) + _pack_str(obj.get("interval"))
+
+
+def _dec_candle2(buf: bytes) -> dict:
+    t, o, h, l, c, v, closed = _CANDLE2.unpack_from(buf, 0)
+    market, off = _unpack_str(buf, _CANDLE2.size)
+    interval, _ = _unpack_str(buf, off)
+    ev = {"market": market, "interval": interval, "candle": [t, o, h, l, c, v]}
+    if closed != 2:
+        ev["closed"] = bool(closed)
+    return ev
+
+
+_ENCODERS: Dict[str, Callable[[Mapping], bytes]] = {
+    CT_TOB: _enc_tob,
+    CT_TRADE: _enc_trade,
+    CT_CANDLE: _enc_candle,
+    CT_CANDLE2: _enc_candle2,
+}
+_DECODERS: Dict[str, Callable[[bytes], dict]] = {
+    CT_TOB: _dec_tob,
+    CT_TRADE: _dec_trade,
+    CT_CANDLE: _dec_candle,
+    CT_CANDLE2: _dec_candle2,
+}
+
+
+def _as_str(value: Union[str, bytes, None]) -> Optional[str]:
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8")
+    return value
+
+
+def decode_fields(fields: Fields) -> dict:
+    """Decode one stream entry (``str`` or ``bytes`` keys) into an event dict.
+
+    Returns ``{}`` when the entry has no usable payload.
+    """
+    raw = fields.get("data", fields.get(b"data"))
+    if raw is None:
+        return {}
+    ct = _as_str(fields.get("ct", fields.get(b"ct")))
+    try:
+        if ct and ct != CT_JSON:
+            decoder = _DECODERS.get(ct)
+            if decoder is None:
+                return {}
+            if isinstance(raw, str):
+                # client met decode_responses=True kan binaire payloads niet lezen
+                return {}
+            return decoder(bytes(raw))
+        ev = jsonf.loads(raw)
+        if isinstance(ev, str):
+            ev = jsonf.loads(ev)
+        return ev if isinstance(ev, dict) else {}
+    except Exception:
+        return {}
+
+
+class WireCodec:
+    """Per-stream encoder selection; streams without a rule publish JSON.
+
+    Rules map a stream name or ``fnmatch`` pattern to a content type, e.g.
+    ``{"bitvavo:book": "tob/1", "bitvavo:candles:*": "candle/1"}``.
+    """
+
+    def __init__(self, formats: Optional[Mapping[str, str]] = None):
+        self._rules = dict(formats or {})
+        for ct in self._rules.values():
+            if ct != CT_JSON and ct not in _ENCODERS:
+                raise ValueError(f"Onbekend wire-format: {ct} (toegestaan: {CT_JSON}, {', '.join(_ENCODERS)})")
+        self._cache: Dict[str, Optional[Callable[[Mapping], bytes]]] = {}
+        self._ct: Dict[str, bytes] = {}
+
+    @classmethod
+    def from_env(cls, env_var: str = "WIRE_FORMATS") -> "WireCodec":
+        """Parse ``stream=ct`` pairs, comma separated (``bitvavo:book=tob/1,...``)."""
+        formats = {}
+        for part in os.getenv(env_var, "").split(","):
+            stream, _, ct = part.strip().partition("=")
+            if stream and ct:
+                formats[stream.strip()] = ct.strip()
+        return cls(formats)
+
+    def _encoder_for(self, stream: str) -> Optional[Callable[[Mapping], bytes]]:
+        if stream in self._cache:
+            return self._cache[stream]
+        ct = self._rules.get(stream)
+        if ct is None:
+            for pattern, candidate in self._rules.items():
+                if fnmatch.fnmatchcase(stream, pattern):
+                    ct = candidate
+                    break
+        encoder = _ENCODERS.get(ct) if ct else None
+        if encoder is not None:
+            self._ct[stream] = ct.encode("ascii")
+        self._cache[stream] = encoder
+        return encoder
+
+    def encode(self, stream: str, obj: Mapping) -> Dict[str, bytes]:
+        encoder = self._encoder_for(stream)
+        if encoder is not None:
+            try:
+                return {"data": encoder(obj), "ct": self._ct[stream]}
+            except (KeyError, IndexError, TypeError, ValueError, struct.error):
+                pass
+        return {"data": jsonf.dumps(obj)}
+
+
+__all__ = ["CT_CANDLE", "CT_CANDLE2", "CT_JSON", "CT_TOB", "CT_TRADE", "WireCodec", "decode_fields"]
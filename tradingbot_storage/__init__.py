@@ -1,5 +1,23 @@
 """Storage utilities for the Bitvavo trading bot."""
 
-from .parquet_sink import ParquetConfig, ParquetSink
+from .compact import CompactionResult, closed_days, compact_day
+from .manifest import Manifest
+from .parquet_sink import BACKPRESSURE_POLICIES, SCHEMA_MODES, ParquetConfig, ParquetSink
+from .rolling import RollingParquetWriter, quarantine_inprogress
+from .schemas import SCHEMAS, build_table, schema_for
 
-__all__ = ["ParquetConfig", "ParquetSink"]
+__all__ = [
+    "BACKPRESSURE_POLICIES",
+    "CompactionResult",
+    "Manifest",
+    "SCHEMAS",
+    "SCHEMA_MODES",
+    "ParquetConfig",
+    "ParquetSink",
+    "RollingParquetWriter",
+    "build_table",
+    "closed_days",
+    "compact_day",
+    "quarantine_inprogress",
+    "schema_for",
+]
@@ -0,0 +1,261 @@
+"""Compaction of closed daily Parquet partitions.
+
+Ingest lands many small files per ``<day>/<event>/`` directory
+(``<market>-<HHMMSS>-<token>.parquet``).  Once a day is closed,
+:func:`compact_day` rewrites every event directory into a few large
+``compacted-NNNNN.parquet`` files, sorted by market and timestamp and
+compressed with zstd:
+
+1. input files are grouped per market and schema: ingest files by the
+   market in their name, earlier ``compacted-*`` files (a late file arrived)
+   by the distinct values of their ``market`` column;
+2. each market is read (filtered on ``market``), sorted on its time column and appended to the
+   current output file, which rolls over at ``target_rows``;
+3. output row counts are checked against the input footers;
+4. other files in the directory (the JSONL of ``trades/``) move along, and
+   the new directory is swapped in with two renames; the old one is removed;
+5. the day/event manifest (:mod:`tradingbot_storage.manifest`) is rewritten
+   for the new files.
+
+Readers can briefly see the event directory missing between the two renames,
+but never a mix of old and new files.  Directories with ``.inprogress``
+files (an ingest still writing, or a crashed writer) are skipped, unless
+``quarantine_inprogress`` moves them to ``<day>/_orphaned/`` first (closed
+days only).
+"""
+from __future__ import annotations
+
+import datetime as dt
+import os
+import pathlib
+import shutil
+import sys
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .manifest import COMPACTED_PREFIX, FileEntry, Manifest, market_of_file, table_stats
+from .rolling import INPROGRESS_SUFFIX, quarantine_inprogress as _quarantine
+from .schemas import time_column
+
+
+@dataclass
+class CompactionResult:
+    day: str
+    event: str
+    input_files: int = 0
+    output_files: int = 0
+    rows: int = 0
+    skipped: Optional[str] = None
+    quarantined: int = 0
+    outputs: List[pathlib.Path] = field(default_factory=list)
+
+
+def closed_days(base_dir: pathlib.Path, min_age_hours: float = 2.0, now: Optional[dt.datetime] = None) -> List[str]:
+    """Day directories whose UTC day ended at least ``min_age_hours`` ago."""
+    now = now or dt.datetime.utcnow()
+    days = []
+    for child in sorted(pathlib.Path(base_dir).iterdir()):
+        try:
+            day = dt.datetime.strptime(child.name, "%Y-%m-%d")
+        except ValueError:
+            continue
+        if child.is_dir() and now - (day + dt.timedelta(days=1)) >= dt.timedelta(hours=min_age_hours):
+            days.append(child.name)
+    return days
+
+
+def _markets_in(path: pathlib.Path, schema: pa.Schema) -> List[str]:
+    if path.name.startswith(COMPACTED_PREFIX) and "market" in schema.names:
+        # meerdere markten per bestand: de bestandsnaam zegt niets
+        column = pq.read_table(path, columns=["market"]).column("market")
+        return pc.unique(column).drop_null().to_pylist()
+    return [market_of_file(path)]
+
+
+class _OutputRoller:
+    def __init__(self, directory: pathlib.Path, schema: pa.Schema, target_rows: int, compression: str,
+                 compression_level: Optional[int], start_index: int):
+        self.directory = directory
+        self.schema = schema
+        self.target_rows = target_rows
+        self.compression = compression
+        self.compression_level = compression_level
+        self.index = start_index
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.rows_in_file = 0
+        self.paths: List[pathlib.Path] = []
+        self.stats: Dict[pathlib.Path, FileEntry] = {}
+
+    def write(self, market: str, table: pa.Table) -> None:
+        if self.writer is not None and self.rows_in_file >= self.target_rows:
+            self.close()
+        if self.writer is None:
+            path = self.directory / f"{COMPACTED_PREFIX}{self.index:05d}.parquet"
+            self.index += 1
+            self.writer = pq.ParquetWriter(
+                str(path), self.schema, compression=self.compression, compression_level=self.compression_level,
+            )
+            self.paths.append(path)
+            self.stats[path] = FileEntry(path.name)
+            self.rows_in_file = 0
+        self.writer.write_table(table, row_group_size=256 * 1024)
+        self.rows_in_file += table.num_rows
+        rows, lo, hi = table_stats(table)
+        entry = self.stats[self.paths[-1]]
+        entry.markets.append(market)
+        entry.rows += rows
+        if lo is not None:
+            entry.min_ts = lo if entry.min_ts is None else min(entry.min_ts, lo)
+            entry.max_ts = hi if entry.max_ts is None else max(entry.max_ts, hi)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def _abort_staging(staging: pathlib.Path, moved: List[pathlib.Path]) -> None:
+    """Put the files moved along back in the event directory, then drop the staging directory."""
+    stranded = []
+    for path in moved:
+        try:
+            os.rename(staging / path.name, path)
+        except OSError:
+            stranded.append(path.name)
+    if stranded:
+        # niet weggooien: dit zijn de enige kopieën
+        print(f"[compact] {len(stranded)} files left in {staging}: {', '.join(stranded)}", file=sys.stderr)
+        return
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def compact_event_dir(
+    event_dir: pathlib.Path,
+    target_rows: int = 5_000_000,
+    compression: str = "zstd",
+    compression_level: Optional[int] = None,
+    dry_run: bool = False,
+    manifest: Optional[Manifest] = None,
+    quarantine_inprogress: bool = False,
+) -> CompactionResult:
+    result = CompactionResult(event_dir.parent.name, event_dir.name)
+    if quarantine_inprogress and not dry_run:
+        result.quarantined = len(_quarantine(event_dir))
+    if any(p.name.endswith(INPROGRESS_SUFFIX) for p in event_dir.iterdir()):
+        result.skipped = "inprogress-files"
+        return result
+    inputs = sorted(event_dir.glob("*.parquet"))
+    result.input_files = len(inputs)
+    if not inputs:
+        result.skipped = "no-parquet"
+        return result
+    if len(inputs) == 1 or all(p.name.startswith(COMPACTED_PREFIX) for p in inputs):
+        result.skipped = "already-compact"
+        return result
+
+    # per schema (typed/json naast elkaar op een omschakeldag) en per markt groeperen
+    groups: Dict[str, Dict[str, List[pathlib.Path]]] = defaultdict(lambda: defaultdict(list))
+    schemas: Dict[str, pa.Schema] = {}
+    expected_rows = 0
+    for path in inputs:
+        meta = pq.read_metadata(path)
+        schema = meta.schema.to_arrow_schema()
+        key = schema.to_string(show_schema_metadata=False)
+        schemas.setdefault(key, schema)
+        for market in _markets_in(path, schema):
+            groups[key][market].append(path)
+        expected_rows += meta.num_rows
+    result.rows = expected_rows
+    if dry_run:
+        result.skipped = "dry-run"
+        return result
+
+    token = uuid.uuid4().hex[:10]
+    staging = event_dir.with_name(f".{event_dir.name}.compact-{token}")
+    staging.mkdir()
+    stats: Dict[pathlib.Path, FileEntry] = {}
+    moved: List[pathlib.Path] = []
+    swapped = False
+    try:
+        index = 0
+        for key, markets in groups.items():
+            schema = schemas[key]
+            sort_col = time_column(schema)
+            roller = _OutputRoller(staging, schema, target_rows, compression, compression_level, index)
+            try:
+                for market in sorted(markets):
+                    filters = [("market", "=", market)] if "market" in schema.names else None
+                    table = pq.read_table([str(p) for p in markets[market]], schema=schema, filters=filters)
+                    if sort_col is not None:
+                        table = table.sort_by([(sort_col, "ascending")])
+                    roller.write(market, table)
+            finally:
+                roller.close()
+            index = roller.index
+            result.outputs.extend(roller.paths)
+            stats.update(roller.stats)
+
+        written = sum(pq.read_metadata(p).num_rows for p in result.outputs)
+        if written != expected_rows:
+            raise RuntimeError(f"row count mismatch in {event_dir}: {expected_rows} in, {written} out")
+        if sorted(event_dir.glob("*.parquet")) != inputs:
+            raise RuntimeError(f"{event_dir} changed during compaction")
+
+        # overige bestanden (bv. JSONL in trades/) verhuizen mee naar de nieuwe map
+        keep = set(inputs)
+        for other in event_dir.iterdir():
+            if other not in keep:
+                os.rename(other, staging / other.name)
+                moved.append(other)
+
+        # swap: oude map opzij, nieuwe op zijn plek, oude weg
+        retired = event_dir.with_name(f".{event_dir.name}.old-{token}")
+        os.rename(event_dir, retired)
+        try:
+            os.rename(staging, event_dir)
+        except BaseException:
+            os.rename(retired, event_dir)
+            raise
+        swapped = True
+        shutil.rmtree(retired)
+    except BaseException:
+        if not swapped:
+            _abort_staging(staging, moved)
+        raise
+    result.outputs = [event_dir / p.name for p in result.outputs]
+    result.output_files = len(result.outputs)
+    if manifest is not None:
+        manifest.replace(result.day, result.event, [
+            manifest.entry_for(event_dir / p.name, s.markets, s.rows, s.min_ts, s.max_ts) for p, s in stats.items()
+        ])
+    return result
+
+
+def compact_day(
+    base_dir: pathlib.Path,
+    day: str,
+    events: Optional[Sequence[str]] = None,
+    **kwargs,
+) -> List[CompactionResult]:
+    """Compact every event directory of one day (or only ``events``)."""
+    day_dir = pathlib.Path(base_dir) / day
+    results = []
+    for event_dir in sorted(p for p in day_dir.iterdir() if p.is_dir() and p.name[:1] not in (".", "_")):
+        if events and event_dir.name not in events:
+            continue
+        results.append(compact_event_dir(event_dir, **kwargs))
+    return results
+
+
+__all__ = [
+    "CompactionResult",
+    "closed_days",
+    "compact_day",
+    "compact_event_dir",
+]
@@ -0,0 +1,240 @@
+"""Dataset manifest per ``<day>/<event>`` for partition pruning.
+
+Without an index every historical read has to glob a day directory and open
+every footer.  The sink and the compactor record each finished Parquet file
+in ``<day>/_manifest/<event>.jsonl``: one line per file with its path
+(relative to the base directory), markets, row count and min/max of the time
+column in epoch milliseconds.
+
+* :meth:`Manifest.add` appends lines (one ``os.write`` on an ``O_APPEND``
+  descriptor, so several ingest processes can share a manifest);
+* :meth:`Manifest.replace` rewrites the manifest of a day/event atomically
+  (compaction, :meth:`Manifest.rebuild`);
+* :meth:`Manifest.prune` returns only the files that can hold rows for a
+  query such as "BTC-EUR trades between 10:00 and 11:00".
+
+Files missing from a manifest (written before it existed, with
+``PARQUET_MANIFEST=false``, or by a process that died before recording them)
+are always returned, so pruning never hides data; a directory listing is
+still far cheaper than opening every footer.
+``tools/parquet_compact.py --rebuild-manifest`` indexes them.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import os
+import pathlib
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import orjson as jsonf
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .schemas import time_column
+
+MANIFEST_DIR = "_manifest"
+COMPACTED_PREFIX = "compacted-"
+
+TimeLike = Union[dt.datetime, dt.date, int, float, str, None]
+
+_UNIT_PER_MS = {"s": None, "ms": 1, "us": 1000, "ns": 1000000}
+
+
+@dataclass
+class FileEntry:
+    path: str
+    markets: List[str] = field(default_factory=list)
+    rows: int = 0
+    min_ts: Optional[int] = None
+    max_ts: Optional[int] = None
+
+    def overlaps(self, start_ms: Optional[int], end_ms: Optional[int]) -> bool:
+        """Whether ``[min_ts, max_ts]`` can intersect ``[start_ms, end_ms)``."""
+        if self.min_ts is None or self.max_ts is None:
+            return True  # zonder statistiek niet wegsnoeien
+        if start_ms is not None and self.max_ts < start_ms:
+            return False
+        if end_ms is not None and self.min_ts >= end_ms:
+            return False
+        return True
+
+
+def market_of_file(path: pathlib.Path) -> str:
+    """``BTC-EUR-123456-ab12cd34ef.parquet`` -> ``BTC-EUR``."""
+    parts = path.stem.rsplit("-", 2)
+    return parts[0] if len(parts) == 3 else path.stem
+
+
+def to_ms(value: TimeLike) -> Optional[int]:
+    """Epoch milliseconds from a datetime (naive = UTC), date, ISO string or number."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = dt.datetime.fromisoformat(value)
+    if not isinstance(value, dt.datetime):
+        value = dt.datetime.combine(value, dt.time())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt.timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _scalar_ms(scalar: pa.Scalar, unit: str) -> Optional[int]:
+    if not scalar.is_valid:
+        return None
+    value = scalar.cast(pa.int64()).as_py()
+    per_ms = _UNIT_PER_MS.get(unit)
+    return value * 1000 if per_ms is None else value // per_ms
+
+
+def table_stats(table: pa.Table) -> Tuple[int, Optional[int], Optional[int]]:
+    """Rows and min/max (epoch ms) of the table's time column."""
+    name = time_column(table.schema)
+    if name is None or table.num_rows == 0:
+        return table.num_rows, None, None
+    column = table.column(name)
+    if not pa.types.is_timestamp(column.type):
+        return table.num_rows, None, None
+    mm = pc.min_max(column)
+    unit = column.type.unit
+    return table.num_rows, _scalar_ms(mm["min"], unit), _scalar_ms(mm["max"], unit)
+
+
+def days_in_range(base_dir: pathlib.Path, start_ms: Optional[int], end_ms: Optional[int]) -> List[str]:
+    """UTC day partitions touched by ``[start_ms, end_ms)``; open ends use the days on disk."""
+    if start_ms is None or end_ms is None:
+        if not base_dir.is_dir():
+            return []
+        days = sorted(p.name for p in base_dir.iterdir() if p.is_dir() and p.name[:1].isdigit())
+        first = dt.datetime.utcfromtimestamp(start_ms / 1000).strftime("%Y-%m-%d") if start_ms is not None else ""
+        last = dt.datetime.utcfromtimestamp((end_ms - 1) / 1000).strftime("%Y-%m-%d") if end_ms is not None else "9"
+        return [d for d in days if first <= d <= last]
+    day = dt.datetime.utcfromtimestamp(start_ms / 1000).date()
+    last = dt.datetime.utcfromtimestamp((end_ms - 1) / 1000).date()
+    days = []
+    while day <= last:
+        days.append(day.strftime("%Y-%m-%d"))
+        day += dt.timedelta(days=1)
+    return days
+
+
+class Manifest:
+    """Per day/event file index under ``<base>/<day>/_manifest/``."""
+
+    def __init__(self, base_dir: pathlib.Path):
+        self.base_dir = pathlib.Path(base_dir).expanduser()
+        self._lock = threading.Lock()
+
+    def path(self, day: str, event: str) -> pathlib.Path:
+        return self.base_dir / day / MANIFEST_DIR / f"{event}.jsonl"
+
+    def entry_for(self, path: pathlib.Path, markets: Sequence[str], rows: int,
+                  min_ts: Optional[int], max_ts: Optional[int]) -> FileEntry:
+        rel = pathlib.Path(path).relative_to(self.base_dir).as_posix()
+        return FileEntry(rel, sorted(set(markets)), rows, min_ts, max_ts)
+
+    def add(self, day: str, event: str, entries: Iterable[FileEntry]) -> None:
+        data = b"".join(jsonf.dumps(asdict(e)) + b"\n" for e in entries)
+        if not data:
+            return
+        target = self.path(day, event)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def replace(self, day: str, event: str, entries: Iterable[FileEntry]) -> None:
+        target = self.path(day, event)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(b"".join(jsonf.dumps(asdict(e)) + b"\n" for e in entries))
+        os.replace(tmp, target)
+
+    def entries(self, day: str, event: str) -> Optional[Dict[str, FileEntry]]:
+        """Entries by relative path, or ``None`` when the day/event has no manifest."""
+        target = self.path(day, event)
+        try:
+            raw = target.read_bytes()
+        except FileNotFoundError:
+            return None
+        out: Dict[str, FileEntry] = {}
+        for line in raw.splitlines():
+            try:
+                entry = FileEntry(**jsonf.loads(line))
+            except (ValueError, TypeError):
+                continue  # halve regel na een crash
+            out[entry.path] = entry
+        return out
+
+    def rebuild(self, day: str, event: str) -> int:
+        """Index the existing ``*.parquet`` files of a day/event from their data."""
+        entries = []
+        for path in sorted((self.base_dir / day / event).glob("*.parquet")):
+            schema = pq.read_schema(path)
+            name = time_column(schema)
+            columns = [c for c in ("market", name) if c and c in schema.names]
+            table = pq.read_table(path, columns=columns)
+            rows, lo, hi = table_stats(table)
+            if "market" in table.column_names:
+                markets = pc.unique(table.column("market")).drop_null().to_pylist()
+            else:
+                markets = [market_of_file(path)]
+            entries.append(self.entry_for(path, markets, rows, lo, hi))
+        self.replace(day, event, entries)
+        return len(entries)
+
+    def prune(
+        self,
+        event: str,
+        markets: Optional[Sequence[str]] = None,
+        start: TimeLike = None,
+        end: TimeLike = None,
+    ) -> List[pathlib.Path]:
+        """Files of ``event`` that may contain ``markets`` rows in ``[start, end)``."""
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        wanted = set(markets) if markets else None
+        files: List[pathlib.Path] = []
+        for day in days_in_range(self.base_dir, start_ms, end_ms):
+            entries = self.entries(day, event)
+            if entries is None:
+                files.extend(self._glob(day, event, wanted))
+                continue
+            # bestanden die (nog) niet in het manifest staan altijd meenemen
+            files.extend(p for p in self._glob(day, event, wanted)
+                         if p.relative_to(self.base_dir).as_posix() not in entries)
+            for entry in entries.values():
+                if wanted is not None and entry.markets and wanted.isdisjoint(entry.markets):
+                    continue
+                if not entry.overlaps(start_ms, end_ms):
+                    continue
+                path = self.base_dir / entry.path
+                if path.exists():  # bv. manifest niet meer bijgewerkt na een crash
+                    files.append(path)
+        return files
+
+    def _glob(self, day: str, event: str, wanted: Optional[set]) -> List[pathlib.Path]:
+        out = []
+        for path in sorted((self.base_dir / day / event).glob("*.parquet")):
+            if wanted is None or path.name.startswith(COMPACTED_PREFIX) or market_of_file(path) in wanted:
+                out.append(path)
+        return out
+
+
+__all__ = [
+    "COMPACTED_PREFIX",
+    "FileEntry",
+    "MANIFEST_DIR",
+    "Manifest",
+    "days_in_range",
+    "market_of_file",
+    "table_stats",
+    "to_ms",
+]
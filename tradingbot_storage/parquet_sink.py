@@ -3,84 +3,273 @@
 The blueprint prescribes Redis Streams as the realtime transport and
 Parquet as the durable landing zone.  The sink keeps the interface tiny so
 that ingest scripts can drop batches without having to know about the
-filesystem layout or pyarrow internals.
+filesystem layout or pyarrow internals.  Batches are written with the
+typed per-event schemas from :mod:`tradingbot_storage.schemas`
+(``PARQUET_SCHEMA=json`` keeps the old single ``payload`` column) and, by
+default, appended as row groups to rolling per-(day, event, market) files
+(:mod:`tradingbot_storage.rolling`); ``PARQUET_ROLLING=false`` goes back to
+one file per batch.
+
+With ``PARQUET_ASYNC=true`` :meth:`ParquetSink.write` only enqueues the batch;
+writer threads (``pq.write_table`` releases the GIL) drain a bounded queue so
+a slow disk no longer stalls websocket callbacks.  When the queue is full the
+backpressure policy decides: ``block`` the caller, ``drop-oldest`` batch, or
+``spill`` the new batch to ``<day>/_spill/<event>/<market>.jsonl`` for later
+replay.  Queue depth, drops, spills and enqueue-to-disk latency are available
+from :meth:`ParquetSink.stats`.
+
+Every finished file is recorded in the day/event manifest
+(:mod:`tradingbot_storage.manifest`) unless ``PARQUET_MANIFEST=false``.
 """
 from __future__ import annotations
 
 import datetime as dt
 import os
 import pathlib
+import sys
 import threading
+import time
 import uuid
+from collections import deque
 from dataclasses import dataclass
-from typing import Iterable, List, Mapping
+from typing import Deque, Dict, Iterable, List, Mapping, Optional, Tuple
 
 import orjson as jsonf
 import pyarrow as pa
 import pyarrow.parquet as pq
 
+from .manifest import Manifest, table_stats
+from .rolling import INPROGRESS_SUFFIX, RollingParquetWriter
+from .schemas import JSON_SCHEMA, build_table, json_table
+
+
+BACKPRESSURE_POLICIES = ("block", "drop-oldest", "spill")
+# typed: kolommen per event-familie (schemas.py); json: ingested_at/event/market/payload
+SCHEMA_MODES = ("typed", "json")
+
+_Job = Tuple[str, str, List[Mapping[str, object]], float]
+
 
 @dataclass(frozen=True)
 class ParquetConfig:
     base_dir: pathlib.Path
+    async_mode: bool = False
+    queue_size: int = 256
+    workers: int = 1
+    backpressure: str = "block"
+    stats_secs: float = 60.0
+    schema_mode: str = "typed"
+    rolling: bool = True
+    rotate_bytes: int = 128 * 1024 * 1024
+    rotate_secs: float = 300.0
+    max_open: int = 256
+    manifest: bool = True
+
+    def __post_init__(self) -> None:
+        if self.schema_mode not in SCHEMA_MODES:
+            raise ValueError(f"Onbekende PARQUET_SCHEMA: {self.schema_mode} (toegestaan: {', '.join(SCHEMA_MODES)})")
+        if self.backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                f"Onbekende backpressure-policy: {self.backpressure} (toegestaan: {', '.join(BACKPRESSURE_POLICIES)})"
+            )
 
     @classmethod
     def from_env(cls, env_var: str = "PARQUET_DIR", default: str = "/srv/trading/storage/parquet") -> "ParquetConfig":
         base = pathlib.Path(os.getenv(env_var, default)).expanduser()
-        return cls(base)
+        return cls(
+            base,
+            async_mode=os.getenv("PARQUET_ASYNC", "false").lower() in ("1", "true", "yes", "on"),
+            queue_size=int(os.getenv("PARQUET_QUEUE", "256")),
+            workers=int(os.getenv("PARQUET_WORKERS", "1")),
+            backpressure=os.getenv("PARQUET_BACKPRESSURE", "block"),
+            stats_secs=float(os.getenv("PARQUET_STATS_SECS", "60")),
+            schema_mode=os.getenv("PARQUET_SCHEMA", "typed"),
+            rolling=os.getenv("PARQUET_ROLLING", "true").lower() in ("1", "true", "yes", "on"),
+            rotate_bytes=int(float(os.getenv("PARQUET_ROTATE_MB", "128")) * 1024 * 1024),
+            rotate_secs=float(os.getenv("PARQUET_ROTATE_SECS", "300")),
+            max_open=int(os.getenv("PARQUET_MAX_OPEN", "256")),
+            manifest=os.getenv("PARQUET_MANIFEST", "true").lower() in ("1", "true", "yes", "on"),
+        )
+
+
+def _filename(market: str) -> str:
+    safe_market = market.replace("/", "-") or "unknown"
+    ts = dt.datetime.utcnow().strftime("%H%M%S")
+    token = uuid.uuid4().hex[:10]
+    return f"{safe_market}-{ts}-{token}.parquet"
+
+
+def write_partition(
+    base_dir: pathlib.Path,
+    day: str,
+    event: str,
+    market: str,
+    table: pa.Table,
+    manifest: Optional[Manifest] = None,
+    compression: str = "snappy",
+) -> pathlib.Path:
+    """Write ``table`` as a new file in ``<base>/<day>/<event>/`` (live layout) and record it.
+
+    The file appears under its final name only once complete.
+    """
+    directory = pathlib.Path(base_dir) / day / event
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / _filename(market)
+    tmp = path.with_name(path.name + INPROGRESS_SUFFIX)
+    pq.write_table(table, tmp, compression=compression)
+    os.replace(tmp, path)
+    if manifest is not None:
+        rows, lo, hi = table_stats(table)
+        manifest.add(day, event, [manifest.entry_for(path, [market], rows, lo, hi)])
+    return path
 
 
 class ParquetSink:
     """Append-only Parquet writer for websocket event batches."""
 
-    _SCHEMA = pa.schema(
-        [
-            ("ingested_at", pa.timestamp("us")),
-            ("event", pa.string()),
-            ("market", pa.string()),
-            ("payload", pa.string()),
-        ]
-    )
+    _SCHEMA = JSON_SCHEMA
 
     def __init__(self, config: ParquetConfig):
         self._config = config
         self._lock = threading.Lock()
-
-    def _daily_dir(self, event: str) -> pathlib.Path:
-        day = dt.datetime.utcnow().strftime("%Y-%m-%d")
-        target = self._config.base_dir / day / event
-        target.mkdir(parents=True, exist_ok=True)
-        return target
-
-    def _filename(self, event: str, market: str) -> str:
-        safe_market = market.replace("/", "-") or "unknown"
-        ts = dt.datetime.utcnow().strftime("%H%M%S")
-        token = uuid.uuid4().hex[:10]
-        return f"{safe_market}-{ts}-{token}.parquet"
+        self._cond = threading.Condition()
+        self._queue: Deque[_Job] = deque()
+        self._busy = 0
+        self._closing = False
+        self._counters: Dict[str, float] = {
+            "written": 0, "dropped": 0, "spilled": 0, "errors": 0,
+            "latency_ms_last": 0.0, "latency_ms_max": 0.0, "latency_ms_sum": 0.0,
+        }
+        self._manifest = Manifest(config.base_dir) if config.manifest else None
+        self._rolling: Optional[RollingParquetWriter] = None
+        if config.rolling:
+            self._rolling = RollingParquetWriter(
+                config.base_dir, config.rotate_bytes, config.rotate_secs, config.max_open, manifest=self._manifest,
+            )
+        self._threads: List[threading.Thread] = []
+        if config.async_mode:
+            for i in range(max(1, config.workers)):
+                t = threading.Thread(target=self._run, name=f"parquet-writer-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
 
     def write(self, event: str, market: str, rows: Iterable[Mapping[str, object]]) -> None:
         batch: List[Mapping[str, object]] = list(rows)
         if not batch:
             return
+        if not self._threads:
+            with self._lock:
+                self._write(event, market, batch)
+            return
+        self._enqueue((event, market, batch, time.monotonic()))
 
-        payload_rows = []
-        now = dt.datetime.utcnow()
-        for row in batch:
-            payload_rows.append(
-                {
-                    "ingested_at": now,
-                    "event": event,
-                    "market": market,
-                    "payload": jsonf.dumps(row).decode("utf-8"),
-                }
-            )
+    def _enqueue(self, job: _Job) -> None:
+        policy = self._config.backpressure
+        spill = False
+        with self._cond:
+            if len(self._queue) >= self._config.queue_size:
+                if policy == "spill":
+                    self._counters["spilled"] += 1
+                    spill = True
+                elif policy == "drop-oldest":
+                    self._queue.popleft()
+                    self._counters["dropped"] += 1
+                else:
+                    while len(self._queue) >= self._config.queue_size and not self._closing:
+                        self._cond.wait()
+            if not spill:
+                self._queue.append(job)
+                self._cond.notify_all()
+                return
+        self._spill(*job[:3])
+
+    def _spill(self, event: str, market: str, batch: List[Mapping[str, object]]) -> None:
+        # buiten de lock: de writer-threads hoeven niet op deze append te wachten
+        day = dt.datetime.utcnow().strftime("%Y-%m-%d")
+        target = self._config.base_dir / day / "_spill" / event
+        try:
+            target.mkdir(parents=True, exist_ok=True)
+            with open(target / f"{market.replace('/', '-') or 'unknown'}.jsonl", "ab") as f:
+                f.write(b"".join(jsonf.dumps(row) + b"\n" for row in batch))
+        except OSError as e:
+            self._counters["errors"] += 1
+            print(f"[parquet] spill {event}/{market} failed: {e}", file=sys.stderr)
+
+    def _write(self, event: str, market: str, batch: List[Mapping[str, object]]) -> None:
+        if self._config.schema_mode == "typed":
+            table = build_table(event, market, batch)
+        else:
+            table = json_table(event, market, batch)
+        if self._rolling is not None:
+            self._rolling.append(event, market, table)
+            return
+        # elke batch een eigen bestand: writer-threads hoeven niet op elkaar te wachten
+        day = dt.datetime.utcnow().strftime("%Y-%m-%d")
+        write_partition(self._config.base_dir, day, event, market, table, self._manifest)
+
+    def _run(self) -> None:
+        next_stats = time.monotonic() + self._config.stats_secs
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait(timeout=1.0)
+                if not self._queue:
+                    return
+                event, market, batch, enqueued = self._queue.popleft()
+                self._busy += 1
+                self._cond.notify_all()
+            try:
+                self._write(event, market, batch)
+                ok = True
+            except Exception as e:
+                ok = False
+                print(f"[parquet] write {event}/{market} ({len(batch)} rows) failed: {e}", file=sys.stderr)
+            latency_ms = (time.monotonic() - enqueued) * 1000.0
+            with self._cond:
+                self._busy -= 1
+                c = self._counters
+                if ok:
+                    c["written"] += 1
+                    c["latency_ms_last"] = latency_ms
+                    c["latency_ms_sum"] += latency_ms
+                    c["latency_ms_max"] = max(c["latency_ms_max"], latency_ms)
+                else:
+                    c["errors"] += 1
+                self._cond.notify_all()
+            if self._config.stats_secs > 0 and time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + self._config.stats_secs
+                print(f"[parquet] {self.stats()}", file=sys.stderr)
 
-        table = pa.Table.from_pylist(payload_rows, schema=self._SCHEMA)
-        directory = self._daily_dir(event)
-        file_path = directory / self._filename(event, market)
+    def queue_depth(self) -> int:
+        return len(self._queue)
 
-        with self._lock:
-            pq.write_table(table, file_path)
+    def stats(self) -> Dict[str, float]:
+        """Queue depth, batch counters and enqueue-to-disk latency (ms) of the async mode."""
+        with self._cond:
+            c = dict(self._counters)
+            depth = len(self._queue)
+        written = c.pop("written")
+        latency_sum = c.pop("latency_ms_sum")
+        return {
+            "queue_depth": depth,
+            "written": written,
+            **c,
+            "latency_ms_avg": latency_sum / written if written else 0.0,
+        }
 
+    def close(self, timeout: Optional[float] = 30.0) -> None:
+        """Drain the async queue, stop the writer threads and finalise rolling files."""
+        if self._threads:
+            with self._cond:
+                self._closing = True
+                self._cond.notify_all()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for t in self._threads:
+                t.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            self._threads = []
+            if self._queue:
+                print(f"[parquet] close: {len(self._queue)} batches not written", file=sys.stderr)
+        if self._rolling is not None:
+            self._rolling.close()
 
-__all__ = ["ParquetConfig", "ParquetSink"]
+__all__ = ["BACKPRESSURE_POLICIES", "SCHEMA_MODES", "ParquetConfig", "ParquetSink", "write_partition"]
@@ -0,0 +1,195 @@
+"""Historical reads over the Parquet store (and the legacy JSONL landing).
+
+:func:`load` answers "which rows of ``event`` for these markets between
+``start`` and ``end``" without hand-rolled globbing or JSON parsing:
+
+1. the day/event manifest (:mod:`tradingbot_storage.manifest`) prunes the
+   files to those that can hold matching rows;
+2. typed files are read as one ``pyarrow.dataset`` with the market and time
+   predicates pushed down (row groups whose statistics do not match are
+   skipped) and only the requested columns projected;
+3. files in the old JSON layout (``payload`` column) and days that only have
+   JSONL are parsed and converted with :func:`~.schemas.build_table`, so every
+   part of the result has the typed schema of the event.
+
+Times are epoch ms, datetimes (naive = UTC), dates or ISO strings; ``end`` is
+exclusive.  :func:`to_numpy` turns a result into one array per column.
+"""
+from __future__ import annotations
+
+import os
+import pathlib
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, Iterable, List, Mapping, Optional, Sequence
+
+import orjson as jsonf
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .manifest import Manifest, TimeLike, days_in_range, to_ms
+from .schemas import build_table, family_of, schema_for, time_column
+
+if TYPE_CHECKING:  # numpy is alleen nodig voor to_numpy (pyarrow laadt het dan zelf)
+    import numpy as np
+
+
+def default_base_dir() -> pathlib.Path:
+    return pathlib.Path(os.getenv("PARQUET_DIR", "/srv/trading/storage/parquet")).expanduser()
+
+
+def jsonl_dir(base_dir: pathlib.Path, day: str, event: str) -> pathlib.Path:
+    """Where the ingest scripts land ``event`` as JSONL (see ``JsonlWriter``)."""
+    family, _, sub = event.partition(":")
+    if family == "ticker24h":
+        return base_dir / day
+    if family in ("candles", "orderbook") and sub:
+        return base_dir / day / family / sub
+    return base_dir / day / event
+
+
+def _ts_scalar(ms: int, type_: pa.DataType) -> pa.Scalar:
+    return pa.scalar(ms, type=pa.timestamp("ms")).cast(type_)
+
+
+def _predicate(schema: pa.Schema, markets: Optional[Sequence[str]], start_ms: Optional[int],
+               end_ms: Optional[int]) -> Optional[ds.Expression]:
+    expr: Optional[ds.Expression] = None
+
+    def both(e: ds.Expression) -> ds.Expression:
+        return e if expr is None else expr & e
+
+    if markets:
+        expr = both(ds.field("market").isin(list(markets)))
+    name = time_column(schema)
+    if name is not None and pa.types.is_timestamp(schema.field(name).type):
+        type_ = schema.field(name).type
+        if start_ms is not None:
+            expr = both(ds.field(name) >= _ts_scalar(start_ms, type_))
+        if end_ms is not None:
+            expr = both(ds.field(name) < _ts_scalar(end_ms, type_))
+    return expr
+
+
+def _from_rows(event: str, by_market: Mapping[str, List[dict]], predicate: Optional[ds.Expression]) -> List[pa.Table]:
+    tables = []
+    for market, rows in by_market.items():
+        table = build_table(event, market, rows)
+        if predicate is not None:
+            table = table.filter(predicate)
+        if table.num_rows:
+            tables.append(table)
+    return tables
+
+
+def _legacy_parquet(event: str, files: Sequence[pathlib.Path], markets: Optional[Sequence[str]],
+                    predicate: Optional[ds.Expression]) -> List[pa.Table]:
+    # oude JSON-layout: payload parsen en als getypte tabel opbouwen
+    market_filter = ds.field("market").isin(list(markets)) if markets else None
+    raw = ds.dataset([str(p) for p in files], format="parquet").to_table(
+        columns=["market", "payload"], filter=market_filter,
+    )
+    by_market: Dict[str, List[dict]] = defaultdict(list)
+    for market, payload in zip(raw.column("market").to_pylist(), raw.column("payload").to_pylist()):
+        if payload is not None:
+            by_market[market or ""].append(jsonf.loads(payload))
+    return _from_rows(event, by_market, predicate)
+
+
+def _jsonl(event: str, base_dir: pathlib.Path, day: str, markets: Optional[Sequence[str]],
+           predicate: Optional[ds.Expression]) -> List[pa.Table]:
+    directory = jsonl_dir(base_dir, day, event)
+    if markets:
+        paths = [directory / f"{m.replace('/', '-')}.jsonl" for m in markets]
+    else:
+        paths = sorted(directory.glob("*.jsonl"))
+    by_market: Dict[str, List[dict]] = defaultdict(list)
+    for path in paths:
+        try:
+            raw = path.read_bytes()
+        except FileNotFoundError:
+            continue
+        rows = by_market[path.stem]
+        for line in raw.splitlines():
+            try:
+                rows.append(jsonf.loads(line))
+            except ValueError:
+                continue  # halve regel van een lopende writer
+    return _from_rows(event, by_market, predicate)
+
+
+def load(
+    event: str,
+    markets: Optional[Sequence[str]] = None,
+    start: TimeLike = None,
+    end: TimeLike = None,
+    columns: Optional[Sequence[str]] = None,
+    base_dir: Optional[pathlib.Path] = None,
+    jsonl_fallback: bool = True,
+    sort: bool = True,
+) -> pa.Table:
+    """Rows of ``event`` for ``markets`` in ``[start, end)`` as one Arrow table.
+
+    ``columns`` projects the result (default: every column of the event's
+    schema).  With ``sort`` the rows are ordered by market and time.
+    """
+    base = pathlib.Path(base_dir).expanduser() if base_dir is not None else default_base_dir()
+    schema = schema_for(event)
+    if columns is not None:
+        unknown = [c for c in columns if c not in schema.names]
+        if unknown:
+            raise ValueError(f"Onbekende kolom(men) voor {event}: {unknown} (toegestaan: {', '.join(schema.names)})")
+    start_ms, end_ms = to_ms(start), to_ms(end)
+    predicate = _predicate(schema, markets, start_ms, end_ms)
+    sort_keys = [("market", "ascending")]
+    if time_column(schema) is not None:
+        sort_keys.append((time_column(schema), "ascending"))
+    projection = list(schema.names)
+    if columns is not None:
+        # sorteerkolommen alleen meelezen als ze nodig zijn
+        extra = [k for k, _ in sort_keys if sort and k not in columns]
+        projection = list(columns) + extra
+
+    files = Manifest(base).prune(event, markets, start_ms, end_ms)
+    typed: List[pathlib.Path] = []
+    legacy: List[pathlib.Path] = []
+    for path in files:
+        if family_of(event) is not None and "payload" in pq.read_schema(path).names:
+            legacy.append(path)
+        else:
+            typed.append(path)
+
+    tables: List[pa.Table] = []
+    if typed:
+        dataset = ds.dataset([str(p) for p in typed], schema=schema, format="parquet")
+        tables.append(dataset.to_table(columns=projection, filter=predicate))
+    converted: List[pa.Table] = []
+    if legacy:
+        converted.extend(_legacy_parquet(event, legacy, markets, predicate))
+    if jsonl_fallback:
+        with_parquet = {p.relative_to(base).parts[0] for p in files}
+        for day in days_in_range(base, start_ms, end_ms):
+            if day not in with_parquet and not any((base / day / event).glob("*.parquet")):
+                converted.extend(_jsonl(event, base, day, markets, predicate))
+    tables.extend(t.select(projection) for t in converted)
+
+    table = pa.concat_tables(tables) if tables else schema.empty_table().select(projection)
+    if sort and table.num_rows:
+        table = table.sort_by(sort_keys)
+    if columns is not None:
+        table = table.select(list(columns))
+    return table
+
+
+def to_numpy(table: pa.Table, columns: Optional[Iterable[str]] = None) -> Dict[str, "np.ndarray"]:
+    """One NumPy array per column (timestamps become ``datetime64``)."""
+    names = list(columns) if columns is not None else table.column_names
+    return {name: table.column(name).to_numpy() for name in names}
+
+
+def load_numpy(event: str, markets: Optional[Sequence[str]] = None, start: TimeLike = None, end: TimeLike = None,
+               columns: Optional[Sequence[str]] = None, **kwargs) -> Dict[str, "np.ndarray"]:
+    return to_numpy(load(event, markets, start, end, columns, **kwargs))
+
+
+__all__ = ["default_base_dir", "jsonl_dir", "load", "load_numpy", "to_numpy"]
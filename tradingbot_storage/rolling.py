@@ -0,0 +1,205 @@
+"""Rolling Parquet files: one open ``pq.ParquetWriter`` per (day, event, market).
+
+Writing a new file per batch left hundreds of thousands of tiny files (and
+footers) per day.  :class:`RollingParquetWriter` keeps a writer open per
+partition and appends every batch as a row group.  A file is rotated once
+it has taken ``rotate_bytes`` of (uncompressed) Arrow data or has been open
+for ``rotate_secs``, when its UTC day ends, or when it is the least recently
+used file beyond ``max_open``.
+
+Open files carry an ``.inprogress`` suffix and are renamed to ``.parquet``
+when closed, so dataset readers that glob ``*.parquet`` never see a file
+without footer.  :meth:`close` (called from the SIGTERM paths of the ingest
+processes) finalises every open file.  With a :class:`~.manifest.Manifest`
+every finalised file is recorded with its row count and time range.
+
+A hard kill (kill -9, OOM, power loss) leaves the open files behind without
+footer: unreadable, and up to ``rotate_secs`` of rows per partition (the
+JSONL copy still has them).  :func:`quarantine_inprogress` moves such orphans
+of a closed day out of the event directory, to ``<day>/_orphaned/<event>/``.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import os
+import pathlib
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .manifest import Manifest, table_stats
+
+INPROGRESS_SUFFIX = ".inprogress"
+
+_Key = Tuple[str, str, str]
+
+
+class _OpenFile:
+    __slots__ = ("key", "writer", "tmp_path", "path", "opened", "nbytes", "rows", "min_ts", "max_ts", "lock")
+
+    def __init__(self, key: _Key, writer: pq.ParquetWriter, tmp_path: pathlib.Path, path: pathlib.Path):
+        self.key = key
+        self.writer: Optional[pq.ParquetWriter] = writer
+        self.tmp_path = tmp_path
+        self.path = path
+        self.opened = time.monotonic()
+        self.nbytes = 0
+        self.rows = 0
+        self.min_ts: Optional[int] = None
+        self.max_ts: Optional[int] = None
+        self.lock = threading.Lock()
+
+
+def quarantine_inprogress(event_dir: pathlib.Path) -> List[pathlib.Path]:
+    """Move the ``.inprogress`` files of ``event_dir`` to ``<day>/_orphaned/<event>/``.
+
+    Only for days no writer is still on: the rolling writer closes its files
+    within seconds after 00:00 UTC, so what is left in a closed day is orphaned.
+    """
+    event_dir = pathlib.Path(event_dir)
+    orphans = sorted(p for p in event_dir.iterdir() if p.name.endswith(INPROGRESS_SUFFIX))
+    if not orphans:
+        return []
+    target = event_dir.parent / "_orphaned" / event_dir.name
+    target.mkdir(parents=True, exist_ok=True)
+    moved = []
+    for path in orphans:
+        dest = target / path.name
+        os.replace(path, dest)
+        moved.append(dest)
+    return moved
+
+
+def _utc_day() -> str:
+    return dt.datetime.utcnow().strftime("%Y-%m-%d")
+
+
+class RollingParquetWriter:
+    """Append tables as row groups to long-lived per-partition Parquet files."""
+
+    def __init__(
+        self,
+        base_dir: pathlib.Path,
+        rotate_bytes: int = 128 * 1024 * 1024,
+        rotate_secs: float = 300.0,
+        max_open: int = 256,
+        compression: str = "snappy",
+        manifest: Optional[Manifest] = None,
+    ):
+        self._base_dir = pathlib.Path(base_dir)
+        self._rotate_bytes = rotate_bytes
+        self._rotate_secs = rotate_secs
+        self._max_open = max_open
+        self._compression = compression
+        self._manifest = manifest
+        self._lock = threading.Lock()
+        self._files: "OrderedDict[_Key, _OpenFile]" = OrderedDict()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="parquet-rotate", daemon=True)
+        self._thread.start()
+
+    def _open(self, key: _Key, schema: pa.Schema) -> _OpenFile:
+        day, event, market = key
+        directory = self._base_dir / day / event
+        directory.mkdir(parents=True, exist_ok=True)
+        safe_market = market.replace("/", "-") or "unknown"
+        ts = dt.datetime.utcnow().strftime("%H%M%S")
+        path = directory / f"{safe_market}-{ts}-{uuid.uuid4().hex[:10]}.parquet"
+        tmp_path = path.with_name(path.name + INPROGRESS_SUFFIX)
+        writer = pq.ParquetWriter(str(tmp_path), schema, compression=self._compression)
+        return _OpenFile(key, writer, tmp_path, path)
+
+    def _file_for(self, key: _Key, schema: pa.Schema) -> Tuple[_OpenFile, List[_OpenFile]]:
+        evicted = []
+        with self._lock:
+            f = self._files.get(key)
+            if f is not None:
+                self._files.move_to_end(key)
+                return f, evicted
+            f = self._files[key] = self._open(key, schema)
+            while len(self._files) > self._max_open:
+                _, old = self._files.popitem(last=False)
+                evicted.append(old)
+        return f, evicted
+
+    def append(self, event: str, market: str, table: pa.Table) -> None:
+        key = (_utc_day(), event, market)
+        while True:
+            f, evicted = self._file_for(key, table.schema)
+            for old in evicted:
+                self._finish(old)
+            with f.lock:
+                if f.writer is None:
+                    continue  # net geroteerd door een andere thread: opnieuw openen
+                f.writer.write_table(table)
+                f.nbytes += table.nbytes
+                f.rows += table.num_rows
+                if self._manifest is not None:
+                    _, lo, hi = table_stats(table)
+                    if lo is not None:
+                        f.min_ts = lo if f.min_ts is None else min(f.min_ts, lo)
+                        f.max_ts = hi if f.max_ts is None else max(f.max_ts, hi)
+                full = f.nbytes >= self._rotate_bytes
+            if full:
+                self._rotate(key, f)
+            return
+
+    def _rotate(self, key: _Key, f: _OpenFile) -> None:
+        with self._lock:
+            if self._files.get(key) is f:
+                del self._files[key]
+        self._finish(f)
+
+    def _finish(self, f: _OpenFile) -> None:
+        with f.lock:
+            if f.writer is None:
+                return
+            try:
+                f.writer.close()
+                os.replace(f.tmp_path, f.path)
+            except Exception as e:
+                print(f"[parquet] closing {f.tmp_path} failed: {e}", file=sys.stderr)
+                f.writer = None
+                return
+            f.writer = None
+        if self._manifest is not None:
+            day, event, market = f.key
+            try:
+                self._manifest.add(day, event, [self._manifest.entry_for(f.path, [market], f.rows, f.min_ts, f.max_ts)])
+            except OSError as e:
+                print(f"[parquet] manifest {day}/{event} failed: {e}", file=sys.stderr)
+
+    def maintain(self) -> int:
+        """Close files past ``rotate_secs`` or from a previous day; returns how many."""
+        now = time.monotonic()
+        today = _utc_day()
+        with self._lock:
+            due = [k for k, f in self._files.items() if k[0] != today or now - f.opened >= self._rotate_secs]
+            files = [self._files.pop(k) for k in due]
+        for f in files:
+            self._finish(f)
+        return len(files)
+
+    def open_files(self) -> int:
+        return len(self._files)
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            files = list(self._files.values())
+            self._files.clear()
+        for f in files:
+            self._finish(f)
+
+    def _run(self) -> None:
+        while not self._stop.wait(min(10.0, max(1.0, self._rotate_secs / 10))):
+            self.maintain()
+
+
+__all__ = ["INPROGRESS_SUFFIX", "RollingParquetWriter", "quarantine_inprogress"]
@@ -0,0 +1,248 @@
+"""Typed, column-wise Parquet tables per event family.
+
+Every family has a fixed Arrow schema with numeric prices/amounts and
+millisecond timestamps instead of one JSON ``payload`` string.  Tables are
+built column by column straight from a batch of raw websocket rows (one pass
+over the rows, one ``pa.array`` per column), so there is no per-row dict to
+``from_pylist`` and readers can load single columns without JSON parsing.
+
+Families (the ``event`` name used by the sinks):
+
+``trades``              market, timestamp, id, price, amount, side
+``ticker24h``           market, timestamp, open/high/low/last, volume(s), bid/ask (+size)
+``candles:<interval>``  market, interval, open_time, open, high, low, close, volume
+``orderbook:snapshot``  market, timestamp, nonce, bids/asks as list<struct<price, amount>>
+``orderbook:update``    same as snapshot
+``orderbook:top``       market, timestamp, nonce, best bid/ask (+size), source
+
+Unknown events keep the generic JSON layout (:data:`JSON_SCHEMA`).  Values
+that do not parse become nulls rather than failing the batch.
+"""
+from __future__ import annotations
+
+import datetime as dt
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import orjson as jsonf
+import pyarrow as pa
+
+Row = Mapping[str, object]
+_Column = Tuple[str, pa.DataType, Callable[[Row], object]]
+
+JSON_SCHEMA = pa.schema(
+    [
+        ("ingested_at", pa.timestamp("us")),
+        ("event", pa.string()),
+        ("market", pa.string()),
+        ("payload", pa.string()),
+    ]
+)
+
+# eerste kolom die bestaat is de tijdas van een tabel (sortering, min/max in het manifest)
+TIME_COLUMNS = ("timestamp", "open_time", "ingested_at")
+
+LEVEL = pa.struct([("price", pa.float64()), ("amount", pa.float64())])
+_TS = pa.timestamp("ms")
+
+
+def _float(value: object) -> Optional[float]:
+    try:
+        return float(value)  # Bitvavo levert prijzen/amounts als strings
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value: object) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _str(value: object) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _num(key: str) -> Callable[[Row], object]:
+    return lambda row: _float(row.get(key))
+
+
+def _ts(key: str) -> Callable[[Row], object]:
+    return lambda row: _int(row.get(key))
+
+
+def _text(key: str) -> Callable[[Row], object]:
+    return lambda row: _str(row.get(key))
+
+
+def _candle(i: int, conv: Callable[[object], object]) -> Callable[[Row], object]:
+    def get(row: Row) -> object:
+        c = row.get("candle")
+        return conv(c[i]) if isinstance(c, (list, tuple)) and len(c) > i else None
+    return get
+
+
+def _book_data(row: Row) -> Mapping[str, object]:
+    data = row.get("data")
+    return data if isinstance(data, Mapping) else row
+
+
+_TRADES: List[_Column] = [
+    ("timestamp", _TS, _ts("timestamp")),
+    ("id", pa.string(), _text("id")),
+    ("price", pa.float64(), _num("price")),
+    ("amount", pa.float64(), _num("amount")),
+    ("side", pa.string(), _text("side")),
+]
+
+_TICKER24H: List[_Column] = [
+    ("timestamp", _TS, _ts("timestamp")),
+    ("open", pa.float64(), _num("open")),
+    ("high", pa.float64(), _num("high")),
+    ("low", pa.float64(), _num("low")),
+    ("last", pa.float64(), _num("last")),
+    ("volume", pa.float64(), _num("volume")),
+    ("volume_quote", pa.float64(), _num("volumeQuote")),
+    ("bid", pa.float64(), _num("bid")),
+    ("bid_size", pa.float64(), _num("bidSize")),
+    ("ask", pa.float64(), _num("ask")),
+    ("ask_size", pa.float64(), _num("askSize")),
+    ("open_timestamp", _TS, _ts("openTimestamp")),
+    ("close_timestamp", _TS, _ts("closeTimestamp")),
+]
+
+_CANDLES: List[_Column] = [
+    ("interval", pa.string(), _text("interval")),
+    ("open_time", _TS, _candle(0, _int)),
+    ("open", pa.float64(), _candle(1, _float)),
+    ("high", pa.float64(), _candle(2, _float)),
+    ("low", pa.float64(), _candle(3, _float)),
+    ("close", pa.float64(), _candle(4, _float)),
+    ("volume", pa.float64(), _candle(5, _float)),
+]
+
+_BOOK_HEAD: List[_Column] = [
+    ("timestamp", _TS, _ts("timestamp")),
+    ("nonce", pa.int64(), lambda row: _int(_book_data(row).get("nonce"))),
+]
+
+_TOP: List[_Column] = [
+    ("timestamp", _TS, _ts("timestamp")),
+    ("nonce", pa.int64(), _ts("nonce")),
+    ("best_bid", pa.float64(), _num("bestBid")),
+    ("best_bid_size", pa.float64(), _num("bestBidSize")),
+    ("best_ask", pa.float64(), _num("bestAsk")),
+    ("best_ask_size", pa.float64(), _num("bestAskSize")),
+    ("source", pa.string(), _text("source")),
+]
+
+
+def _schema(columns: Sequence[_Column], extra: Sequence[Tuple[str, pa.DataType]] = ()) -> pa.Schema:
+    head = [("ingested_at", pa.timestamp("us")), ("market", pa.string())]
+    return pa.schema(head + [(n, t) for n, t, _ in columns] + list(extra))
+
+
+_BOOK_SCHEMA = _schema(_BOOK_HEAD, [("bids", pa.list_(LEVEL)), ("asks", pa.list_(LEVEL))])
+
+SCHEMAS: Dict[str, pa.Schema] = {
+    "trades": _schema(_TRADES),
+    "ticker24h": _schema(_TICKER24H),
+    "candles": _schema(_CANDLES),
+    "orderbook:snapshot": _BOOK_SCHEMA,
+    "orderbook:update": _BOOK_SCHEMA,
+    "orderbook:top": _schema(_TOP),
+}
+
+_COLUMNS: Dict[str, List[_Column]] = {
+    "trades": _TRADES,
+    "ticker24h": _TICKER24H,
+    "candles": _CANDLES,
+    "orderbook:snapshot": _BOOK_HEAD,
+    "orderbook:update": _BOOK_HEAD,
+    "orderbook:top": _TOP,
+}
+
+
+def family_of(event: str) -> Optional[str]:
+    """``candles:1m`` -> ``candles``; ``None`` for events without a typed schema."""
+    if event in SCHEMAS:
+        return event
+    family = event.split(":", 1)[0]
+    return family if family == "candles" else None
+
+
+def schema_for(event: str) -> pa.Schema:
+    family = family_of(event)
+    return SCHEMAS[family] if family else JSON_SCHEMA
+
+
+def time_column(schema: pa.Schema) -> Optional[str]:
+    for name in TIME_COLUMNS:
+        if name in schema.names:
+            return name
+    return None
+
+
+def _levels(rows: Sequence[Row], side: str) -> pa.Array:
+    # list<struct> direct uit platte prijs/amount-kolommen + offsets
+    offsets = [0]
+    prices: List[Optional[float]] = []
+    amounts: List[Optional[float]] = []
+    for row in rows:
+        levels = _book_data(row).get(side) or ()
+        for level in levels:
+            if isinstance(level, (list, tuple)) and len(level) >= 2:
+                prices.append(_float(level[0]))
+                amounts.append(_float(level[1]))
+        offsets.append(len(prices))
+    values = pa.StructArray.from_arrays(
+        [pa.array(prices, pa.float64()), pa.array(amounts, pa.float64())], names=["price", "amount"]
+    )
+    return pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), values)
+
+
+def json_table(event: str, market: str, rows: Sequence[Row], ingested_at: Optional[dt.datetime] = None) -> pa.Table:
+    """Generic layout: one JSON ``payload`` string per row."""
+    ingested_at = ingested_at or dt.datetime.utcnow()
+    n = len(rows)
+    return pa.Table.from_arrays(
+        [
+            pa.array([ingested_at] * n, pa.timestamp("us")),
+            pa.array([event] * n, pa.string()),
+            pa.array([market] * n, pa.string()),
+            pa.array([jsonf.dumps(row).decode("utf-8") for row in rows], pa.string()),
+        ],
+        schema=JSON_SCHEMA,
+    )
+
+
+def build_table(event: str, market: str, rows: Sequence[Row], ingested_at: Optional[dt.datetime] = None) -> pa.Table:
+    """Build the typed table for ``event`` (or the JSON fallback) column by column."""
+    ingested_at = ingested_at or dt.datetime.utcnow()
+    family = family_of(event)
+    if family is None:
+        return json_table(event, market, rows, ingested_at)
+    columns = _COLUMNS[family]
+    values: List[List[object]] = [[] for _ in columns]
+    for row in rows:
+        for out, (_, _, get) in zip(values, columns):
+            out.append(get(row))
+    arrays = [pa.array([ingested_at] * len(rows), pa.timestamp("us")), pa.array([market] * len(rows), pa.string())]
+    arrays.extend(pa.array(v, t) for v, (_, t, _) in zip(values, columns))
+    if family.startswith("orderbook:") and family != "orderbook:top":
+        arrays.append(_levels(rows, "bids"))
+        arrays.append(_levels(rows, "asks"))
+    return pa.Table.from_arrays(arrays, schema=SCHEMAS[family])
+
+
+__all__ = [
+    "JSON_SCHEMA",
+    "LEVEL",
+    "SCHEMAS",
+    "TIME_COLUMNS",
+    "build_table",
+    "family_of",
+    "json_table",
+    "schema_for",
+    "time_column",
+]